@@ -1,12 +1,14 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
 import os
 from datetime import datetime
 import json
-from services.email_service import EmailService
-from services.google_sheets_service import GoogleSheetsService
-from services.google_docs_service import GoogleDocsService
-from services.ai_service import AIService
-from services.outreach_agent import OutreachAgent
+import threading
+from services.lead_sources import lead_source_kind
+from services.campaign_bundle import bundle_dir, list_bundles
+from services.result_log import read_result_log, result_log_path
+from services.job_manager import JobManager, FINISHED_STATES
+from services.rate_limiter import limiter_stats
+from services.metrics import REGISTRY as metrics_registry
 import logging
 
 app = Flask(__name__)
@@ -16,12 +18,139 @@ app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-producti
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize services
-email_service = EmailService()
-sheets_service = GoogleSheetsService()
-docs_service = GoogleDocsService()
-ai_service = AIService()
-outreach_agent = OutreachAgent(sheets_service, docs_service, ai_service, email_service)
+# Services are built on first use, so importing the app (a worker boot, a test)
+# loads no credentials, opens no connections and imports no API clients
+_services = {}
+_services_lock = threading.RLock()
+
+
+def _service(name, factory):
+    """Build a service once, on first use, however many request threads ask at the same time"""
+    if name not in _services:
+        with _services_lock:
+            if name not in _services:
+                _services[name] = factory()
+    return _services[name]
+
+
+def get_email_service():
+    """SMTP sender"""
+    from services.email_service import EmailService
+    return _service('email', EmailService)
+
+
+def get_lead_source():
+    """Google Sheets, CSV, Parquet or SQLite, selected by LEAD_SOURCE"""
+    from services.lead_sources import create_lead_source
+    return _service('lead_source', create_lead_source)
+
+
+def get_docs_service():
+    """Knowledge base reader"""
+    from services.google_docs_service import GoogleDocsService
+    return _service('docs', GoogleDocsService)
+
+
+def get_ai_service():
+    """OpenAI email generator"""
+    from services.ai_service import AIService
+    return _service('ai', AIService)
+
+
+def get_send_ledger():
+    """Ledger of past sends so reruns skip rows that were already contacted"""
+    def build():
+        if os.environ.get('SEND_LEDGER_ENABLED', 'true').lower() != 'true':
+            return None
+        from services.send_ledger import SendLedger
+        return SendLedger()
+    return _service('send_ledger', build)
+
+
+def get_checkpoint_store():
+    """Checkpoints so interrupted runs can resume where they stopped"""
+    def build():
+        if os.environ.get('CHECKPOINTS_ENABLED', 'true').lower() != 'true':
+            return None
+        from services.checkpoint_store import CheckpointStore
+        return CheckpointStore()
+    return _service('checkpoints', build)
+
+
+def get_generation_cache():
+    """Cache of generated emails so reruns skip the model for unchanged rows"""
+    def build():
+        if os.environ.get('GENERATION_CACHE_ENABLED', 'true').lower() != 'true':
+            return None
+        from services.generation_cache import GenerationCache
+        return GenerationCache()
+    return _service('generation_cache', build)
+
+
+def get_recipient_validator():
+    """Screens recipient addresses before generation: syntax, disposable domains and, optionally, MX records"""
+    def build():
+        if os.environ.get('RECIPIENT_VALIDATION_ENABLED', 'true').lower() != 'true':
+            return None
+        from services.recipient_validator import create_recipient_validator
+        return create_recipient_validator()
+    return _service('recipient_validator', build)
+
+
+def get_outreach_agent():
+    """Agent wired to the services above, built with them on the first run"""
+    def build():
+        from services.outreach_agent import OutreachAgent
+        return OutreachAgent(
+            get_lead_source(), get_docs_service(), get_ai_service(), get_email_service(),
+            ledger=get_send_ledger(), checkpoints=get_checkpoint_store(),
+            generation_cache=get_generation_cache(), recipient_validator=get_recipient_validator()
+        )
+    return _service('outreach_agent', build)
+
+
+def get_lease_store():
+    """Shared store of campaign shards and leases (SQLite, or Redis across machines)"""
+    from services.lease_store import create_lease_store
+    return _service('lease_store', create_lease_store)
+
+
+def get_campaign_coordinator():
+    """Splits campaigns into shards in the lease store"""
+    from services.campaign_coordinator import CampaignCoordinator
+    return _service('campaign_coordinator', lambda: CampaignCoordinator(get_lease_store()))
+
+
+job_manager = JobManager()
+
+# Held from a row-range check until its job or campaign exists, so two requests cannot both pass
+_row_range_lock = threading.Lock()
+
+
+def _row_range_conflict(start_row, end_row, campaigns=True):
+    """Why rows start_row-end_row cannot be sent to now, or None
+    
+    A range conflicts with an unfinished /api/execute or resume job of this
+    process whose rows overlap it (render jobs send nothing and are left
+    out) and, with ``campaigns``, with a running campaign in the lease store.
+    """
+    for job in job_manager.list():
+        params = job.params
+        if job.status in FINISHED_STATES or 'startRow' not in params or params.get('mode') == 'render':
+            continue
+        if start_row <= params['endRow'] and params['startRow'] <= end_row:
+            return (f"Rows {start_row}-{end_row} overlap job {job.id} "
+                    f"(rows {params['startRow']}-{params['endRow']}, {job.status})")
+    if campaigns:
+        campaign = get_lease_store().overlapping_campaign(start_row, end_row)
+        if campaign:
+            return (f"Rows {start_row}-{end_row} overlap running campaign {campaign['campaign_id']} "
+                    f"(rows {campaign['start_row']}-{campaign['end_row']})")
+    return None
+
+
+# Seconds between keepalive comments on idle event streams
+SSE_HEARTBEAT_SECONDS = 15
 
 
 @app.route('/')
@@ -36,6 +165,7 @@ def get_config():
     config = {
         'google_sheets_document_id': os.environ.get('GOOGLE_SHEETS_DOCUMENT_ID', ''),
         'google_sheets_sheet_id': os.environ.get('GOOGLE_SHEETS_SHEET_ID', ''),
+        'lead_source': lead_source_kind(),
         'google_docs_document_id': os.environ.get('GOOGLE_DOCS_DOCUMENT_ID', ''),
         'smtp_from_email': os.environ.get('SMTP_FROM_EMAIL', ''),
         'openai_model': os.environ.get('OPENAI_MODEL', 'gpt-4o-mini'),
@@ -54,22 +184,37 @@ def update_config():
 
 @app.route('/api/execute', methods=['POST'])
 def execute_workflow():
-    """Execute the outreach workflow"""
+    """Start the outreach workflow as a background job"""
     try:
         data = request.json
         start_row = int(data.get('startRow', 1))
         end_row = int(data.get('endRow', 10))
+        mode = data.get('mode')
         
         logger.info(f"Starting workflow execution: rows {start_row} to {end_row}")
         
-        # Execute the outreach agent
-        results = outreach_agent.execute(start_row, end_row)
+        with _row_range_lock:
+            conflict = None if mode == 'render' else _row_range_conflict(start_row, end_row)
+            if conflict:
+                return jsonify({'status': 'error', 'message': conflict}), 409
+            
+            # Execute the outreach agent in the job worker pool
+            job = job_manager.submit(
+                lambda job: get_outreach_agent().execute(
+                    start_row, end_row, mode=mode,
+                    cancel_event=job.cancel_event,
+                    progress_callback=job.update_results,
+                    event_callback=job.add_event,
+                    run_id=job.id
+                ),
+                params={'startRow': start_row, 'endRow': end_row, 'mode': mode}
+            )
         
         return jsonify({
             'status': 'success',
-            'message': f'Processed {results["processed"]} rows, sent {results["sent"]} emails',
-            'results': results
-        })
+            'message': f'Started job for rows {start_row} to {end_row}',
+            'job_id': job.id
+        }), 202
     except Exception as e:
         logger.error(f"Error executing workflow: {str(e)}")
         return jsonify({
@@ -78,6 +223,266 @@ def execute_workflow():
         }), 500
 
 
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """List background jobs, newest first"""
+    return jsonify({'jobs': [job.to_dict() for job in job_manager.list()]})
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Get the status and (partial) results of a background job"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Stream per-row progress events of a job as Server-Sent Events"""
+    job = job_manager.get(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    
+    # EventSource reconnects send the last id they saw
+    try:
+        last_id = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Last-Event-ID and after must be integers'}), 400
+    
+    def generate():
+        nonlocal last_id
+        while True:
+            events = job.events_after(last_id, timeout=SSE_HEARTBEAT_SECONDS)
+            if not events:
+                if job.finished_at:
+                    # The job ended and its final event is no longer buffered
+                    yield f"data: {json.dumps({'type': 'done', 'status': job.status, 'error': job.error})}\n\n"
+                    return
+                # Comment line keeps proxies from closing an idle stream
+                yield ': keepalive\n\n'
+                continue
+            for event in events:
+                last_id = event['id']
+                yield f"id: {event['id']}\ndata: {json.dumps(event)}\n\n"
+                if event['type'] == 'done':
+                    return
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Cancel a queued or running background job"""
+    job = job_manager.cancel(job_id)
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+    return jsonify({'status': 'success', 'message': 'Cancellation requested', 'job': job.to_dict()})
+
+
+@app.route('/api/runs', methods=['GET'])
+def list_runs():
+    """List checkpointed runs, most recently updated first"""
+    checkpoint_store = get_checkpoint_store()
+    if not checkpoint_store:
+        return jsonify({'status': 'error', 'message': 'Checkpoints are not enabled'}), 400
+    return jsonify({'runs': checkpoint_store.list_runs()})
+
+
+@app.route('/api/runs/<run_id>', methods=['GET'])
+def get_run(run_id):
+    """Get the checkpoint of a run"""
+    checkpoint_store = get_checkpoint_store()
+    if not checkpoint_store:
+        return jsonify({'status': 'error', 'message': 'Checkpoints are not enabled'}), 400
+    checkpoint = checkpoint_store.get_run(run_id)
+    if not checkpoint:
+        return jsonify({'status': 'error', 'message': 'Run not found'}), 404
+    return jsonify(checkpoint)
+
+
+@app.route('/api/runs/<run_id>/resume', methods=['POST'])
+def resume_run(run_id):
+    """Resume an interrupted run from its checkpoint as a background job"""
+    checkpoint_store = get_checkpoint_store()
+    if not checkpoint_store:
+        return jsonify({'status': 'error', 'message': 'Checkpoints are not enabled'}), 400
+    checkpoint = checkpoint_store.get_run(run_id)
+    if not checkpoint:
+        return jsonify({'status': 'error', 'message': 'Run not found'}), 404
+    if checkpoint['status'] == 'completed':
+        return jsonify({'status': 'error', 'message': 'Run already completed'}), 400
+    
+    with _row_range_lock:
+        # Only the rows after the checkpoint are still to be sent
+        start_row = max(checkpoint['start_row'], (checkpoint['last_completed_row'] or 0) + 1)
+        end_row = checkpoint['end_row']
+        conflict = None if checkpoint['mode'] == 'render' else _row_range_conflict(start_row, end_row)
+        if conflict:
+            return jsonify({'status': 'error', 'message': conflict}), 409
+        
+        job = job_manager.submit(
+            lambda job: get_outreach_agent().resume(
+                run_id,
+                cancel_event=job.cancel_event,
+                progress_callback=job.update_results,
+                event_callback=job.add_event
+            ),
+            params={'resume': run_id, 'startRow': start_row, 'endRow': end_row, 'mode': checkpoint['mode']}
+        )
+    
+    return jsonify({
+        'status': 'success',
+        'message': f'Resuming run {run_id} after row {checkpoint["last_completed_row"]}',
+        'job_id': job.id
+    }), 202
+
+
+@app.route('/api/results/<log_id>', methods=['GET'])
+def get_result_log(log_id):
+    """Page through every row outcome and error of a run, as written to its result log
+    
+    ``cursor`` is the ``next_cursor`` of the previous page (0 for the first),
+    ``limit`` the page size and ``status`` an optional filter such as 'error'.
+    """
+    path = result_log_path(log_id)
+    if log_id != os.path.basename(log_id) or not os.path.isfile(path):
+        return jsonify({'status': 'error', 'message': 'Result log not found'}), 404
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'cursor and limit must be integers'}), 400
+    
+    page = read_result_log(path, cursor=max(0, cursor), limit=limit, status=request.args.get('status'))
+    page['id'] = log_id
+    return jsonify(page)
+
+
+@app.route('/api/bundles', methods=['GET'])
+def get_bundles():
+    """List the campaign bundles written by 'render' runs, newest first"""
+    return jsonify({'bundles': list_bundles()})
+
+
+@app.route('/api/bundles/<bundle_id>/send', methods=['POST'])
+def send_bundle(bundle_id):
+    """Deliver the drafts of a campaign bundle as a background job, without generating anything"""
+    path = os.path.join(bundle_dir(), bundle_id)
+    if bundle_id != os.path.basename(bundle_id) or bundle_id in ('.', '..') or not os.path.isdir(path):
+        return jsonify({'status': 'error', 'message': 'Bundle not found'}), 404
+    
+    job = job_manager.submit(
+        lambda job: get_outreach_agent().send_bundle(
+            path,
+            cancel_event=job.cancel_event,
+            progress_callback=job.update_results,
+            event_callback=job.add_event
+        ),
+        params={'bundle': bundle_id}
+    )
+    
+    return jsonify({
+        'status': 'success',
+        'message': f'Sending bundle {bundle_id}',
+        'job_id': job.id
+    }), 202
+
+
+def _submit_shard_worker(campaign_id):
+    """Start a background job that works on a campaign's shards from this process"""
+    from services.campaign_coordinator import ShardWorker
+    return job_manager.submit(
+        lambda job: ShardWorker(get_outreach_agent(), get_lease_store()).run(
+            campaign_id,
+            cancel_event=job.cancel_event,
+            progress_callback=job.update_results,
+            event_callback=job.add_event
+        ),
+        params={'campaign': campaign_id}
+    )
+
+
+@app.route('/api/campaigns', methods=['POST'])
+def create_campaign():
+    """Split a row range into leased shards and start workers on them in this process
+    
+    ``workers`` (default 1) is the number of local worker jobs; 0 only
+    creates the campaign, for workers started elsewhere with
+    POST /api/campaigns/<campaign_id>/work.
+    """
+    try:
+        data = request.json or {}
+        start_row = int(data.get('startRow', 1))
+        end_row = int(data.get('endRow', 10))
+        workers = int(data.get('workers', 1))
+        shard_size = data.get('shardSize')
+        with _row_range_lock:
+            # Running campaigns are checked by the lease store itself, atomically with the insert
+            conflict = _row_range_conflict(start_row, end_row, campaigns=False)
+            if conflict:
+                return jsonify({'status': 'error', 'message': conflict}), 409
+            campaign = get_campaign_coordinator().create(
+                start_row, end_row, mode=data.get('mode'), shard_size=int(shard_size) if shard_size else None
+            )
+    except Exception as e:
+        logger.error(f"Error creating campaign: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    job_ids = [_submit_shard_worker(campaign['campaign_id']).id for _ in range(max(0, workers))]
+    return jsonify({
+        'status': 'success',
+        'message': f"Created campaign for rows {start_row} to {end_row} in {len(campaign['shards'])} shards",
+        'campaign_id': campaign['campaign_id'],
+        'job_ids': job_ids
+    }), 202
+
+
+@app.route('/api/campaigns', methods=['GET'])
+def list_campaigns():
+    """Campaigns in the lease store, newest first"""
+    return jsonify({'campaigns': get_campaign_coordinator().list(int(request.args.get('limit', 50)))})
+
+
+@app.route('/api/campaigns/<campaign_id>', methods=['GET'])
+def get_campaign(campaign_id):
+    """A campaign's shards, their leases and the summed row counts"""
+    campaign = get_campaign_coordinator().status(campaign_id)
+    if not campaign:
+        return jsonify({'status': 'error', 'message': 'Campaign not found'}), 404
+    return jsonify(campaign)
+
+
+@app.route('/api/campaigns/<campaign_id>/work', methods=['POST'])
+def work_on_campaign(campaign_id):
+    """Start one more worker on a campaign from this process, e.g. on another machine sharing the lease store"""
+    if not get_lease_store().get_campaign(campaign_id):
+        return jsonify({'status': 'error', 'message': 'Campaign not found'}), 404
+    job = _submit_shard_worker(campaign_id)
+    return jsonify({
+        'status': 'success',
+        'message': f'Started worker on campaign {campaign_id}',
+        'job_id': job.id
+    }), 202
+
+
+@app.route('/api/rate-limits', methods=['GET'])
+def rate_limits():
+    """Per-service rate limits with call, retry and throttling counters since startup"""
+    return jsonify({'services': limiter_stats()})
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Call timings, errors, tokens and throttling in the Prometheus text format"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route('/api/test-email', methods=['POST'])
 def test_email():
     """Test email sending"""
@@ -87,7 +492,7 @@ def test_email():
         subject = data.get('subject', 'Test Email')
         body = data.get('body', 'This is a test email')
         
-        email_service.send_email(to_email, subject, body)
+        get_email_service().send_email(to_email, subject, body)
         
         return jsonify({'status': 'success', 'message': 'Test email sent'})
     except Exception as e:
@@ -104,18 +509,20 @@ def validate_connection():
         
         results = {}
         
-        if service == 'google_sheets' or service == 'all':
+        if service in ('google_sheets', 'lead_source', 'all'):
+            # The dashboard's Google Sheets check covers whichever lead source is configured
+            key = 'lead_source' if service == 'lead_source' else 'google_sheets'
             try:
-                # Test Google Sheets connection
-                sheets_service.test_connection()
-                results['google_sheets'] = {'status': 'success'}
+                # Test lead source connection
+                get_lead_source().test_connection()
+                results[key] = {'status': 'success'}
             except Exception as e:
-                results['google_sheets'] = {'status': 'error', 'message': str(e)}
+                results[key] = {'status': 'error', 'message': str(e)}
         
         if service == 'google_docs' or service == 'all':
             try:
                 # Test Google Docs connection
-                docs_service.test_connection()
+                get_docs_service().test_connection()
                 results['google_docs'] = {'status': 'success'}
             except Exception as e:
                 results['google_docs'] = {'status': 'error', 'message': str(e)}
@@ -123,7 +530,7 @@ def validate_connection():
         if service == 'openai' or service == 'all':
             try:
                 # Test OpenAI connection
-                ai_service.test_connection()
+                get_ai_service().test_connection()
                 results['openai'] = {'status': 'success'}
             except Exception as e:
                 results['openai'] = {'status': 'error', 'message': str(e)}
@@ -131,7 +538,7 @@ def validate_connection():
         if service == 'smtp' or service == 'all':
             try:
                 # Test SMTP connection
-                email_service.test_connection()
+                get_email_service().test_connection()
                 results['smtp'] = {'status': 'success'}
             except Exception as e:
                 results['smtp'] = {'status': 'error', 'message': str(e)}
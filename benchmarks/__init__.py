@@ -0,0 +1 @@
+# Offline benchmarks run against the local stand-ins in fakes/
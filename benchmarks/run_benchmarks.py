@@ -0,0 +1,231 @@
+"""
+Offline throughput benchmark for OutreachAgent
+
+Runs OutreachAgent.execute against local stand-ins only: in-process Sheets
+and Docs stubs, the fake OpenAI API (fakes.openai_server) and an SMTP sink
+(fakes.smtp_sink). The real AIService and EmailService are used, so HTTP,
+SMTP, pooling, rate limiting, the send ledger and checkpoints are all on
+the measured path. Each row count runs in its own process so peak RSS is
+per run.
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --rows 100,1000 --mode sequential --openai-latency 0.2
+    python -m benchmarks.run_benchmarks --save benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json --tolerance 0.2
+
+With --baseline the exit status is 1 when throughput dropped or peak RSS grew
+by more than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+STAGES = ('fetch', 'generate', 'send')
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where unsupported"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def run_worker(args) -> dict:
+    """Run one benchmark in this process and return its measurements"""
+    logging.basicConfig(level=logging.ERROR)
+    
+    from fakes.google_services import FakeSheetsService, FakeDocsService, generate_rows
+    from services.ai_service import AIService
+    from services.email_service import EmailService
+    from services.outreach_agent import OutreachAgent
+    from services.send_ledger import SendLedger
+    from services.checkpoint_store import CheckpointStore
+    from services.generation_cache import GenerationCache
+    
+    sheets = FakeSheetsService(generate_rows(args.worker), latency=args.sheets_latency)
+    docs = FakeDocsService()
+    
+    # Stores, batch files, bundles and result logs go to a scratch directory removed after the run
+    work_dir = tempfile.mkdtemp(prefix='outreach-bench-')
+    os.environ['OUTREACH_BATCH_DIR'] = os.path.join(work_dir, 'batches')
+    os.environ['OUTREACH_BUNDLE_DIR'] = os.path.join(work_dir, 'bundles')
+    os.environ['OUTREACH_RESULT_LOG_DIR'] = os.path.join(work_dir, 'result_logs')
+    ledger = checkpoints = generation_cache = None
+    if not args.no_stores:
+        ledger = SendLedger(os.path.join(work_dir, 'send_ledger.db'))
+        checkpoints = CheckpointStore(os.path.join(work_dir, 'checkpoints.db'))
+        # Starts empty, so every row is a miss and the run measures the cache's overhead
+        generation_cache = GenerationCache(os.path.join(work_dir, 'generation_cache.db'))
+    
+    agent = OutreachAgent(
+        sheets, docs, AIService(), EmailService(),
+        ledger=ledger, checkpoints=checkpoints, generation_cache=generation_cache
+    )
+    
+    started = time.perf_counter()
+    try:
+        results = agent.execute(2, args.worker + 1, mode=args.mode)
+    finally:
+        elapsed = time.perf_counter() - started
+        if ledger:
+            ledger.close()
+            checkpoints.close()
+            generation_cache.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    stages = results.get('metrics', {}).get('stages', {})
+    return {
+        'rows': args.worker,
+        'mode': args.mode,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(args.worker / elapsed, 2) if elapsed > 0 else 0.0,
+        'sent': results['sent'],
+        'skipped': results['skipped'],
+        'errors': results['error_count'],
+        'stages': {
+            stage: {
+                'p50_seconds': stages[stage]['p50_seconds'],
+                'p99_seconds': stages[stage]['p99_seconds'],
+                'total_seconds': stages[stage]['total_seconds']
+            }
+            for stage in STAGES if stage in stages
+        },
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def run_size(args, rows: int, openai_url: str, smtp_port: int) -> dict:
+    """Run one row count in a child process pointed at the local fakes"""
+    env = dict(os.environ)
+    env.update({
+        'OPENAI_API_KEY': 'benchmark',
+        'OPENAI_BASE_URL': openai_url,
+        'OPENAI_BATCH_POLL_INTERVAL': '0.2',
+        'SMTP_HOST': '127.0.0.1',
+        'SMTP_PORT': str(smtp_port),
+        'SMTP_USER': 'benchmark',
+        'SMTP_PASSWORD': 'benchmark',
+        'SMTP_STARTTLS': 'false',
+        'RETRY_BASE_DELAY': '0.1'
+    })
+    command = [
+        sys.executable, '-m', 'benchmarks.run_benchmarks',
+        '--worker', str(rows),
+        '--mode', args.mode,
+        '--sheets-latency', str(args.sheets_latency)
+    ]
+    if args.no_stores:
+        command.append('--no-stores')
+    
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run(command, env=env, cwd=project_root, capture_output=True, text=True)
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Benchmark for {rows} rows failed:\n{completed.stderr[-2000:]}")
+
+
+def print_table(results: list):
+    """Human-readable summary of the runs"""
+    header = f"{'rows':>7} {'mode':<11} {'rows/s':>9} {'sent':>6} {'errors':>6} {'peak MB':>8}"
+    for stage in STAGES:
+        header += f" {stage + ' p50/p99 ms':>22}"
+    print(header)
+    for result in results:
+        line = (
+            f"{result['rows']:>7} {result['mode']:<11} {result['rows_per_second']:>9.1f} "
+            f"{result['sent']:>6} {result['errors']:>6} {result['peak_rss_mb'] or 0:>8.1f}"
+        )
+        for stage in STAGES:
+            timing = result['stages'].get(stage)
+            cell = f"{timing['p50_seconds'] * 1000:.1f}/{timing['p99_seconds'] * 1000:.1f}" if timing else '-'
+            line += f" {cell:>22}"
+        print(line)
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """Regressions against a saved baseline, as readable messages"""
+    previous = {(entry['mode'], entry['rows']): entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['mode'], result['rows']))
+        if not before:
+            continue
+        if result['rows_per_second'] < before['rows_per_second'] * (1 - tolerance):
+            regressions.append(
+                f"{result['rows']} rows ({result['mode']}): {result['rows_per_second']} rows/s "
+                f"vs {before['rows_per_second']} in baseline"
+            )
+        if result['peak_rss_mb'] and before.get('peak_rss_mb') and \
+                result['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(
+                f"{result['rows']} rows ({result['mode']}): peak RSS {result['peak_rss_mb']} MB "
+                f"vs {before['peak_rss_mb']} MB in baseline"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark OutreachAgent against local fakes')
+    parser.add_argument('--rows', default='100,1000,10000', help='Comma-separated row counts')
+    parser.add_argument('--mode', default='concurrent', choices=('sequential', 'concurrent', 'batch', 'async', 'render'))
+    parser.add_argument('--openai-latency', type=float, default=0.05, help='Seconds per fake completion')
+    parser.add_argument('--openai-error-rate', type=float, default=0.0, help='Fraction of completions answered with 429')
+    parser.add_argument('--smtp-latency', type=float, default=0.005, help='Seconds per accepted message')
+    parser.add_argument('--sheets-latency', type=float, default=0.05, help='Seconds per Sheets range read')
+    parser.add_argument('--no-stores', action='store_true', help='Run without the send ledger, checkpoints and generation cache')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against results saved with --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        print(RESULT_PREFIX + json.dumps(run_worker(args)))
+        return 0
+    
+    from fakes.openai_server import FakeOpenAIServer
+    from fakes.smtp_sink import SMTPSink
+    
+    openai_server = FakeOpenAIServer(latency=args.openai_latency, error_rate=args.openai_error_rate, seed=1)
+    smtp_sink = SMTPSink(latency=args.smtp_latency)
+    openai_url = openai_server.start()
+    smtp_port = smtp_sink.start()
+    
+    results = []
+    try:
+        for rows in [int(value) for value in args.rows.split(',') if value.strip()]:
+            print(f"Running {rows} rows ({args.mode})...", file=sys.stderr)
+            results.append(run_size(args, rows, openai_url, smtp_port))
+    finally:
+        openai_server.stop()
+        smtp_sink.stop()
+    
+    print_table(results)
+    
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION: {message}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
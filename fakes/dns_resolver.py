@@ -0,0 +1,36 @@
+"""
+Local stand-in for DNSResolver, answering MX lookups from a table
+
+Pass it to RecipientValidator to exercise the MX check without a network:
+
+    RecipientValidator(resolver=StubResolver({'bounce.example': []}, latency=0.02))
+
+Domains missing from the table accept mail unless ``default_hosts`` is
+empty, and those listed in ``failing`` raise as a timed-out lookup would.
+"""
+import time
+import threading
+from typing import Dict, Iterable, List
+
+
+class StubResolver:
+    """Answers mail_hosts() from a dict of domain to hosts, counting the lookups per domain"""
+    
+    def __init__(self, records: Dict[str, List[str]] = None, default_hosts: List[str] = None,
+                 failing: Iterable[str] = (), latency: float = 0.0):
+        self.records = dict(records or {})
+        self.default_hosts = ['mx.stub.invalid'] if default_hosts is None else list(default_hosts)
+        self.failing = set(failing)
+        self.latency = latency
+        self.lookups = {}
+        self._lock = threading.Lock()
+    
+    def mail_hosts(self, domain: str) -> List[str]:
+        """Hosts of ``domain`` from the table, after the configured latency"""
+        with self._lock:
+            self.lookups[domain] = self.lookups.get(domain, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if domain in self.failing:
+            raise Exception(f"DNS lookup of {domain} timed out")
+        return list(self.records.get(domain, self.default_hosts))
@@ -0,0 +1,142 @@
+"""
+In-process stand-ins for GoogleSheetsService and GoogleDocsService
+
+They expose the same methods the agent uses, backed by generated rows and a
+fixed knowledge base, with optional per-call latency to mimic the API.
+"""
+import time
+import random
+import asyncio
+from typing import Iterator, List, Tuple
+
+from services.lead_sources import LeadSource
+
+HEADERS = ['company_name', 'website', 'industry', 'city', 'contact_name', 'email_to_use', 'notes']
+
+INDUSTRIES = ['Logistics', 'Dental clinics', 'Accounting', 'E-commerce', 'Real estate', 'Manufacturing']
+CITIES = ['Austin', 'Leeds', 'Toronto', 'Melbourne', 'Dublin', 'Denver']
+
+KNOWLEDGE_BASE = """We build AI automations for small and mid-sized businesses.
+
+Services:
+- Lead qualification agents that answer inbound enquiries around the clock
+- Invoice and document processing with human review for exceptions
+- CRM hygiene: deduplication, enrichment and follow-up reminders
+- Reporting dashboards fed from existing spreadsheets
+
+Typical results: 10-20 hours saved per week per team, replies to leads in
+under a minute, fewer data-entry errors.
+"""
+
+
+def generate_rows(count: int, seed: int = 42, invalid_every: int = 50, empty_every: int = 0) -> List[List[str]]:
+    """Deterministic sheet rows (without the header), with some invalid or empty ones"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(1, count + 1):
+        if empty_every and i % empty_every == 0:
+            rows.append([])
+            continue
+        company = f"Company {i:05d}"
+        email = f"owner{i}@company{i:05d}.example" if not (invalid_every and i % invalid_every == 0) else 'n/a'
+        rows.append([
+            company,
+            f"https://company{i:05d}.example",
+            rng.choice(INDUSTRIES),
+            rng.choice(CITIES),
+            f"Contact {i}",
+            email,
+            rng.choice(['', 'Uses spreadsheets for everything', 'Hiring an ops manager', 'Recently expanded'])
+        ])
+    return rows
+
+
+class FakeSheetsService(LeadSource):
+    """Serves generated rows the way GoogleSheetsService does; row 1 is the header"""
+    
+    kind = 'sheets'
+    
+    def __init__(self, rows: List[List[str]], headers: List[str] = None, latency: float = 0.0, chunk_size: int = 200):
+        self.document_id = 'fake-sheet'
+        self.headers = headers or HEADERS
+        self.rows = rows
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.calls = 0
+    
+    def _read(self, first_row: int, last_row: int) -> List[List[str]]:
+        """One simulated values().get over a 1-based, inclusive row range"""
+        if self.latency:
+            time.sleep(self.latency)
+        return self._values(first_row, last_row)
+    
+    async def _read_async(self, first_row: int, last_row: int) -> List[List[str]]:
+        """_read for coroutines, awaiting the latency"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._values(first_row, last_row)
+    
+    def _values(self, first_row: int, last_row: int) -> List[List[str]]:
+        self.calls += 1
+        values = []
+        for row_index in range(first_row, last_row + 1):
+            if row_index == 1:
+                values.append(list(self.headers))
+            elif row_index - 2 < len(self.rows):
+                values.append(self.rows[row_index - 2])
+            else:
+                values.append([])
+        return values
+    
+    def test_connection(self):
+        return True
+    
+    def get_row_by_index(self, row_index: int) -> dict:
+        return self._row_to_dict(self.headers, self._read(row_index, row_index)[0])
+    
+    def get_rows(self, start_row: int, end_row: int, chunk_size: int = None) -> Iterator[Tuple[int, dict]]:
+        """Header read plus one simulated read per chunk, like GoogleSheetsService.get_rows"""
+        chunk_size = chunk_size or self.chunk_size
+        self._read(1, 1)
+        for chunk_start in range(start_row, end_row + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_row)
+            for offset, values in enumerate(self._read(chunk_start, chunk_end)):
+                yield chunk_start + offset, self._row_to_dict(self.headers, values)
+    
+    async def get_rows_async(self, start_row: int, end_row: int, chunk_size: int = None):
+        """get_rows for asyncio, like GoogleSheetsService.get_rows_async"""
+        chunk_size = chunk_size or self.chunk_size
+        await self._read_async(1, 1)
+        for chunk_start in range(start_row, end_row + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_row)
+            for offset, values in enumerate(await self._read_async(chunk_start, chunk_end)):
+                yield chunk_start + offset, self._row_to_dict(self.headers, values)
+
+
+class FakeDocsService:
+    """Returns a fixed knowledge base the way GoogleDocsService does"""
+    
+    def __init__(self, text: str = KNOWLEDGE_BASE, latency: float = 0.0):
+        self.document_id = 'fake-doc'
+        self.revision_id = 'fake-revision-1'
+        self.text = text
+        self.latency = latency
+    
+    def test_connection(self):
+        return True
+    
+    def get_revision_id(self) -> str:
+        return self.revision_id
+    
+    def get_document(self) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.text
+    
+    async def get_document_async(self) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.text
+    
+    async def aclose(self):
+        pass
@@ -0,0 +1,386 @@
+"""
+Local fake of the OpenAI endpoints used by AIService
+
+Serves chat completions (plain or streamed), file uploads and the Batch API from memory so
+generation can be exercised without network access or API costs. Point the
+app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1 and any API key.
+
+    python -m fakes.openai_server --port 8765 --latency 0.2 --error-rate 0.05
+"""
+import re
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Providers only cache prompt prefixes of at least this many tokens, in 128-token steps
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+
+EMAIL_PATTERN = re.compile(r'"email_to_use":\s*"([^"]*)"')
+COMPANY_PATTERN = re.compile(r'"(?:company_name|CompanyName|company)":\s*"([^"]*)"')
+# Row numbers of a multi-lead prompt, which asks for an "emails" array
+ROW_PATTERN = re.compile(r'"row":\s*(\d+)')
+
+# Characters of content per chunk of a streamed completion
+STREAM_CHUNK_CHARS = 16
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token)"""
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAIServer:
+    """In-process HTTP server speaking enough of the OpenAI API for AIService"""
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 error_rate: float = 0.0, batch_delay: float = 0.0, seed: int = None,
+                 stream_delay: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # Seconds between the chunks of a streamed completion
+        self.stream_delay = stream_delay
+        self.error_rate = error_rate
+        self.batch_delay = batch_delay
+        self.random = random.Random(seed)
+        self.files = {}
+        self.batches = {}
+        self.seen_prefixes = set()
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._httpd = None
+        self._thread = None
+    
+    @property
+    def base_url(self) -> str:
+        """Value for OPENAI_BASE_URL"""
+        return f"http://{self.host}:{self.port}/v1"
+    
+    def start(self) -> str:
+        """Serve in a background thread and return the base URL"""
+        server = self
+        
+        class Handler(FakeOpenAIHandler):
+            fake = server
+        
+        self._httpd = _ThreadingServer((self.host, self.port), Handler)
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.base_url
+    
+    def stop(self):
+        """Shut the server down"""
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+    
+    def should_fail(self) -> bool:
+        """Whether to answer this request with a 429"""
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+    
+    def complete(self, body: dict) -> dict:
+        """Build a chat.completion for a request body"""
+        messages = body.get('messages', [])
+        system = next((m['content'] for m in messages if m['role'] == 'system'), '')
+        user = messages[-1]['content'] if messages else ''
+        
+        rows = list(ROW_PATTERN.finditer(user))
+        if '"emails"' in user and rows:
+            # One email per row, each built from the text between its row number and the next
+            emails = []
+            for position, match in enumerate(rows):
+                end = rows[position + 1].start() if position + 1 < len(rows) else len(user)
+                emails.append(dict(self.write_email(user[match.end():end]), row=int(match.group(1))))
+            content = json.dumps({'emails': emails})
+        else:
+            content = json.dumps(self.write_email(user))
+        
+        prompt_tokens = estimate_tokens(system) + estimate_tokens(user)
+        prefix_tokens = estimate_tokens(system)
+        with self.lock:
+            self.requests += 1
+            cached = system in self.seen_prefixes
+            self.seen_prefixes.add(system)
+        cached_tokens = 0
+        if cached and prefix_tokens >= CACHE_MIN_TOKENS:
+            cached_tokens = prefix_tokens - prefix_tokens % CACHE_STEP_TOKENS
+        
+        completion_tokens = estimate_tokens(content)
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake-model'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens,
+                'prompt_tokens_details': {'cached_tokens': cached_tokens}
+            }
+        }
+    
+    @staticmethod
+    def write_email(text: str) -> dict:
+        """Email for the company whose data appears in ``text``"""
+        email_match = EMAIL_PATTERN.search(text)
+        company_match = COMPANY_PATTERN.search(text)
+        to = email_match.group(1) if email_match else 'unknown@example.com'
+        company = company_match.group(1) if company_match else 'your company'
+        return {
+            'to': to,
+            'subject': f"Quick idea for {company}",
+            'emailBody': f"<p>Hi,</p><p>I came across {company} and noticed a few areas we could automate.</p>"
+        }
+    
+    def add_file(self, data: bytes, filename: str, purpose: str) -> dict:
+        """Store an uploaded file and return its file object"""
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        file_object = {
+            'id': file_id,
+            'object': 'file',
+            'bytes': len(data),
+            'created_at': int(time.time()),
+            'filename': filename,
+            'purpose': purpose,
+            'status': 'processed'
+        }
+        with self.lock:
+            self.files[file_id] = (file_object, data)
+        return file_object
+    
+    def create_batch(self, body: dict) -> dict:
+        """Run every request of the input file now and publish the output after batch_delay"""
+        _, data = self.files[body['input_file_id']]
+        output_lines = []
+        counts = {'total': 0, 'completed': 0, 'failed': 0}
+        for line in data.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            counts['total'] += 1
+            if self.should_fail():
+                counts['failed'] += 1
+                output_lines.append({
+                    'id': f"batch_req_{uuid.uuid4().hex[:24]}",
+                    'custom_id': request['custom_id'],
+                    'response': {'status_code': 500, 'body': {'error': {'message': 'Simulated failure'}}},
+                    'error': None
+                })
+                continue
+            counts['completed'] += 1
+            output_lines.append({
+                'id': f"batch_req_{uuid.uuid4().hex[:24]}",
+                'custom_id': request['custom_id'],
+                'response': {'status_code': 200, 'request_id': uuid.uuid4().hex, 'body': self.complete(request['body'])},
+                'error': None
+            })
+        
+        output = '\n'.join(json.dumps(line) for line in output_lines).encode('utf-8')
+        output_file = self.add_file(output, 'batch_output.jsonl', 'batch_output')
+        
+        now = int(time.time())
+        batch = {
+            'id': f"batch_{uuid.uuid4().hex[:24]}",
+            'object': 'batch',
+            'endpoint': body['endpoint'],
+            'input_file_id': body['input_file_id'],
+            'completion_window': body.get('completion_window', '24h'),
+            'status': 'in_progress',
+            'output_file_id': None,
+            'error_file_id': None,
+            'created_at': now,
+            'request_counts': counts,
+            '_ready_at': time.monotonic() + self.batch_delay,
+            '_output_file_id': output_file['id']
+        }
+        with self.lock:
+            self.batches[batch['id']] = batch
+        return self.batch_view(batch['id'])
+    
+    def batch_view(self, batch_id: str) -> dict:
+        """Public view of a batch, completing it once its delay has passed"""
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch['status'] == 'in_progress' and time.monotonic() >= batch['_ready_at']:
+                batch['status'] = 'completed'
+                batch['output_file_id'] = batch['_output_file_id']
+                batch['completed_at'] = int(time.time())
+            return {key: value for key, value in batch.items() if not key.startswith('_')}
+    
+    def cancel_batch(self, batch_id: str) -> dict:
+        """Cancel a batch that has not completed yet"""
+        with self.lock:
+            batch = self.batches[batch_id]
+            if batch['status'] == 'in_progress':
+                batch['status'] = 'cancelled'
+        return self.batch_view(batch_id)
+
+
+class _ThreadingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for hundreds of clients connecting at once (async runs)
+    request_queue_size = 1024
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Routes requests to the FakeOpenAIServer bound as ``fake``"""
+    
+    fake = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send_json(self, payload: dict, status: int = 200, headers: dict = None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_error(self, status: int, message: str, headers: dict = None):
+        self._send_json({'error': {'message': message, 'type': 'fake_error'}}, status, headers)
+    
+    def _send_stream(self, request: dict, completion: dict):
+        """Send a completion as server-sent chat.completion.chunk events, then [DONE]"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        
+        base = {key: completion[key] for key in ('id', 'created', 'model')}
+        base['object'] = 'chat.completion.chunk'
+        content = completion['choices'][0]['message']['content']
+        events = [dict(base, choices=[{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}])]
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            piece = content[start:start + STREAM_CHUNK_CHARS]
+            events.append(dict(base, choices=[{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]))
+        events.append(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+        if (request.get('stream_options') or {}).get('include_usage'):
+            events.append(dict(base, choices=[], usage=completion['usage']))
+        
+        try:
+            for event in events:
+                if self.fake.stream_delay:
+                    time.sleep(self.fake.stream_delay)
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading, as AIService does when it aborts a bad answer
+            pass
+    
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+    
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        body = self._read_body()
+        
+        if path == '/v1/chat/completions':
+            if self.fake.latency:
+                time.sleep(self.fake.latency)
+            if self.fake.should_fail():
+                self._send_error(429, 'Rate limit reached (simulated)', {'Retry-After': '1'})
+                return
+            request = json.loads(body)
+            if request.get('stream'):
+                self._send_stream(request, self.fake.complete(request))
+            else:
+                self._send_json(self.fake.complete(request))
+        elif path == '/v1/files':
+            message = BytesParser(policy=default_policy).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + body
+            )
+            data, filename, purpose = b'', 'upload.jsonl', 'batch'
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if name == 'file':
+                    data = part.get_payload(decode=True)
+                    filename = part.get_filename() or filename
+                elif name == 'purpose':
+                    purpose = part.get_content().strip()
+            self._send_json(self.fake.add_file(data, filename, purpose))
+        elif path == '/v1/batches':
+            request = json.loads(body)
+            if request.get('input_file_id') not in self.fake.files:
+                self._send_error(404, 'No such file')
+                return
+            self._send_json(self.fake.create_batch(request))
+        elif path.startswith('/v1/batches/') and path.endswith('/cancel'):
+            batch_id = path[len('/v1/batches/'):-len('/cancel')]
+            if batch_id not in self.fake.batches:
+                self._send_error(404, 'No such batch')
+                return
+            self._send_json(self.fake.cancel_batch(batch_id))
+        else:
+            self._send_error(404, f"Unknown endpoint {path}")
+    
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        
+        if path.startswith('/v1/files/') and path.endswith('/content'):
+            file_id = path[len('/v1/files/'):-len('/content')]
+            if file_id not in self.fake.files:
+                self._send_error(404, 'No such file')
+                return
+            _, data = self.fake.files[file_id]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif path.startswith('/v1/files/'):
+            file_id = path[len('/v1/files/'):]
+            if file_id not in self.fake.files:
+                self._send_error(404, 'No such file')
+                return
+            self._send_json(self.fake.files[file_id][0])
+        elif path.startswith('/v1/batches/'):
+            batch_id = path[len('/v1/batches/'):]
+            if batch_id not in self.fake.batches:
+                self._send_error(404, 'No such batch')
+                return
+            self._send_json(self.fake.batch_view(batch_id))
+        else:
+            self._send_error(404, f"Unknown endpoint {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake OpenAI API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every chat completion')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--batch-delay', type=float, default=0.0, help='Seconds before a batch completes')
+    parser.add_argument('--stream-delay', type=float, default=0.0, help='Seconds between streamed chunks')
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer(args.host, args.port, args.latency, args.error_rate, args.batch_delay,
+                              stream_delay=args.stream_delay)
+    print(f"Fake OpenAI API listening on {server.start()}")
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Local SMTP sink that accepts and discards every message
+
+Speaks just enough SMTP for EmailService with SMTP_STARTTLS=false: EHLO,
+AUTH PLAIN/LOGIN (any credentials), MAIL, RCPT, DATA, RSET, NOOP and QUIT.
+Standard library only, so benchmarks run without extra packages. drop()
+makes the next sessions hang up at a chosen command, for testing how
+clients handle a lost connection.
+
+    python -m fakes.smtp_sink --port 8025 --latency 0.05
+"""
+import time
+import argparse
+import threading
+import socketserver
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class SMTPSink:
+    """Threaded SMTP server counting the messages it receives"""
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.messages = 0
+        self.bytes = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        # Command (MAIL or DATA) -> sessions still to hang up on when they reach it
+        self._drops = {}
+        self._server = None
+        self._thread = None
+    
+    def start(self) -> int:
+        """Serve in a background thread and return the port"""
+        server = self
+        
+        class Handler(SMTPSinkHandler):
+            sink = server
+        
+        self._server = _ThreadingServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.port
+    
+    def stop(self):
+        """Shut the server down"""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+    
+    def drop(self, verb: str, count: int = 1):
+        """Close the next ``count`` connections that send ``verb`` instead of replying
+        
+        For MAIL the message is never received; for DATA it is received and
+        counted, and the connection closes before the final reply, as when a
+        server accepts a message and the link fails before it can say so.
+        """
+        with self.lock:
+            self._drops[verb.upper()] = count
+    
+    def should_drop(self, verb: str) -> bool:
+        """Whether this session hangs up at ``verb``, using up one scheduled drop"""
+        with self.lock:
+            if self._drops.get(verb, 0) > 0:
+                self._drops[verb] -= 1
+                return True
+            return False
+    
+    def received(self, size: int):
+        """Count one accepted message"""
+        with self.lock:
+            self.messages += 1
+            self.bytes += size
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """One SMTP session"""
+    
+    sink = None
+    
+    def reply(self, line: str):
+        """Send one reply line"""
+        self.wfile.write(f"{line}\r\n".encode('ascii'))
+        self.wfile.flush()
+    
+    def handle(self):
+        with self.sink.lock:
+            self.sink.connections += 1
+        self.reply('220 smtp-sink ready')
+        
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-smtp-sink\r\n250-8BITMIME\r\n250 AUTH PLAIN LOGIN\r\n')
+                self.wfile.flush()
+            elif verb == 'AUTH':
+                if command.upper().startswith('AUTH LOGIN'):
+                    # Username and password prompts; any answers are accepted
+                    if len(command.split()) < 3:
+                        self.reply('334 VXNlcm5hbWU6')
+                        self.rfile.readline()
+                    self.reply('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                self.reply('235 2.7.0 Authentication successful')
+            elif verb == 'MAIL' and self.sink.should_drop('MAIL'):
+                return
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data)
+                if self.sink.latency:
+                    time.sleep(self.sink.latency)
+                self.sink.received(size)
+                if self.sink.should_drop('DATA'):
+                    return
+                self.reply('250 OK queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local SMTP sink')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8025)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every accepted message')
+    args = parser.parse_args()
+    
+    sink = SMTPSink(args.host, args.port, args.latency)
+    print(f"SMTP sink listening on {args.host}:{sink.start()}")
+    try:
+        sink._thread.join()
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+# Weight of a new latency sample in the moving average
+LATENCY_SMOOTHING = 0.2
+# How fast the latency baseline may creep up per sample, so it follows slow daily changes
+BASELINE_DRIFT = 0.01
+# Latency must also be this many seconds above the baseline to count as congestion,
+# so jitter on very fast calls does not shrink the limit
+LATENCY_SLACK = 0.05
+# Shortest time between two decreases
+MIN_DECREASE_INTERVAL = 1.0
+
+
+def _wake(waiter: asyncio.Future):
+    """Resolve a coroutine's wait for a slot, unless it was cancelled meanwhile"""
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that adapts with AIMD (additive increase, multiplicative decrease)
+    
+    Used as a context manager (``with`` in threads, ``async with`` in
+    coroutines) in place of a semaphore around one call. While
+    calls come back within ``latency_tolerance`` times the best latency seen
+    and the limit is fully used, the limit grows by about one per round of
+    calls; a throttling signal (see backoff) or a slow call cuts it by
+    ``decrease_factor``, at most once per smoothed latency (and per second)
+    so one burst of errors only counts once.
+    """
+    
+    def __init__(self, name: str, initial: int, minimum: int = 1, maximum: int = None,
+                 latency_tolerance: float = 2.0, decrease_factor: float = 0.5):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum or initial)
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        
+        self._limit = float(min(max(initial, self.minimum), self.maximum))
+        self._in_flight = 0
+        # Callers queued for a slot; any of them means the limit is fully used
+        self._waiting = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+        # Start times of coroutine callers, which share a thread, and their wake-up futures
+        self._async_starts = contextvars.ContextVar(f'{name}_starts', default=())
+        self._async_waiters = []
+        self._smoothed_latency = None
+        self._baseline_latency = None
+        self._last_decrease = 0.0
+        self._stats = {
+            'increases': 0,
+            'decreases': 0,
+            'min_limit': int(self._limit),
+            'max_limit': int(self._limit)
+        }
+    
+    @property
+    def limit(self) -> int:
+        """Calls currently allowed in flight"""
+        return int(self._limit)
+    
+    def __enter__(self):
+        with self._cond:
+            if self._in_flight >= int(self._limit):
+                self._waiting += 1
+                while self._in_flight >= int(self._limit):
+                    self._cond.wait()
+                self._waiting -= 1
+            self._in_flight += 1
+        starts = getattr(self._local, 'starts', None)
+        if starts is None:
+            starts = self._local.starts = []
+        starts.append(time.monotonic())
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self._release(time.monotonic() - self._local.starts.pop(), exc_type is None)
+        return False
+    
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        queued = False
+        try:
+            while True:
+                with self._cond:
+                    if self._in_flight < int(self._limit):
+                        self._in_flight += 1
+                        if queued:
+                            self._waiting -= 1
+                        break
+                    if not queued:
+                        self._waiting += 1
+                        queued = True
+                    waiter = loop.create_future()
+                    self._async_waiters.append((loop, waiter))
+                await waiter
+        except asyncio.CancelledError:
+            with self._cond:
+                self._waiting -= 1
+            raise
+        self._async_starts.set(self._async_starts.get() + (time.monotonic(),))
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        starts = self._async_starts.get()
+        self._async_starts.set(starts[:-1])
+        self._release(time.monotonic() - starts[-1], exc_type is None)
+        return False
+    
+    def _release(self, latency: float, succeeded: bool):
+        """Free a slot, learn from the call's latency and wake every waiter to re-check the limit"""
+        with self._cond:
+            saturated = self._in_flight >= int(self._limit) or self._waiting > 0
+            self._in_flight -= 1
+            if succeeded:
+                self._observe(latency, saturated)
+            self._cond.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+    
+    def _observe(self, latency: float, saturated: bool):
+        """Fold in the latency of a successful call and grow or shrink the limit (lock held)"""
+        if self._smoothed_latency is None:
+            self._smoothed_latency = latency
+            self._baseline_latency = latency
+        else:
+            self._smoothed_latency += LATENCY_SMOOTHING * (latency - self._smoothed_latency)
+            self._baseline_latency = min(self._baseline_latency * (1 + BASELINE_DRIFT), self._smoothed_latency)
+        
+        congestion_latency = max(self._baseline_latency * self.latency_tolerance, self._baseline_latency + LATENCY_SLACK)
+        if self._smoothed_latency > congestion_latency:
+            self._decrease('latency')
+        elif saturated and self._limit < self.maximum:
+            previous = int(self._limit)
+            self._limit = min(self.maximum, self._limit + 1.0 / self._limit)
+            if int(self._limit) > previous:
+                self._stats['increases'] += 1
+                self._stats['max_limit'] = max(self._stats['max_limit'], int(self._limit))
+    
+    def backoff(self, reason: str = 'throttled'):
+        """Cut the limit after a 429, timeout or other sign of overload"""
+        with self._cond:
+            self._decrease(reason)
+    
+    def _decrease(self, reason: str):
+        """Multiplicative decrease, rate-limited so a burst of signals counts once (lock held)"""
+        now = time.monotonic()
+        if now - self._last_decrease < max(self._smoothed_latency or 0.0, MIN_DECREASE_INTERVAL):
+            return
+        previous = int(self._limit)
+        self._limit = max(self.minimum, self._limit * self.decrease_factor)
+        self._last_decrease = now
+        if int(self._limit) < previous:
+            self._stats['decreases'] += 1
+            self._stats['min_limit'] = min(self._stats['min_limit'], int(self._limit))
+            logger.info(f"{self.name}: concurrency {previous} -> {int(self._limit)} ({reason})")
+    
+    def on_transient_error(self, error: Exception):
+        """RateLimiter listener: treat every retried error as an overload signal"""
+        self.backoff(type(error).__name__)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Current limit, its range so far and the latency it is tracking"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['limit'] = int(self._limit)
+            stats['in_flight'] = self._in_flight
+            stats['maximum'] = self.maximum
+            if self._smoothed_latency is not None:
+                stats['latency'] = round(self._smoothed_latency, 3)
+                stats['baseline_latency'] = round(self._baseline_latency, 3)
+        return stats
@@ -1,10 +1,36 @@
 import os
+import time
+import asyncio
 import logging
-from openai import OpenAI
+import threading
+from openai import OpenAI, AsyncOpenAI
 import json
+from typing import Callable, Dict
+
+from services.rate_limiter import get_limiter
+from services.metrics import OPENAI_TOKENS, timed_call, timed_call_async
 
 logger = logging.getLogger(__name__)
 
+# Batch API endpoint and the batch states after which polling stops
+BATCH_ENDPOINT = '/v1/chat/completions'
+BATCH_FINAL_STATES = ('completed', 'failed', 'expired', 'cancelled')
+
+# Completion tokens allowed per generated email
+EMAIL_MAX_TOKENS = 2000
+
+SYSTEM_PROMPT = "You are an automation outreach agent. Output only valid JSON without any additional text, explanations, or markdown formatting."
+
+
+def empty_usage() -> Dict[str, int]:
+    """Token usage counters filled in by AIService.generate_email"""
+    return {
+        'requests': 0,
+        'prompt_tokens': 0,
+        'cached_prompt_tokens': 0,
+        'completion_tokens': 0
+    }
+
 
 class AIService:
     """Service for interacting with OpenAI API"""
@@ -13,12 +39,23 @@ class AIService:
         self.api_key = os.environ.get('OPENAI_API_KEY')
         self.model = os.environ.get('OPENAI_MODEL', 'gpt-4o-mini')
         self.client = None
+        self._usage_lock = threading.Lock()
+        # AsyncOpenAI clients for generate_email_async, one per event loop (jobs run their own loops)
+        self._async_clients = {}
+        self._async_clients_lock = threading.Lock()
+        
+        # Deferred (Batch API) generation
+        self.batch_poll_interval = float(os.environ.get('OPENAI_BATCH_POLL_INTERVAL', '30'))
+        self.batch_completion_window = os.environ.get('OPENAI_BATCH_COMPLETION_WINDOW', '24h')
+        
+        # Shared rate limit and retries; the client's own retries are turned off so backoff is not stacked
+        self.limiter = get_limiter('openai')
         
         if not self.api_key:
             logger.warning("OpenAI API key not configured. AI features will not work.")
         else:
             try:
-                self.client = OpenAI(api_key=self.api_key)
+                self.client = OpenAI(api_key=self.api_key, max_retries=0)
             except Exception as e:
                 logger.warning(f"Failed to initialize OpenAI client: {str(e)}. AI features will not work.")
                 self.client = None
@@ -29,11 +66,36 @@ class AIService:
             raise Exception("OpenAI API key not configured")
         if not self.client:
             try:
-                self.client = OpenAI(api_key=self.api_key)
+                self.client = OpenAI(api_key=self.api_key, max_retries=0)
             except Exception as e:
                 raise Exception(f"Failed to initialize OpenAI client: {str(e)}")
         return self.client
     
+    def _get_async_client(self):
+        """Get or create the AsyncOpenAI client for the running event loop"""
+        if not self.api_key:
+            raise Exception("OpenAI API key not configured")
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                try:
+                    client = AsyncOpenAI(api_key=self.api_key, max_retries=0)
+                except Exception as e:
+                    raise Exception(f"Failed to initialize OpenAI client: {str(e)}")
+                # Loops that ended without aclose() cannot close their clients any more
+                for closed in [other for other in self._async_clients if other.is_closed()]:
+                    del self._async_clients[closed]
+                self._async_clients[loop] = client
+        return client
+    
+    async def aclose(self):
+        """Close the async client of the running loop; other loops' clients stay open"""
+        with self._async_clients_lock:
+            client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+    
     def test_connection(self):
         """Test OpenAI API connection"""
         client = self._get_client()
@@ -49,40 +111,243 @@ class AIService:
         except Exception as e:
             raise Exception(f"OpenAI connection failed: {str(e)}")
     
-    def generate_email(self, prompt: str) -> str:
-        """Generate email content using OpenAI"""
+    def _completion_params(self, prompt: str, instructions: str = None, max_tokens: int = EMAIL_MAX_TOKENS) -> Dict:
+        """Chat completion request body shared by real-time and batch generation"""
+        system_content = SYSTEM_PROMPT
+        if instructions:
+            system_content = f"{SYSTEM_PROMPT}\n\n{instructions}"
+        
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_content
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.7,
+            "max_tokens": max_tokens,
+            "response_format": {"type": "json_object"}
+        }
+    
+    def _stream_params(self, prompt: str, instructions: str = None, max_tokens: int = EMAIL_MAX_TOKENS) -> Dict:
+        """_completion_params for a streamed completion that reports its usage in the last chunk"""
+        return dict(
+            self._completion_params(prompt, instructions, max_tokens),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+    
+    @staticmethod
+    def _normalize_content(content: str) -> str:
+        """Return the model output, re-serialized when it is already a complete email object"""
+        # If response_format is json_object, OpenAI wraps it, so we need to parse and extract
+        try:
+            parsed = json.loads(content)
+            # If it's already in the correct format, return as JSON string
+            if 'to' in parsed and 'subject' in parsed and 'emailBody' in parsed:
+                return json.dumps(parsed)
+            return content
+        except:
+            return content
+    
+    def generate_email(self, prompt: str, instructions: str = None, usage: Dict[str, int] = None,
+                       max_tokens: int = EMAIL_MAX_TOKENS) -> str:
+        """Generate email content using OpenAI
+        
+        ``instructions`` is the part of the prompt shared by every row (for
+        example instructions plus knowledge base). It is sent first, right after
+        the fixed system prompt, so consecutive calls share a byte-identical
+        prefix that the provider can cache; ``prompt`` holds the per-row data
+        and goes last. Token counts are added to ``usage`` when given.
+        ``max_tokens`` is raised for prompts that ask for several emails.
+        """
         client = self._get_client()
         try:
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an automation outreach agent. Output only valid JSON without any additional text, explanations, or markdown formatting."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                temperature=0.7,
-                max_tokens=2000,
-                response_format={"type": "json_object"}
+            response = self.limiter.call(
+                timed_call, 'openai', 'generate',
+                client.chat.completions.create, **self._completion_params(prompt, instructions, max_tokens)
             )
+            self._record_usage(usage, response.usage)
             
-            content = response.choices[0].message.content
+            return self._normalize_content(response.choices[0].message.content)
+        
+        except Exception as e:
+            logger.error(f"Error generating email: {str(e)}")
+            raise Exception(f"Failed to generate email: {str(e)}")
+    
+    def generate_email_stream(self, prompt: str, on_text: Callable[[str], None], instructions: str = None,
+                              usage: Dict[str, int] = None, max_tokens: int = EMAIL_MAX_TOKENS) -> str:
+        """generate_email over a streamed completion, passing each piece of text to ``on_text`` as it arrives
+        
+        When ``on_text`` raises, the stream is closed at once so the rest of
+        the answer is neither waited for nor generated, and the error is
+        raised. Returns the whole output otherwise.
+        """
+        client = self._get_client()
+        try:
+            stream = self.limiter.call(
+                timed_call, 'openai', 'generate_stream',
+                client.chat.completions.create, **self._stream_params(prompt, instructions, max_tokens)
+            )
+            parts = []
+            with stream:
+                for chunk in stream:
+                    # The last chunk carries only the usage of the whole request
+                    self._record_usage(usage, chunk.usage)
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        parts.append(text)
+                        on_text(text)
+            return ''.join(parts)
+        
+        except Exception as e:
+            logger.error(f"Error generating email: {str(e)}")
+            raise Exception(f"Failed to generate email: {str(e)}")
+    
+    async def generate_email_async(self, prompt: str, instructions: str = None, usage: Dict[str, int] = None,
+                                   max_tokens: int = EMAIL_MAX_TOKENS) -> str:
+        """generate_email for asyncio, over AsyncOpenAI with the same prompt layout and limiter"""
+        client = self._get_async_client()
+        try:
+            response = await self.limiter.call_async(
+                timed_call_async, 'openai', 'generate',
+                client.chat.completions.create, **self._completion_params(prompt, instructions, max_tokens)
+            )
+            self._record_usage(usage, response.usage)
             
-            # If response_format is json_object, OpenAI wraps it, so we need to parse and extract
-            try:
-                parsed = json.loads(content)
-                # If it's already in the correct format, return as JSON string
-                if 'to' in parsed and 'subject' in parsed and 'emailBody' in parsed:
-                    return json.dumps(parsed)
-                return content
-            except:
-                return content
-                
+            return self._normalize_content(response.choices[0].message.content)
+        
         except Exception as e:
             logger.error(f"Error generating email: {str(e)}")
             raise Exception(f"Failed to generate email: {str(e)}")
+    
+    async def generate_email_stream_async(self, prompt: str, on_text: Callable[[str], None], instructions: str = None,
+                                          usage: Dict[str, int] = None, max_tokens: int = EMAIL_MAX_TOKENS) -> str:
+        """generate_email_stream for asyncio"""
+        client = self._get_async_client()
+        try:
+            stream = await self.limiter.call_async(
+                timed_call_async, 'openai', 'generate_stream',
+                client.chat.completions.create, **self._stream_params(prompt, instructions, max_tokens)
+            )
+            parts = []
+            async with stream:
+                async for chunk in stream:
+                    self._record_usage(usage, chunk.usage)
+                    text = chunk.choices[0].delta.content if chunk.choices else None
+                    if text:
+                        parts.append(text)
+                        on_text(text)
+            return ''.join(parts)
+        
+        except Exception as e:
+            logger.error(f"Error generating email: {str(e)}")
+            raise Exception(f"Failed to generate email: {str(e)}")
+    
+    def build_batch_request(self, custom_id: str, prompt: str, instructions: str = None) -> Dict:
+        """One line of a Batch API input file for the given prompt"""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": self._completion_params(prompt, instructions)
+        }
+    
+    def submit_batch(self, input_path: str) -> str:
+        """Upload a JSONL batch file, start the batch and return its id"""
+        client = self._get_client()
+        try:
+            with open(input_path, 'rb') as f:
+                input_file = self.limiter.call(timed_call, 'openai', 'upload_file', client.files.create, file=f, purpose='batch')
+            batch = self.limiter.call(
+                timed_call, 'openai', 'create_batch', client.batches.create,
+                input_file_id=input_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=self.batch_completion_window
+            )
+            logger.info(f"Submitted batch {batch.id} from {input_path}")
+            return batch.id
+        except Exception as e:
+            logger.error(f"Error submitting batch: {str(e)}")
+            raise Exception(f"Failed to submit batch: {str(e)}")
+    
+    def wait_for_batch(self, batch_id: str, cancel_event: threading.Event = None):
+        """Poll a batch until it reaches a final state and return it
+        
+        Setting ``cancel_event`` cancels the batch and returns right away.
+        """
+        client = self._get_client()
+        while True:
+            batch = self.limiter.call(timed_call, 'openai', 'retrieve_batch', client.batches.retrieve, batch_id)
+            if batch.status in BATCH_FINAL_STATES:
+                logger.info(f"Batch {batch_id} finished with status {batch.status}")
+                return batch
+            
+            if cancel_event and cancel_event.wait(self.batch_poll_interval):
+                logger.info(f"Cancelling batch {batch_id}")
+                return self.limiter.call(timed_call, 'openai', 'cancel_batch', client.batches.cancel, batch_id)
+            if not cancel_event:
+                time.sleep(self.batch_poll_interval)
+    
+    def get_batch_results(self, batch, usage: Dict[str, int] = None) -> Dict[str, str]:
+        """Map custom_id to normalized model output for every successful request of a batch
+        
+        Requests that failed are left out, so callers treat missing ids as errors.
+        """
+        client = self._get_client()
+        results = {}
+        if not batch.output_file_id:
+            return results
+        
+        output = self.limiter.call(timed_call, 'openai', 'download_file', client.files.content, batch.output_file_id).text
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            response = entry.get('response') or {}
+            if entry.get('error') or response.get('status_code') != 200:
+                logger.warning(f"Batch request {entry.get('custom_id')} failed: {entry.get('error')}")
+                continue
+            
+            body = response.get('body', {})
+            self._record_usage(usage, body.get('usage'))
+            results[entry['custom_id']] = self._normalize_content(body['choices'][0]['message']['content'])
+        
+        return results
+    
+    @staticmethod
+    def _usage_value(source, key: str, default=0):
+        """Read a usage field from either an SDK object or a plain dict"""
+        if source is None:
+            return default
+        if isinstance(source, dict):
+            return source.get(key, default)
+        return getattr(source, key, default)
+    
+    def _record_usage(self, usage: Dict[str, int], response_usage):
+        """Add the token counts of one response to the token metrics and, when given, a usage dict"""
+        if response_usage is None:
+            return
+        
+        prompt_tokens = self._usage_value(response_usage, 'prompt_tokens') or 0
+        completion_tokens = self._usage_value(response_usage, 'completion_tokens') or 0
+        details = self._usage_value(response_usage, 'prompt_tokens_details', None)
+        cached_tokens = self._usage_value(details, 'cached_tokens') or 0
+        
+        OPENAI_TOKENS.inc(prompt_tokens, type='prompt')
+        OPENAI_TOKENS.inc(cached_tokens, type='cached_prompt')
+        OPENAI_TOKENS.inc(completion_tokens, type='completion')
+        if usage is None:
+            return
+        
+        with self._usage_lock:
+            usage['requests'] += 1
+            usage['prompt_tokens'] += prompt_tokens
+            usage['cached_prompt_tokens'] += cached_tokens
+            usage['completion_tokens'] += completion_tokens
 
@@ -0,0 +1,137 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List
+
+from services.result_log import at_line_boundary
+
+logger = logging.getLogger(__name__)
+
+# Layout of a bundle directory
+MANIFEST_FILE = 'manifest.json'
+DRAFTS_FILE = 'drafts.jsonl'
+EML_DIR = 'eml'
+
+
+def bundle_dir() -> str:
+    """Directory holding the bundles written by 'render' runs (OUTREACH_BUNDLE_DIR)"""
+    return os.environ.get('OUTREACH_BUNDLE_DIR', 'bundles')
+
+
+class CampaignBundleWriter:
+    """Streams generated drafts of a 'render' run into a bundle directory
+    
+    Every draft is appended to drafts.jsonl as soon as it is generated, with
+    the row data needed to check the send ledger later, and written as a
+    ready-to-open .eml file under eml/ for review in a mail client.
+    manifest.json describes the run. Opening an existing bundle appends to it,
+    so a resumed run continues the same bundle.
+    """
+    
+    def __init__(self, path: str, render_message: Callable[[str, str, str], bytes] = None,
+                 manifest: Dict[str, Any] = None):
+        self.path = path
+        self.render_message = render_message
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(path, EML_DIR), exist_ok=True)
+        
+        self.manifest = read_manifest(path) if os.path.exists(os.path.join(path, MANIFEST_FILE)) else {}
+        self.manifest.setdefault('created_at', datetime.now().isoformat())
+        self.manifest.update(manifest or {})
+        self.manifest['finished_at'] = None
+        self._write_manifest()
+        
+        drafts_path = os.path.join(path, DRAFTS_FILE)
+        torn = not at_line_boundary(drafts_path)
+        self._drafts_file = open(drafts_path, 'a', encoding='utf-8')
+        if torn:
+            # Keep the first new draft off the torn line an interrupted run left behind
+            self._drafts_file.write('\n')
+    
+    def _write_manifest(self):
+        tmp_path = os.path.join(self.path, f"{MANIFEST_FILE}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_FILE))
+    
+    def add(self, row_index: int, company_data: Dict, email_content: Dict[str, str]):
+        """Write one draft; safe to call from several generate workers"""
+        eml_name = None
+        if self.render_message:
+            eml_name = f"{EML_DIR}/row-{row_index}.eml"
+            message = self.render_message(email_content['to'], email_content['subject'], email_content['emailBody'])
+            with open(os.path.join(self.path, eml_name), 'wb') as f:
+                f.write(message)
+        
+        line = json.dumps({
+            'row': row_index,
+            'to': email_content['to'],
+            'subject': email_content['subject'],
+            'emailBody': email_content['emailBody'],
+            'company_data': company_data,
+            'eml': eml_name
+        }, ensure_ascii=False)
+        with self._lock:
+            self._drafts_file.write(line + '\n')
+            # Flushed per draft so the bundle can be read while the run goes on
+            self._drafts_file.flush()
+    
+    def close(self, **summary):
+        """Close the drafts file and record the end of the run in the manifest"""
+        with self._lock:
+            self._drafts_file.close()
+        self.manifest.update(summary)
+        self.manifest['finished_at'] = datetime.now().isoformat()
+        self._write_manifest()
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    """manifest.json of a bundle"""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise Exception(f"Not a campaign bundle: {path}")
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def iter_drafts(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream the drafts of a bundle in file order, one line at a time
+    
+    A row written twice (by a run that was resumed after generating it)
+    yields only its first draft, and a torn last line from an interrupted
+    run is skipped.
+    """
+    seen = set()
+    with open(os.path.join(path, DRAFTS_FILE), 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                draft = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping unreadable draft on line {line_number} of {path}")
+                continue
+            if draft['row'] in seen:
+                continue
+            seen.add(draft['row'])
+            yield draft
+
+
+def list_bundles(directory: str = None) -> List[Dict[str, Any]]:
+    """Manifests of the bundles in a directory, newest first"""
+    directory = directory or bundle_dir()
+    if not os.path.isdir(directory):
+        return []
+    
+    bundles = []
+    for name in os.listdir(directory):
+        try:
+            manifest = read_manifest(os.path.join(directory, name))
+        except Exception:
+            continue
+        manifest['id'] = name
+        bundles.append(manifest)
+    bundles.sort(key=lambda manifest: manifest.get('created_at') or '', reverse=True)
+    return bundles
@@ -0,0 +1,245 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from services.lease_store import (
+    SHARD_PENDING, SHARD_LEASED, SHARD_DONE, SHARD_FAILED, COUNT_FIELDS
+)
+
+logger = logging.getLogger(__name__)
+
+# Agent events that report a finished row; they arrive in row order
+OUTCOME_EVENTS = ('sent', 'rendered', 'skipped', 'error')
+
+
+def plan_shards(start_row: int, end_row: int, shard_size: int) -> List[Tuple[int, int]]:
+    """Split start_row..end_row into consecutive (first, last) ranges of at most shard_size rows"""
+    return [(first, min(first + shard_size - 1, end_row)) for first in range(start_row, end_row + 1, shard_size)]
+
+
+def new_worker_id() -> str:
+    """Worker id unique across machines and processes"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class CampaignCoordinator:
+    """Splits a campaign's row range into shards that ShardWorkers lease from a lease store"""
+    
+    def __init__(self, lease_store, shard_size: int = None):
+        self.store = lease_store
+        self.shard_size = shard_size or int(os.environ.get('CAMPAIGN_SHARD_SIZE', '100'))
+    
+    def create(self, start_row: int, end_row: int, mode: str = None, shard_size: int = None,
+               campaign_id: str = None) -> Dict[str, Any]:
+        """Register a campaign; raises when its rows overlap a campaign that is still running"""
+        if end_row < start_row:
+            raise Exception(f"Invalid row range {start_row}-{end_row}")
+        shard_size = max(1, shard_size or self.shard_size)
+        campaign_id = campaign_id or uuid.uuid4().hex
+        self.store.create_campaign(campaign_id, start_row, end_row, plan_shards(start_row, end_row, shard_size), mode)
+        logger.info(f"Created campaign {campaign_id} for rows {start_row}-{end_row} in shards of {shard_size} rows")
+        return self.status(campaign_id)
+    
+    def status(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """A campaign with its shards, the number of shards in each state and the summed row counts"""
+        campaign = self.store.get_campaign(campaign_id)
+        if campaign is None:
+            return None
+        states = [shard['status'] for shard in campaign['shards']]
+        campaign['shard_counts'] = {state: states.count(state) for state in (SHARD_PENDING, SHARD_LEASED, SHARD_DONE, SHARD_FAILED)}
+        campaign['totals'] = {
+            field: sum(shard['counts'].get(field, 0) for shard in campaign['shards']) for field in COUNT_FIELDS
+        }
+        return campaign
+    
+    def list(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recently created campaigns first, without their shards"""
+        campaigns = []
+        for campaign in self.store.list_campaigns(limit):
+            campaign.pop('shards')
+            campaigns.append(campaign)
+        return campaigns
+
+
+class _ShardLease:
+    """Keeps one shard's lease alive while the agent works on it
+    
+    A background thread renews the lease every heartbeat interval, and
+    every finished row renews it with that row as the shard's progress. If
+    a renewal finds the lease taken over, or the caller cancels, the
+    shard's cancel event is set so the agent starts no new rows.
+    """
+    
+    def __init__(self, store, shard: Dict[str, Any], worker_id: str, ttl: float,
+                 interval: float, cancel_event: threading.Event = None):
+        self.store = store
+        self.shard = shard
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.interval = interval
+        self.outer_cancel = cancel_event
+        self.cancel_event = threading.Event()
+        self.lost = threading.Event()
+        self.progress = shard['progress']
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+    
+    def __enter__(self):
+        self._thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+    
+    def renew(self, progress: int = None) -> bool:
+        """Extend the lease, recording ``progress`` as the last completed row"""
+        if self.lost.is_set():
+            return False
+        if progress is not None:
+            self.progress = progress
+        try:
+            held = self.store.heartbeat(
+                self.shard['campaign_id'], self.shard['shard_index'], self.worker_id, self.shard['token'],
+                self.ttl, progress=self.progress
+            )
+        except Exception as e:
+            # A store hiccup is retried by the next renewal, before the lease runs out
+            logger.error(f"Failed to renew lease of shard {self.shard['shard_index']}: {str(e)}")
+            return True
+        if not held:
+            logger.warning(f"Lost lease of shard {self.shard['shard_index']}; stopping work on it")
+            self.lost.set()
+            self.cancel_event.set()
+        return held
+    
+    def _beat(self):
+        next_renewal = time.monotonic() + self.interval
+        # Wake at least once a second so a cancel reaches the agent quickly
+        while not self._stop.wait(min(self.interval, 1.0)):
+            if self.outer_cancel and self.outer_cancel.is_set():
+                self.cancel_event.set()
+            if time.monotonic() >= next_renewal:
+                next_renewal = time.monotonic() + self.interval
+                self.renew()
+
+
+class ShardWorker:
+    """Claims the shards of a campaign one at a time and runs each through an OutreachAgent
+    
+    Any number of workers, in any number of processes or on any number of
+    machines sharing the lease store, can work on the same campaign. A
+    shard whose worker stops renewing its lease is reassigned once the
+    lease expires, and the new owner starts after the last row the old one
+    reported as finished, so rows are neither lost nor worked on twice.
+    Rows that were in flight when a worker died may be retried; with a
+    send ledger shared by the workers those are skipped as already
+    contacted.
+    """
+    
+    def __init__(self, agent, lease_store, worker_id: str = None, lease_ttl: float = None,
+                 heartbeat_interval: float = None, poll_interval: float = None, max_attempts: int = None):
+        self.agent = agent
+        self.store = lease_store
+        self.worker_id = worker_id or new_worker_id()
+        self.lease_ttl = lease_ttl or float(os.environ.get('LEASE_TTL', '60'))
+        self.heartbeat_interval = heartbeat_interval or float(os.environ.get('LEASE_HEARTBEAT_INTERVAL', str(self.lease_ttl / 4)))
+        # How often an idle worker checks whether another worker's lease expired
+        self.poll_interval = poll_interval or float(os.environ.get('LEASE_POLL_INTERVAL', str(self.lease_ttl / 2)))
+        # Claims of a shard before a failing shard is given up on
+        self.max_attempts = max_attempts or int(os.environ.get('LEASE_MAX_ATTEMPTS', '3'))
+    
+    def run(self, campaign_id: str, cancel_event: threading.Event = None,
+            progress_callback=None, event_callback=None) -> Dict[str, Any]:
+        """Work on a campaign until none of its shards is left to claim
+        
+        While other workers hold the remaining shards this worker keeps
+        polling, so it can take over a shard whose lease expires. Returns
+        the row counts of the shards this worker ran.
+        """
+        campaign = self.store.get_campaign(campaign_id)
+        if campaign is None:
+            raise Exception(f"Unknown campaign: {campaign_id}")
+        summary = {'campaign_id': campaign_id, 'worker_id': self.worker_id, 'shards': []}
+        summary.update({field: 0 for field in COUNT_FIELDS})
+        
+        while not (cancel_event and cancel_event.is_set()):
+            shard = self.store.claim(campaign_id, self.worker_id, self.lease_ttl)
+            if shard is None:
+                campaign = self.store.get_campaign(campaign_id)
+                if campaign['status'] != 'running':
+                    break
+                # The rest is leased by other workers; wait in case one of them dies
+                if cancel_event:
+                    cancel_event.wait(self.poll_interval)
+                else:
+                    time.sleep(self.poll_interval)
+                continue
+            
+            status, counts = self._run_shard(campaign, shard, cancel_event, progress_callback, event_callback)
+            summary['shards'].append({'shard': shard['shard_index'], 'attempt': shard['token'], 'status': status})
+            for field in COUNT_FIELDS:
+                summary[field] += counts.get(field, 0)
+            if progress_callback:
+                progress_callback(summary)
+        
+        summary['campaign_status'] = self.store.get_campaign(campaign_id)['status']
+        return summary
+    
+    def _run_shard(self, campaign: Dict[str, Any], shard: Dict[str, Any], cancel_event: threading.Event,
+                   progress_callback, event_callback) -> Tuple[str, Dict[str, int]]:
+        """Run one leased shard and end its lease; returns the shard's new state and this attempt's counts"""
+        index = shard['shard_index']
+        first_row = shard['start_row'] if shard['progress'] is None else shard['progress'] + 1
+        logger.info(f"Worker {self.worker_id} running shard {index} of {campaign['campaign_id']}: "
+                    f"rows {first_row}-{shard['end_row']} (attempt {shard['token']})")
+        
+        with _ShardLease(self.store, shard, self.worker_id, self.lease_ttl,
+                         self.heartbeat_interval, cancel_event) as lease:
+            def on_event(event):
+                if event['type'] in OUTCOME_EVENTS and event.get('row') is not None:
+                    lease.renew(progress=event['row'])
+                if event_callback:
+                    event_callback(dict(event, shard=index))
+            
+            results = {}
+            error = None
+            if first_row <= shard['end_row']:
+                try:
+                    results = self.agent.execute(
+                        first_row, shard['end_row'], mode=campaign['mode'],
+                        cancel_event=lease.cancel_event,
+                        progress_callback=progress_callback,
+                        event_callback=on_event,
+                        # A fresh checkpoint per attempt, since the rows before first_row are someone else's
+                        run_id=f"{campaign['campaign_id']}-{index}-{shard['token']}"
+                    )
+                except Exception as e:
+                    logger.error(f"Shard {index} of {campaign['campaign_id']} failed: {str(e)}")
+                    error = str(e)
+        
+        counts = {field: results.get(field, 0) for field in COUNT_FIELDS}
+        if lease.lost.is_set():
+            # The new owner continues from the progress recorded before the lease was lost
+            return 'lost', counts
+        
+        if (cancel_event and cancel_event.is_set()) or results.get('cancelled'):
+            status = SHARD_PENDING
+        elif error or results.get('incomplete'):
+            error = error or (results.get('errors') or ['Run incomplete'])[-1]
+            status = SHARD_FAILED if shard['token'] >= self.max_attempts else SHARD_PENDING
+        else:
+            status = SHARD_DONE
+        
+        finished = self.store.finish(
+            campaign['campaign_id'], index, self.worker_id, shard['token'], status,
+            counts=counts, progress=lease.progress, error=error
+        )
+        if not finished:
+            logger.warning(f"Lease of shard {index} expired before it could be finished")
+            return 'lost', counts
+        return status, counts
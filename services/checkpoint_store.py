@@ -0,0 +1,112 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Run states; anything but 'completed' can be resumed
+RUN_RUNNING = 'running'
+RUN_COMPLETED = 'completed'
+RUN_CANCELLED = 'cancelled'
+RUN_INCOMPLETE = 'incomplete'
+
+
+class CheckpointStore:
+    """SQLite store of run progress so interrupted runs can resume where they stopped"""
+    
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get('CHECKPOINT_DB_PATH', 'checkpoints.db')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    start_row INTEGER NOT NULL,
+                    end_row INTEGER NOT NULL,
+                    mode TEXT,
+                    status TEXT NOT NULL,
+                    last_completed_row INTEGER,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS run_rows (
+                    run_id TEXT NOT NULL,
+                    row_index INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    outcome TEXT NOT NULL,
+                    PRIMARY KEY (run_id, row_index)
+                )
+            ''')
+    
+    def create_run(self, run_id: str, start_row: int, end_row: int, mode: str = None):
+        """Register a new run; a run that already exists is left untouched"""
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR IGNORE INTO runs (run_id, start_row, end_row, mode, status, last_completed_row, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, NULL, ?, ?)',
+                (run_id, start_row, end_row, mode, RUN_RUNNING, now, now)
+            )
+    
+    def record_row(self, run_id: str, outcome: Dict[str, Any]):
+        """Store a row outcome and advance the run's last completed row
+        
+        Outcomes are recorded in row order, so the last completed row is always
+        the end of a contiguous block of finished rows.
+        """
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO run_rows (run_id, row_index, status, outcome) VALUES (?, ?, ?, ?)',
+                (run_id, outcome['row'], outcome['status'], json.dumps(outcome))
+            )
+            self._conn.execute(
+                'UPDATE runs SET last_completed_row = ?, updated_at = ? WHERE run_id = ?',
+                (outcome['row'], now, run_id)
+            )
+    
+    def set_status(self, run_id: str, status: str):
+        """Update the status of a run"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?',
+                (status, datetime.now().isoformat(), run_id)
+            )
+    
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """A run's checkpoint, or None if it is unknown"""
+        with self._lock:
+            row = self._conn.execute('SELECT * FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        return dict(row) if row else None
+    
+    def list_runs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recently updated runs first"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT * FROM runs ORDER BY updated_at DESC LIMIT ?', (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def row_outcomes(self, run_id: str) -> Iterator[Dict[str, Any]]:
+        """Stored row outcomes of a run in row order"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT outcome FROM run_rows WHERE run_id = ? ORDER BY row_index', (run_id,)
+            ).fetchall()
+        for row in rows:
+            yield json.loads(row['outcome'])
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
@@ -1,12 +1,330 @@
 import os
+import time
+import queue
+import asyncio
 import smtplib
 import logging
+import threading
+import aiosmtplib
+from contextlib import contextmanager, asynccontextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.utils import formataddr
 
+from services.rate_limiter import get_limiter
+from services.metrics import track
+
 logger = logging.getLogger(__name__)
 
+# A connection lost or timed out with one of these is worth replacing, if the message was not handed over yet
+_CONNECTION_LOST = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+_ASYNC_CONNECTION_LOST = (aiosmtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class SMTPDeliveryUncertain(Exception):
+    """The connection was lost after DATA began, so the server may already have accepted the message
+    
+    Sending it again could deliver it twice, so this is neither resent by
+    the pool nor retried by the rate limiter.
+    """
+
+
+class _SMTP(smtplib.SMTP):
+    """smtplib.SMTP that notes when a message reached the DATA command"""
+    
+    data_started = False
+    
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class _AsyncSMTP(aiosmtplib.SMTP):
+    """aiosmtplib.SMTP that notes when a message reached the DATA command"""
+    
+    data_started = False
+    
+    async def data(self, message, **kwargs):
+        self.data_started = True
+        return await super().data(message, **kwargs)
+
+
+def _send_over(server, msg):
+    """Send ``msg`` on an open connection, raising SMTPDeliveryUncertain if it drops once DATA began"""
+    if isinstance(server, _SMTP):
+        server.data_started = False
+    try:
+        with track('smtp', 'send'):
+            server.send_message(msg)
+    except _CONNECTION_LOST as e:
+        # Without the DATA marker nothing says the message was not delivered
+        if not isinstance(server, _SMTP) or server.data_started:
+            raise SMTPDeliveryUncertain(f"Connection lost after the message was sent: {str(e)}") from e
+        raise
+
+
+async def _send_over_async(server, msg):
+    """_send_over for aiosmtplib connections"""
+    if isinstance(server, _AsyncSMTP):
+        server.data_started = False
+    try:
+        with track('smtp', 'send'):
+            await server.send_message(msg)
+    except _ASYNC_CONNECTION_LOST as e:
+        if not isinstance(server, _AsyncSMTP) or server.data_started:
+            raise SMTPDeliveryUncertain(f"Connection lost after the message was sent: {str(e)}") from e
+        raise
+
+
+class _PooledConnection:
+    """An authenticated SMTP connection tracked by SMTPConnectionPool or AsyncSMTPConnectionPool"""
+    
+    def __init__(self, server):
+        self.server = server
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """Pool of authenticated SMTP connections reused across many sends
+    
+    Connections are opened lazily up to ``size``, checked with NOOP when they
+    have been idle longer than ``keepalive_interval`` seconds, re-opened when
+    the server drops them and recycled after ``max_messages`` sends. A
+    message is sent again on a fresh connection only when the old one was
+    lost before DATA; after that the server may have accepted it, and
+    SMTPDeliveryUncertain is raised instead.
+    """
+    
+    def __init__(self, connect, size: int = 1, max_messages: int = 100, keepalive_interval: float = 30.0):
+        self._connect = connect
+        self.size = max(1, size)
+        self.max_messages = max_messages
+        self.keepalive_interval = keepalive_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._closed = False
+    
+    def grow(self, size: int):
+        """Allow up to ``size`` connections, if that is more than the pool has room for"""
+        with self._lock:
+            self.size = max(self.size, size)
+    
+    def _acquire(self) -> _PooledConnection:
+        """Take an idle connection, opening a new one if the pool has room"""
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            
+            with self._lock:
+                can_open = self._open < self.size
+                if can_open:
+                    self._open += 1
+            
+            if can_open:
+                try:
+                    return _PooledConnection(self._connect())
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+            
+            # Pool is full: wait for a connection to come back (or a slot to free up)
+            try:
+                return self._idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+    
+    def _release(self, conn: _PooledConnection):
+        """Return a connection to the pool, or retire it if it is used up"""
+        if self._closed or (self.max_messages and conn.messages_sent >= self.max_messages):
+            self._discard(conn)
+            return
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+    
+    def _discard(self, conn: _PooledConnection):
+        """Close a connection and free its slot"""
+        try:
+            conn.server.quit()
+        except Exception:
+            try:
+                conn.server.close()
+            except Exception:
+                pass
+        with self._lock:
+            self._open -= 1
+    
+    def _ensure_alive(self, conn: _PooledConnection) -> _PooledConnection:
+        """Send a NOOP on idle connections and reconnect if the server went away"""
+        if time.monotonic() - conn.last_used < self.keepalive_interval:
+            return conn
+        try:
+            with track('smtp', 'noop'):
+                code, _ = conn.server.noop()
+            if code == 250:
+                return conn
+        except (smtplib.SMTPException, OSError):
+            pass
+        logger.info("SMTP connection went stale, reconnecting")
+        return self._reconnect(conn)
+    
+    def _reconnect(self, conn: _PooledConnection) -> _PooledConnection:
+        """Replace a dead connection, keeping its pool slot"""
+        try:
+            conn.server.close()
+        except Exception:
+            pass
+        return _PooledConnection(self._connect())
+    
+    def send_message(self, msg):
+        """Send a message over a pooled connection, reconnecting once if it dropped before DATA"""
+        if self._closed:
+            raise Exception("SMTP connection pool is closed")
+        
+        conn = self._acquire()
+        try:
+            conn = self._ensure_alive(conn)
+            try:
+                _send_over(conn.server, msg)
+            except _CONNECTION_LOST:
+                logger.info("SMTP server dropped the connection before DATA, reconnecting")
+                conn = self._reconnect(conn)
+                _send_over(conn.server, msg)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+            # The server rejected this message but the connection is still usable
+            self._release(conn)
+            raise
+        except Exception:
+            # Anything else leaves the connection in an unknown state; free its slot
+            self._discard(conn)
+            raise
+        
+        conn.messages_sent += 1
+        self._release(conn)
+    
+    def close(self):
+        """Close every idle connection; busy ones are closed when released"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+class AsyncSMTPConnectionPool:
+    """SMTPConnectionPool for asyncio, over aiosmtplib connections
+    
+    Same policy: at most ``size`` connections, opened lazily, NOOP after
+    ``keepalive_interval`` idle seconds, one reconnect when the server drops
+    a connection before DATA and recycling after ``max_messages`` sends. Must be used
+    from a single event loop.
+    """
+    
+    def __init__(self, connect, size: int = 1, max_messages: int = 100, keepalive_interval: float = 30.0):
+        self._connect = connect
+        self.size = max(1, size)
+        self.max_messages = max_messages
+        self.keepalive_interval = keepalive_interval
+        # Busy connections hold a slot; idle ones wait in a LIFO list
+        self._slots = asyncio.Semaphore(self.size)
+        self._idle = []
+        self._closed = False
+    
+    def grow(self, size: int):
+        """Allow up to ``size`` connections, if that is more than the pool has room for"""
+        for _ in range(size - self.size):
+            self._slots.release()
+        self.size = max(self.size, size)
+    
+    async def _acquire(self) -> _PooledConnection:
+        """Take a slot and an idle connection, opening a new one if none is idle"""
+        await self._slots.acquire()
+        if self._idle:
+            return self._idle.pop()
+        try:
+            return _PooledConnection(await self._connect())
+        except Exception:
+            self._slots.release()
+            raise
+    
+    async def _release(self, conn: _PooledConnection):
+        """Return a connection to the pool, or retire it if it is used up"""
+        if self._closed or (self.max_messages and conn.messages_sent >= self.max_messages):
+            await self._discard(conn)
+            return
+        conn.last_used = time.monotonic()
+        self._idle.append(conn)
+        self._slots.release()
+    
+    async def _discard(self, conn: _PooledConnection):
+        """Close a connection and free its slot"""
+        try:
+            await conn.server.quit()
+        except Exception:
+            conn.server.close()
+        self._slots.release()
+    
+    async def _ensure_alive(self, conn: _PooledConnection) -> _PooledConnection:
+        """Send a NOOP on idle connections and reconnect if the server went away"""
+        if time.monotonic() - conn.last_used < self.keepalive_interval:
+            return conn
+        try:
+            with track('smtp', 'noop'):
+                response = await conn.server.noop()
+            if response.code == 250:
+                return conn
+        except (aiosmtplib.SMTPException, OSError):
+            pass
+        logger.info("SMTP connection went stale, reconnecting")
+        return await self._reconnect(conn)
+    
+    async def _reconnect(self, conn: _PooledConnection) -> _PooledConnection:
+        """Replace a dead connection, keeping its pool slot"""
+        conn.server.close()
+        return _PooledConnection(await self._connect())
+    
+    async def send_message(self, msg):
+        """Send a message over a pooled connection, reconnecting once if it dropped before DATA"""
+        if self._closed:
+            raise Exception("SMTP connection pool is closed")
+        
+        conn = await self._acquire()
+        try:
+            conn = await self._ensure_alive(conn)
+            try:
+                await _send_over_async(conn.server, msg)
+            except _ASYNC_CONNECTION_LOST:
+                logger.info("SMTP server dropped the connection before DATA, reconnecting")
+                conn = await self._reconnect(conn)
+                await _send_over_async(conn.server, msg)
+        except (aiosmtplib.SMTPRecipientsRefused, aiosmtplib.SMTPSenderRefused, aiosmtplib.SMTPDataError):
+            # The server rejected this message but the connection is still usable
+            await self._release(conn)
+            raise
+        except BaseException:
+            # Anything else (cancellation included) leaves the connection in an unknown state
+            await self._discard(conn)
+            raise
+        
+        conn.messages_sent += 1
+        await self._release(conn)
+    
+    async def close(self):
+        """Close every idle connection; busy ones are closed when released"""
+        self._closed = True
+        while self._idle:
+            conn = self._idle.pop()
+            try:
+                await conn.server.quit()
+            except Exception:
+                conn.server.close()
+
 
 class EmailService:
     """Service for sending emails via SMTP"""
@@ -18,47 +336,218 @@ class EmailService:
         self.smtp_password = os.environ.get('SMTP_PASSWORD')
         self.from_email = os.environ.get('SMTP_FROM_EMAIL', self.smtp_user)
         self.from_name = os.environ.get('SMTP_FROM_NAME', 'Outreach Team')
+        # Plain-text relays (such as a local sink) do not offer STARTTLS
+        self.use_starttls = os.environ.get('SMTP_STARTTLS', 'true').lower() != 'false'
+        
+        # Connection pooling used by session()
+        self.pool_size = int(os.environ.get('SMTP_POOL_SIZE', '1'))
+        self.max_messages_per_connection = int(os.environ.get('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+        self.keepalive_interval = float(os.environ.get('SMTP_KEEPALIVE_INTERVAL', '30'))
+        self._pool = None
+        self._session_depth = 0
+        self._session_lock = threading.Lock()
+        # Pools of async_session(), used by send_email_async: event loop -> [pool, session depth]
+        self._async_pools = {}
+        
+        # Shared send rate and retries on 421/45x replies
+        self.limiter = get_limiter('smtp')
         
         if not self.smtp_user or not self.smtp_password:
             logger.warning("SMTP credentials not configured. Email sending will fail.")
     
+    def _connect(self) -> smtplib.SMTP:
+        """Open an SMTP connection and run STARTTLS (unless disabled) and LOGIN"""
+        with track('smtp', 'connect'):
+            server = _SMTP(self.smtp_host, self.smtp_port)
+        try:
+            if self.use_starttls:
+                with track('smtp', 'starttls'):
+                    server.starttls()
+            with track('smtp', 'login'):
+                server.login(self.smtp_user, self.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+    
+    async def _connect_async(self) -> aiosmtplib.SMTP:
+        """_connect for asyncio: open an aiosmtplib connection, then STARTTLS (unless disabled) and LOGIN"""
+        server = _AsyncSMTP(hostname=self.smtp_host, port=self.smtp_port, start_tls=False)
+        with track('smtp', 'connect'):
+            await server.connect()
+        try:
+            if self.use_starttls:
+                with track('smtp', 'starttls'):
+                    await server.starttls()
+            with track('smtp', 'login'):
+                await server.login(self.smtp_user, self.smtp_password)
+        except Exception:
+            server.close()
+            raise
+        return server
+    
     def test_connection(self):
         """Test SMTP connection"""
         try:
-            server = smtplib.SMTP(self.smtp_host, self.smtp_port)
-            server.starttls()
-            server.login(self.smtp_user, self.smtp_password)
+            server = self._connect()
             server.quit()
             return True
         except Exception as e:
             raise Exception(f"SMTP connection failed: {str(e)}")
     
+    @contextmanager
+    def session(self, pool_size: int = None):
+        """Keep authenticated SMTP connections open for every send_email in the block
+        
+        ``pool_size`` overrides SMTP_POOL_SIZE. Sessions nest, for example
+        when several jobs run at once: the outermost one creates and closes
+        the pool, and each session grows it to the size it asked for, so the
+        pool is as large as the largest request.
+        """
+        size = pool_size or self.pool_size
+        with self._session_lock:
+            if self._session_depth == 0:
+                self._pool = SMTPConnectionPool(
+                    self._connect,
+                    size=size,
+                    max_messages=self.max_messages_per_connection,
+                    keepalive_interval=self.keepalive_interval
+                )
+            else:
+                self._pool.grow(size)
+            self._session_depth += 1
+        
+        try:
+            yield self
+        finally:
+            with self._session_lock:
+                self._session_depth -= 1
+                if self._session_depth == 0:
+                    self._pool.close()
+                    self._pool = None
+    
+    @asynccontextmanager
+    async def async_session(self, pool_size: int = None):
+        """session() for asyncio: pooled aiosmtplib connections for every send_email_async in the block
+        
+        Each event loop gets its own pool, since aiosmtplib connections
+        belong to the loop that opened them; sessions on the same loop nest
+        as in session().
+        """
+        size = pool_size or self.pool_size
+        loop = asyncio.get_running_loop()
+        with self._session_lock:
+            entry = self._async_pools.get(loop)
+            if entry is None:
+                pool = AsyncSMTPConnectionPool(
+                    self._connect_async,
+                    size=size,
+                    max_messages=self.max_messages_per_connection,
+                    keepalive_interval=self.keepalive_interval
+                )
+                entry = self._async_pools[loop] = [pool, 0]
+            else:
+                entry[0].grow(size)
+            entry[1] += 1
+        
+        try:
+            yield self
+        finally:
+            with self._session_lock:
+                entry[1] -= 1
+                closing = entry[1] == 0
+                if closing:
+                    del self._async_pools[loop]
+            if closing:
+                await entry[0].close()
+    
+    def _send_message(self, msg):
+        """Deliver a message over the session pool, or a one-off connection outside a session"""
+        pool = self._pool
+        if pool:
+            pool.send_message(msg)
+            return
+        
+        server = self._connect()
+        try:
+            _send_over(server, msg)
+        finally:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+    
+    async def _send_message_async(self, msg):
+        """_send_message for asyncio, over the running loop's session pool or a one-off connection"""
+        with self._session_lock:
+            entry = self._async_pools.get(asyncio.get_running_loop())
+        if entry:
+            await entry[0].send_message(msg)
+            return
+        
+        server = await self._connect_async()
+        try:
+            await _send_over_async(server, msg)
+        finally:
+            try:
+                await server.quit()
+            except Exception:
+                server.close()
+    
+    def _build_message(self, to_email: str, subject: str, html_body: str) -> MIMEMultipart:
+        """HTML email from the configured sender"""
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = formataddr((self.from_name, self.from_email))
+        msg['To'] = to_email
+        
+        # Add HTML body
+        html_part = MIMEText(html_body, 'html')
+        msg.attach(html_part)
+        return msg
+    
+    def render_message(self, to_email: str, subject: str, html_body: str) -> bytes:
+        """The message send_email would deliver, as .eml bytes"""
+        return self._build_message(to_email, subject, html_body).as_bytes()
+    
     def send_email(self, to_email: str, subject: str, html_body: str):
         """Send an email"""
         if not self.smtp_user or not self.smtp_password:
             raise Exception("SMTP credentials not configured")
         
         try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = formataddr((self.from_name, self.from_email))
-            msg['To'] = to_email
-            
-            # Add HTML body
-            html_part = MIMEText(html_body, 'html')
-            msg.attach(html_part)
+            msg = self._build_message(to_email, subject, html_body)
             
-            # Send email
-            server = smtplib.SMTP(self.smtp_host, self.smtp_port)
-            server.starttls()
-            server.login(self.smtp_user, self.smtp_password)
-            server.send_message(msg)
-            server.quit()
+            # Send email, over the session pool when one is open
+            self.limiter.call(self._send_message, msg)
             
             logger.info(f"Email sent successfully to {to_email}")
+        
+        except SMTPDeliveryUncertain as e:
+            # Kept as is, so the caller records the message as possibly delivered
+            logger.error(f"Delivery to {to_email} is uncertain: {str(e)}")
+            raise
+        except Exception as e:
+            logger.error(f"Error sending email to {to_email}: {str(e)}")
+            raise Exception(f"Failed to send email: {str(e)}")
+    
+    async def send_email_async(self, to_email: str, subject: str, html_body: str):
+        """send_email for asyncio"""
+        if not self.smtp_user or not self.smtp_password:
+            raise Exception("SMTP credentials not configured")
+        
+        try:
+            msg = self._build_message(to_email, subject, html_body)
+            
+            # Send email, over the async session pool when one is open
+            await self.limiter.call_async(self._send_message_async, msg)
             
+            logger.info(f"Email sent successfully to {to_email}")
+        
+        except SMTPDeliveryUncertain as e:
+            # Kept as is, so the caller records the message as possibly delivered
+            logger.error(f"Delivery to {to_email} is uncertain: {str(e)}")
+            raise
         except Exception as e:
             logger.error(f"Error sending email to {to_email}: {str(e)}")
             raise Exception(f"Failed to send email: {str(e)}")
-
@@ -0,0 +1,135 @@
+import json
+from typing import Dict
+
+from services.metrics import GENERATION_STREAM_ABORTS
+
+EMAIL_FIELDS = ('to', 'subject', 'emailBody')
+
+# Text a model may put around the JSON object despite the instructions
+CODE_FENCE = '```json'
+
+
+class EmailStreamParser:
+    """Incremental parser of the {to, subject, emailBody} object a model streams
+    
+    feed() takes the text as it arrives and raises as soon as the output
+    can no longer become a valid email: anything but a flat object of
+    those three string fields, a "to" that is not the row's recipient, or
+    an emailBody longer than ``max_body_chars``. The caller then stops the
+    stream instead of paying for the rest of a bad answer. Once the
+    closing brace is read, email() returns the fields without parsing the
+    text again.
+    """
+    
+    def __init__(self, expected_to: str = None, max_body_chars: int = 8000):
+        self.expected_to = (expected_to or '').strip().lower()
+        self.max_body_chars = max_body_chars
+        self.fields = {}
+        self.complete = False
+        self._state = 'start'
+        self._preamble = ''
+        # Raw (still escaped) text of the string being read, and whether it is a key
+        self._raw = []
+        self._in_key = False
+        self._escaped = False
+        self._key = None
+    
+    def feed(self, text: str):
+        """Consume the next piece of streamed text"""
+        for char in text:
+            self._step(char)
+    
+    def email(self) -> Dict[str, str]:
+        """The parsed email; raises when the stream ended before the object was complete"""
+        if not self.complete:
+            self._abort('incomplete', "AI response ended before the email JSON was complete")
+        return dict(self.fields)
+    
+    def _step(self, char: str):
+        state = self._state
+        if state == 'string':
+            self._string_char(char)
+        elif char.isspace():
+            return
+        elif state == 'start':
+            if char == '{':
+                self._state = 'key_or_end'
+            else:
+                self._preamble += char
+                if not CODE_FENCE.startswith(self._preamble):
+                    self._abort('structure', "AI response does not start with a JSON object")
+        elif state in ('key_or_end', 'key'):
+            if char == '"':
+                self._start_string(in_key=True)
+            elif char == '}' and state == 'key_or_end':
+                self._finish()
+            else:
+                self._abort('structure', f"Unexpected {char!r} where a field name belongs in the AI response")
+        elif state == 'colon':
+            if char != ':':
+                self._abort('structure', f"Unexpected {char!r} after field {self._key!r} in the AI response")
+            self._state = 'value'
+        elif state == 'value':
+            if char != '"':
+                self._abort('structure', f"Field {self._key!r} of the AI response is not a string")
+            self._start_string(in_key=False)
+        elif state == 'comma_or_end':
+            if char == ',':
+                self._state = 'key'
+            elif char == '}':
+                self._finish()
+            else:
+                self._abort('structure', f"Unexpected {char!r} after field {self._key!r} in the AI response")
+        elif state == 'done' and char != '`':
+            self._abort('structure', "AI response continues after the email JSON")
+    
+    def _start_string(self, in_key: bool):
+        self._state = 'string'
+        self._in_key = in_key
+        self._raw = []
+        self._escaped = False
+    
+    def _string_char(self, char: str):
+        if self._escaped:
+            self._escaped = False
+        elif char == '\\':
+            self._escaped = True
+        elif char == '"':
+            self._end_string()
+            return
+        self._raw.append(char)
+        if not self._in_key and self._key == 'emailBody' and len(self._raw) > self.max_body_chars:
+            self._abort('body_too_long', f"AI email body is longer than {self.max_body_chars} characters")
+    
+    def _end_string(self):
+        try:
+            # json decodes the escapes, including surrogate pairs, and rejects raw control characters
+            value = json.loads('"' + ''.join(self._raw) + '"')
+        except ValueError:
+            self._abort('structure', "AI response holds an invalid JSON string")
+        
+        if self._in_key:
+            if value not in EMAIL_FIELDS:
+                self._abort('structure', f"AI response has unexpected field {value!r}")
+            if value in self.fields:
+                self._abort('structure', f"AI response repeats field {value!r}")
+            self._key = value
+            self._state = 'colon'
+            return
+        
+        if self._key == 'to' and self.expected_to and value.strip().lower() != self.expected_to:
+            self._abort('recipient', f"AI email is addressed to {value}, not the row's email_to_use")
+        self.fields[self._key] = value
+        self._state = 'comma_or_end'
+    
+    def _finish(self):
+        missing = [field for field in EMAIL_FIELDS if not self.fields.get(field, '').strip()]
+        if missing:
+            self._abort('structure', f"AI response is missing {', '.join(missing)}")
+        self.complete = True
+        self._state = 'done'
+    
+    @staticmethod
+    def _abort(reason: str, message: str):
+        GENERATION_STREAM_ABORTS.inc(reason=reason)
+        raise Exception(message)
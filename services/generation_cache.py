@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCache:
+    """Content-addressed SQLite cache of generated emails with least-recently-used eviction
+    
+    Entries are keyed by a hash of everything the model sees (the row, the
+    knowledge base, the prompt templates and the model name), so a rerun after
+    a failed send reuses the email instead of generating it again, and any
+    change to those inputs is a miss. At most ``max_entries`` emails are kept;
+    the least recently used ones are evicted first.
+    """
+    
+    def __init__(self, path: str = None, max_entries: int = None):
+        self.path = path or os.environ.get('GENERATION_CACHE_PATH', os.path.join('.cache', 'generation_cache.db'))
+        self.max_entries = max_entries or int(os.environ.get('GENERATION_CACHE_MAX_ENTRIES', '10000'))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS generations (
+                    key TEXT PRIMARY KEY,
+                    email TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_generations_last_used ON generations (last_used)')
+            self._count = self._conn.execute('SELECT COUNT(*) FROM generations').fetchone()[0]
+    
+    @staticmethod
+    def make_key(company_data: Dict, knowledge_base: str, instructions: str, row_template: str, model: str,
+                 retrieval: Dict = None) -> str:
+        """Hash of the generation inputs, independent of the row's column order
+        
+        ``instructions`` is the shared prompt prefix. The knowledge base text is
+        hashed on its own since, with retrieval, the prefix does not hold it;
+        ``retrieval`` then holds the settings (top k, token budget, chunk size)
+        that decide which of its chunks a row's prompt gets.
+        """
+        inputs = {
+            'row': company_data,
+            'knowledge_base': knowledge_base,
+            'instructions': instructions,
+            'row_template': row_template,
+            'model': model
+        }
+        if retrieval:
+            inputs['retrieval'] = retrieval
+        payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, key: str) -> Optional[Dict[str, str]]:
+        """The cached {to, subject, emailBody} for a key, marking it recently used, or None"""
+        with self._lock, self._conn:
+            row = self._conn.execute('SELECT email FROM generations WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE generations SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+    
+    def put(self, key: str, email_content: Dict[str, str]):
+        """Store a generated email, evicting the least recently used entries beyond max_entries"""
+        email = json.dumps({field: email_content[field] for field in ('to', 'subject', 'emailBody')}, ensure_ascii=False)
+        with self._lock, self._conn:
+            inserted = self._conn.execute(
+                'INSERT OR IGNORE INTO generations (key, email, last_used) VALUES (?, ?, ?)',
+                (key, email, time.time())
+            ).rowcount
+            if not inserted:
+                self._conn.execute(
+                    'UPDATE generations SET email = ?, last_used = ? WHERE key = ?',
+                    (email, time.time(), key)
+                )
+                return
+            
+            self._count += 1
+            excess = self._count - self.max_entries
+            if excess > 0:
+                self._count -= self._conn.execute(
+                    'DELETE FROM generations WHERE key IN '
+                    '(SELECT key FROM generations ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                ).rowcount
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
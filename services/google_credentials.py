@@ -0,0 +1,65 @@
+import os
+import json
+import logging
+import threading
+from typing import Optional
+
+from google.oauth2.credentials import Credentials
+from google.auth.transport.requests import Request
+
+logger = logging.getLogger(__name__)
+
+# Read-only scopes of both Google services; one token covers Sheets and Docs
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets.readonly',
+    'https://www.googleapis.com/auth/documents.readonly'
+]
+
+_credentials = None
+_load_lock = threading.Lock()
+_refresh_lock = threading.Lock()
+
+
+def _load() -> Optional[Credentials]:
+    """Credentials from GOOGLE_CREDENTIALS_JSON, else from GOOGLE_TOKEN_FILE"""
+    creds_json = os.environ.get('GOOGLE_CREDENTIALS_JSON')
+    if creds_json:
+        try:
+            return Credentials.from_authorized_user_info(json.loads(creds_json), SCOPES)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Ignoring invalid GOOGLE_CREDENTIALS_JSON: {str(e)}")
+            return None
+    
+    token_path = os.environ.get('GOOGLE_TOKEN_FILE', 'token.json')
+    if os.path.exists(token_path):
+        return Credentials.from_authorized_user_file(token_path, SCOPES)
+    return None
+
+
+def get_credentials() -> Optional[Credentials]:
+    """Process-wide Google credentials, loaded once and shared by the Sheets and Docs services
+    
+    Loading does no network I/O: an expired token is refreshed by
+    ensure_valid() right before the first request that needs it. Returns
+    None when no credentials are configured or they cannot be refreshed;
+    only a successful load is cached, so credentials added later (a token
+    file written by the OAuth flow, say) are picked up by the next call.
+    """
+    global _credentials
+    with _load_lock:
+        if _credentials is None:
+            creds = _load()
+            if creds and not creds.valid and not creds.refresh_token:
+                logger.warning("Google credentials are expired and have no refresh token.")
+                creds = None
+            _credentials = creds
+        return _credentials
+
+
+def ensure_valid(creds: Credentials):
+    """Refresh expired credentials once, however many threads or services noticed"""
+    if creds.valid:
+        return
+    with _refresh_lock:
+        if not creds.valid:
+            creds.refresh(Request())
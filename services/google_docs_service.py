@@ -1,15 +1,19 @@
 import os
 import logging
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import json
+import httpx
+import threading
+from urllib.parse import quote
+from typing import Optional
 
-logger = logging.getLogger(__name__)
+from services.google_credentials import get_credentials, ensure_valid
+from services.google_rest import AsyncGoogleClient, DOCS_API_URL
+from services.rate_limiter import get_limiter
+from services.metrics import timed_call, timed_call_async
 
-# Scopes required for Google Docs API
-SCOPES = ['https://www.googleapis.com/auth/documents.readonly']
+logger = logging.getLogger(__name__)
 
 
 class GoogleDocsService:
@@ -18,34 +22,25 @@ class GoogleDocsService:
     def __init__(self):
         self.document_id = os.environ.get('GOOGLE_DOCS_DOCUMENT_ID')
         
-        # Try to get credentials from environment variable (JSON string)
-        creds_json = os.environ.get('GOOGLE_CREDENTIALS_JSON')
-        if creds_json:
-            try:
-                creds_dict = json.loads(creds_json)
-                self.creds = Credentials.from_authorized_user_info(creds_dict, SCOPES)
-            except:
-                self.creds = None
-        else:
-            # Try to load from token file
-            self.creds = self._load_credentials()
-        
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
-            else:
-                logger.warning("Google Docs credentials not configured. Please set up OAuth.")
-                self.service = None
-                return
-        
-        self.service = build('docs', 'v1', credentials=self.creds)
-    
-    def _load_credentials(self):
-        """Load credentials from token file"""
-        token_path = os.environ.get('GOOGLE_TOKEN_FILE', 'token.json')
-        if os.path.exists(token_path):
-            return Credentials.from_authorized_user_file(token_path, SCOPES)
-        return None
+        # Extracted text cached per document id, keyed by revisionId
+        self.cache_dir = os.environ.get('GOOGLE_DOCS_CACHE_DIR', os.path.join('.cache', 'google_docs'))
+        self.revision_id = None
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+        self.limiter = get_limiter('docs')  # Shared read quota and retries on 429/5xx
+        
+        # Shared with GoogleSheetsService; expired tokens are refreshed on first use, not here
+        self.creds = get_credentials()
+        if not self.creds:
+            logger.warning("Google Docs credentials not configured. Please set up OAuth.")
+            self.service = None
+            self.rest = None
+            return
+        
+        # Bundled discovery document: no network I/O and no discovery cache on disk
+        self.service = build('docs', 'v1', credentials=self.creds, static_discovery=True, cache_discovery=False)
+        # REST client for the async readers
+        self.rest = AsyncGoogleClient(self.creds)
     
     def test_connection(self):
         """Test Google Docs API connection"""
@@ -56,34 +51,148 @@ class GoogleDocsService:
             if not self.document_id:
                 raise Exception("GOOGLE_DOCS_DOCUMENT_ID not configured")
             
-            # Try to read the document
-            doc = self.service.documents().get(documentId=self.document_id).execute()
+            # Try to read the document's revision (no need to download the body)
+            self.get_revision_id()
             return True
         except HttpError as e:
             raise Exception(f"Google Docs connection failed: {str(e)}")
     
+    def _execute(self, operation: str, request):
+        """Execute an API request under the Docs rate limit, retrying quota errors and timing each attempt"""
+        ensure_valid(self.creds)
+        return self.limiter.call(timed_call, 'docs', operation, request.execute)
+    
+    def get_revision_id(self) -> str:
+        """Get the current revisionId of the document with a fields-limited request"""
+        doc = self._execute('get_revision', self.service.documents().get(
+            documentId=self.document_id,
+            fields='revisionId'
+        ))
+        return doc.get('revisionId')
+    
     def get_document(self) -> str:
-        """Get the full content of a Google Doc"""
+        """Get the full content of a Google Doc
+        
+        Only the revisionId is requested when the text for that revision is
+        already cached in memory or on disk.
+        """
         if not self.service or not self.document_id:
             raise Exception("Google Docs service not configured")
         
         try:
-            doc = self.service.documents().get(documentId=self.document_id).execute()
+            revision_id = self.get_revision_id()
             
-            # Extract text content from the document
-            content = doc.get('body', {}).get('content', [])
-            text_parts = []
+            cached = self._get_cached(self.document_id)
+            if cached and revision_id and cached.get('revision_id') == revision_id:
+                logger.info(f"Knowledge base unchanged (revision {revision_id}), using cached text")
+                self.revision_id = revision_id
+                return cached['text']
             
-            for element in content:
-                if 'paragraph' in element:
-                    paragraph = element['paragraph']
-                    for para_element in paragraph.get('elements', []):
-                        if 'textRun' in para_element:
-                            text_parts.append(para_element['textRun'].get('content', ''))
-            
-            return '\n'.join(text_parts)
+            doc = self._execute('get_document', self.service.documents().get(documentId=self.document_id))
+            text = self._extract_text(doc)
             
+            # The full fetch may have seen a newer revision than the check above
+            revision_id = doc.get('revisionId', revision_id)
+            self._set_cached(self.document_id, revision_id, text)
+            self.revision_id = revision_id
+            return text
+        
         except HttpError as e:
             logger.error(f"Error fetching document: {str(e)}")
             raise Exception(f"Failed to fetch document: {str(e)}")
-
+    
+    async def aclose(self):
+        """Close the REST client used by the async readers"""
+        if self.rest:
+            await self.rest.aclose()
+    
+    async def _get_async(self, operation: str, fields: str = None) -> dict:
+        """documents().get over the REST API, under the same rate limit and metrics"""
+        url = f"{DOCS_API_URL}/documents/{quote(self.document_id)}"
+        params = {'fields': fields} if fields else None
+        return await self.limiter.call_async(timed_call_async, 'docs', operation, self.rest.get_json, url, params)
+    
+    async def get_document_async(self) -> str:
+        """get_document for asyncio, sharing its revision cache"""
+        if not self.service or not self.document_id:
+            raise Exception("Google Docs service not configured")
+        
+        try:
+            revision_id = (await self._get_async('get_revision', fields='revisionId')).get('revisionId')
+            
+            cached = self._get_cached(self.document_id)
+            if cached and revision_id and cached.get('revision_id') == revision_id:
+                logger.info(f"Knowledge base unchanged (revision {revision_id}), using cached text")
+                self.revision_id = revision_id
+                return cached['text']
+            
+            doc = await self._get_async('get_document')
+            text = self._extract_text(doc)
+            
+            revision_id = doc.get('revisionId', revision_id)
+            self._set_cached(self.document_id, revision_id, text)
+            self.revision_id = revision_id
+            return text
+        
+        except httpx.HTTPError as e:
+            logger.error(f"Error fetching document: {str(e)}")
+            raise Exception(f"Failed to fetch document: {str(e)}")
+    
+    @staticmethod
+    def _extract_text(doc: dict) -> str:
+        """Flatten the paragraphs of a Docs body into plain text"""
+        content = doc.get('body', {}).get('content', [])
+        text_parts = []
+        
+        for element in content:
+            if 'paragraph' in element:
+                paragraph = element['paragraph']
+                for para_element in paragraph.get('elements', []):
+                    if 'textRun' in para_element:
+                        text_parts.append(para_element['textRun'].get('content', ''))
+        
+        return '\n'.join(text_parts)
+    
+    def _cache_path(self, document_id: str) -> str:
+        """Path of the on-disk cache entry for a document"""
+        return os.path.join(self.cache_dir, f"{document_id}.json")
+    
+    def _get_cached(self, document_id: str) -> Optional[dict]:
+        """Cached {revision_id, text} for a document, from memory or disk"""
+        with self._cache_lock:
+            if document_id in self._cache:
+                return self._cache[document_id]
+        
+        path = self._cache_path(document_id)
+        if not os.path.exists(path):
+            return None
+        
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable knowledge base cache {path}: {str(e)}")
+            return None
+        
+        with self._cache_lock:
+            self._cache[document_id] = entry
+        return entry
+    
+    def _set_cached(self, document_id: str, revision_id: str, text: str):
+        """Store the text for a revision in memory and on disk"""
+        entry = {'revision_id': revision_id, 'text': text}
+        with self._cache_lock:
+            self._cache[document_id] = entry
+        
+        if not revision_id:
+            return
+        
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._cache_path(document_id)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write knowledge base cache: {str(e)}")
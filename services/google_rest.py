@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import threading
+
+import httpx
+
+from services.google_credentials import ensure_valid
+
+logger = logging.getLogger(__name__)
+
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4'
+DOCS_API_URL = 'https://docs.googleapis.com/v1'
+
+
+class AsyncGoogleClient:
+    """Async GET client for the Google REST endpoints, authorized with google-auth credentials
+    
+    Used by the *_async readers of GoogleSheetsService and GoogleDocsService
+    instead of googleapiclient, which only blocks. One httpx.AsyncClient is
+    kept per event loop, because its connections cannot be shared across loops.
+    """
+    
+    def __init__(self, creds, timeout: float = 30.0):
+        self.creds = creds
+        self.timeout = timeout
+        # event loop -> httpx.AsyncClient
+        self._clients = {}
+        self._lock = threading.Lock()
+    
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is None:
+                # Loops that ended without aclose() cannot close their clients any more
+                for closed in [other for other in self._clients if other.is_closed()]:
+                    del self._clients[closed]
+                client = self._clients[loop] = httpx.AsyncClient(timeout=self.timeout)
+        return client
+    
+    async def get_json(self, url: str, params: dict = None) -> dict:
+        """GET a JSON resource; raises httpx.HTTPStatusError on error statuses"""
+        if not self.creds.valid:
+            await asyncio.get_running_loop().run_in_executor(None, ensure_valid, self.creds)
+        
+        response = await self._get_client().get(
+            url,
+            params=params,
+            headers={'Authorization': f'Bearer {self.creds.token}'}
+        )
+        response.raise_for_status()
+        return response.json()
+    
+    async def aclose(self):
+        """Close the HTTP client of the running loop; other loops' clients stay open"""
+        with self._lock:
+            client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
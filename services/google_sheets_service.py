@@ -1,53 +1,43 @@
 import os
 import logging
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-import json
+import httpx
+from urllib.parse import quote
+from typing import AsyncIterator, Iterator, Tuple
 
-logger = logging.getLogger(__name__)
+from services.lead_sources import LeadSource
+from services.google_credentials import get_credentials, ensure_valid
+from services.google_rest import AsyncGoogleClient, SHEETS_API_URL
+from services.rate_limiter import get_limiter
+from services.metrics import timed_call, timed_call_async
 
-# Scopes required for Google Sheets API
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets.readonly']
+logger = logging.getLogger(__name__)
 
 
-class GoogleSheetsService:
+class GoogleSheetsService(LeadSource):
     """Service for interacting with Google Sheets API"""
     
+    kind = 'sheets'
+    
     def __init__(self):
         self.document_id = os.environ.get('GOOGLE_SHEETS_DOCUMENT_ID')
         self.sheet_id = os.environ.get('GOOGLE_SHEETS_SHEET_ID', '0')  # Default to first sheet
+        self.chunk_size = int(os.environ.get('GOOGLE_SHEETS_CHUNK_SIZE', '200'))  # Rows per range read
+        self.limiter = get_limiter('sheets')  # Shared read quota and retries on 429/5xx
         
-        # Try to get credentials from environment variable (JSON string)
-        creds_json = os.environ.get('GOOGLE_CREDENTIALS_JSON')
-        if creds_json:
-            try:
-                creds_dict = json.loads(creds_json)
-                self.creds = Credentials.from_authorized_user_info(creds_dict, SCOPES)
-            except:
-                self.creds = None
-        else:
-            # Try to load from token file
-            self.creds = self._load_credentials()
-        
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                self.creds.refresh(Request())
-            else:
-                logger.warning("Google Sheets credentials not configured. Please set up OAuth.")
-                self.service = None
-                return
+        # Shared with GoogleDocsService; expired tokens are refreshed on first use, not here
+        self.creds = get_credentials()
+        if not self.creds:
+            logger.warning("Google Sheets credentials not configured. Please set up OAuth.")
+            self.service = None
+            self.rest = None
+            return
         
-        self.service = build('sheets', 'v4', credentials=self.creds)
-    
-    def _load_credentials(self):
-        """Load credentials from token file"""
-        token_path = os.environ.get('GOOGLE_TOKEN_FILE', 'token.json')
-        if os.path.exists(token_path):
-            return Credentials.from_authorized_user_file(token_path, SCOPES)
-        return None
+        # Bundled discovery document: no network I/O and no discovery cache on disk
+        self.service = build('sheets', 'v4', credentials=self.creds, static_discovery=True, cache_discovery=False)
+        # REST client for the async readers
+        self.rest = AsyncGoogleClient(self.creds)
     
     def test_connection(self):
         """Test Google Sheets API connection"""
@@ -59,14 +49,28 @@ class GoogleSheetsService:
                 raise Exception("GOOGLE_SHEETS_DOCUMENT_ID not configured")
             
             # Try to read a single cell
-            result = self.service.spreadsheets().values().get(
+            result = self._execute('test_connection', self.service.spreadsheets().values().get(
                 spreadsheetId=self.document_id,
                 range='A1'
-            ).execute()
+            ))
             return True
         except HttpError as e:
             raise Exception(f"Google Sheets connection failed: {str(e)}")
     
+    def _execute(self, operation: str, request):
+        """Execute an API request under the Sheets rate limit, retrying quota errors and timing each attempt"""
+        ensure_valid(self.creds)
+        return self.limiter.call(timed_call, 'sheets', operation, request.execute)
+    
+    def _get_headers(self) -> list:
+        """Get the header row (row 1) used as column names, however many columns it has"""
+        header_result = self._execute('read_headers', self.service.spreadsheets().values().get(
+            spreadsheetId=self.document_id,
+            range='1:1'
+        ))
+        
+        return header_result.get('values', [[]])[0] if header_result.get('values') else []
+    
     def get_row_by_index(self, row_index: int) -> dict:
         """Get a row from Google Sheets by index (1-based)"""
         if not self.service or not self.document_id:
@@ -74,34 +78,94 @@ class GoogleSheetsService:
         
         try:
             # First, get the header row to know column names
-            header_range = f'A1:Z1'
-            header_result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.document_id,
-                range=header_range
-            ).execute()
-            
-            headers = header_result.get('values', [[]])[0] if header_result.get('values') else []
+            headers = self._get_headers()
             
             # Get the specific row
-            row_range = f'A{row_index}:Z{row_index}'
-            result = self.service.spreadsheets().values().get(
+            row_range = f'{row_index}:{row_index}'
+            result = self._execute('read_row', self.service.spreadsheets().values().get(
                 spreadsheetId=self.document_id,
                 range=row_range
-            ).execute()
+            ))
             
             values = result.get('values', [[]])[0] if result.get('values') else []
             
             # Convert to dictionary
-            row_data = {}
-            for i, header in enumerate(headers):
-                if i < len(values):
-                    row_data[header] = values[i]
-                else:
-                    row_data[header] = ''
-            
-            return row_data
-            
+            return self._row_to_dict(headers, values)
+        
         except HttpError as e:
             logger.error(f"Error fetching row {row_index}: {str(e)}")
             raise Exception(f"Failed to fetch row: {str(e)}")
-
+    
+    def get_rows(self, start_row: int, end_row: int, chunk_size: int = None) -> Iterator[Tuple[int, dict]]:
+        """Lazily yield (row_index, row_data) for rows start_row..end_row (1-based, inclusive)
+        
+        The header row is read once and the range is read in chunks of
+        ``chunk_size`` rows, one ``values().get`` call per chunk, instead of
+        two API calls per row.
+        """
+        if not self.service or not self.document_id:
+            raise Exception("Google Sheets service not configured")
+        
+        chunk_size = chunk_size or self.chunk_size
+        
+        try:
+            headers = self._get_headers()
+        except HttpError as e:
+            logger.error(f"Error fetching header row: {str(e)}")
+            raise Exception(f"Failed to fetch header row: {str(e)}")
+        
+        for chunk_start in range(start_row, end_row + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_row)
+            
+            try:
+                result = self._execute('read_rows', self.service.spreadsheets().values().get(
+                    spreadsheetId=self.document_id,
+                    range=f'{chunk_start}:{chunk_end}'
+                ))
+            except HttpError as e:
+                logger.error(f"Error fetching rows {chunk_start}-{chunk_end}: {str(e)}")
+                raise Exception(f"Failed to fetch rows {chunk_start}-{chunk_end}: {str(e)}")
+            
+            # The API drops trailing empty rows, so pad the chunk back out
+            values = result.get('values', [])
+            for offset, row_index in enumerate(range(chunk_start, chunk_end + 1)):
+                row_values = values[offset] if offset < len(values) else []
+                yield row_index, self._row_to_dict(headers, row_values)
+    
+    async def aclose(self):
+        """Close the REST client used by the async readers"""
+        if self.rest:
+            await self.rest.aclose()
+    
+    async def _get_values_async(self, operation: str, value_range: str) -> list:
+        """values().get over the REST API, under the same rate limit and metrics as _execute"""
+        url = f"{SHEETS_API_URL}/spreadsheets/{quote(self.document_id)}/values/{quote(value_range)}"
+        result = await self.limiter.call_async(timed_call_async, 'sheets', operation, self.rest.get_json, url)
+        return result.get('values', [])
+    
+    async def get_rows_async(self, start_row: int, end_row: int, chunk_size: int = None) -> AsyncIterator[Tuple[int, dict]]:
+        """get_rows for asyncio: the same chunked range reads, made with httpx instead of googleapiclient"""
+        if not self.service or not self.document_id:
+            raise Exception("Google Sheets service not configured")
+        
+        chunk_size = chunk_size or self.chunk_size
+        
+        try:
+            header_values = await self._get_values_async('read_headers', '1:1')
+        except httpx.HTTPError as e:
+            logger.error(f"Error fetching header row: {str(e)}")
+            raise Exception(f"Failed to fetch header row: {str(e)}")
+        headers = header_values[0] if header_values else []
+        
+        for chunk_start in range(start_row, end_row + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_row)
+            
+            try:
+                values = await self._get_values_async('read_rows', f'{chunk_start}:{chunk_end}')
+            except httpx.HTTPError as e:
+                logger.error(f"Error fetching rows {chunk_start}-{chunk_end}: {str(e)}")
+                raise Exception(f"Failed to fetch rows {chunk_start}-{chunk_end}: {str(e)}")
+            
+            for offset, row_index in enumerate(range(chunk_start, chunk_end + 1)):
+                row_values = values[offset] if offset < len(values) else []
+                yield row_index, self._row_to_dict(headers, row_values)
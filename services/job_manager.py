@@ -0,0 +1,161 @@
+import os
+import uuid
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Job lifecycle states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+FINISHED_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+
+class Job:
+    """A background run tracked by JobManager"""
+    
+    def __init__(self, job_id: str, params: Dict[str, Any], event_buffer: int = 1000):
+        self.id = job_id
+        self.params = params
+        self.status = JOB_QUEUED
+        self.results = None
+        self.error = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.future = None
+        
+        # Recent progress events, numbered so stream readers can resume
+        self._events = deque(maxlen=event_buffer)
+        self._event_seq = 0
+        self._event_cond = threading.Condition()
+    
+    def update_results(self, results: Dict[str, Any]):
+        """Progress callback: keep a reference to the live results of the run"""
+        self.results = results
+    
+    def add_event(self, event: Dict[str, Any]):
+        """Event callback: number the event, buffer it and wake stream readers"""
+        with self._event_cond:
+            self._event_seq += 1
+            self._events.append(dict(event, id=self._event_seq))
+            self._event_cond.notify_all()
+    
+    def events_after(self, last_id: int, timeout: float = None) -> list:
+        """Events newer than ``last_id``, waiting up to ``timeout`` seconds for one to arrive
+        
+        Events that have already fallen out of the buffer are skipped.
+        """
+        with self._event_cond:
+            if self._event_seq <= last_id and self.status not in FINISHED_STATES:
+                self._event_cond.wait(timeout)
+            return [event for event in self._events if event['id'] > last_id]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Snapshot of the job that is safe to serialize while the run is still going"""
+        results = None
+        if self.results is not None:
+            results = dict(self.results)
+            for key in ('errors', 'details'):
+                if key in results:
+                    results[key] = list(results[key])
+        
+        return {
+            'id': self.id,
+            'status': self.status,
+            'params': self.params,
+            'results': results,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'cancel_requested': self.cancel_event.is_set()
+        }
+
+
+class JobManager:
+    """Runs workflow executions in a worker pool so HTTP requests return immediately"""
+    
+    def __init__(self):
+        self.max_workers = int(os.environ.get('JOB_WORKERS', '2'))
+        self.history_limit = int(os.environ.get('JOB_HISTORY_LIMIT', '100'))
+        self.event_buffer = int(os.environ.get('JOB_EVENT_BUFFER', '1000'))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='outreach-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def submit(self, target: Callable[[Job], Dict[str, Any]], params: Dict[str, Any] = None) -> Job:
+        """Queue ``target(job)`` and return the Job right away
+        
+        The target should honour ``job.cancel_event`` and report through
+        ``job.update_results`` and ``job.add_event``; its return value becomes
+        the final results.
+        """
+        job = Job(uuid.uuid4().hex, params or {}, self.event_buffer)
+        
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        
+        job.future = self._executor.submit(self._run, job, target)
+        logger.info(f"Queued job {job.id}: {job.params}")
+        return job
+    
+    def _run(self, job: Job, target: Callable):
+        """Worker body: run the target and record how it finished"""
+        if job.cancel_event.is_set():
+            self._finish(job, JOB_CANCELLED)
+            return
+        
+        job.status = JOB_RUNNING
+        job.started_at = datetime.now().isoformat()
+        
+        try:
+            job.results = target(job)
+            self._finish(job, JOB_CANCELLED if job.cancel_event.is_set() else JOB_COMPLETED)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            self._finish(job, JOB_FAILED)
+    
+    def _finish(self, job: Job, status: str):
+        """Record the final status and tell stream readers the job is over"""
+        job.status = status
+        job.finished_at = datetime.now().isoformat()
+        job.add_event({'type': 'done', 'status': status, 'error': job.error})
+        logger.info(f"Job {job.id} {status}")
+    
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the history limit"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        while len(self._jobs) > self.history_limit and finished:
+            del self._jobs[finished.pop(0)]
+    
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id"""
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def list(self) -> list:
+        """All known jobs, newest first"""
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+    
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Ask a job to stop; queued jobs never start and running ones stop before the next row"""
+        job = self.get(job_id)
+        if job and job.status not in FINISHED_STATES:
+            job.cancel_event.set()
+            if job.status == JOB_QUEUED and job.future and job.future.cancel():
+                self._finish(job, JOB_CANCELLED)
+            logger.info(f"Cancellation requested for job {job.id}")
+        return job
@@ -0,0 +1,163 @@
+import re
+import math
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List
+
+# Rough tokens-per-character ratio of English text for OpenAI tokenizers
+CHARS_PER_TOKEN = 4
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Indexes kept in memory, one per knowledge base text (so per document revision)
+INDEX_CACHE_SIZE = 4
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have how in into is it its of on or our so
+that the their them they this to was we were what when which who will with you your
+""".split())
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of a text, without a tokenizer"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words and numbers of a text, without stopwords"""
+    return [word for word in _WORD_RE.findall(text.lower()) if word not in STOPWORDS]
+
+
+def chunk_text(text: str, chunk_tokens: int) -> List[str]:
+    """Split a document into chunks of whole paragraphs of up to about ``chunk_tokens`` tokens
+    
+    A short line ending in a colon or without final punctuation is taken
+    as a heading and kept with the paragraphs after it. A paragraph longer
+    than a chunk becomes a chunk of its own.
+    """
+    paragraphs = [paragraph.strip() for paragraph in re.split(r'\n\s*\n', text) if paragraph.strip()]
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in paragraphs:
+        tokens = estimate_tokens(paragraph)
+        heading_only = len(current) == 1 and _is_heading(current[0])
+        if current and current_tokens + tokens > chunk_tokens and not heading_only:
+            chunks.append('\n\n'.join(current))
+            current = []
+            current_tokens = 0
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def _is_heading(paragraph: str) -> bool:
+    """Whether a paragraph looks like a section heading"""
+    return '\n' not in paragraph and len(paragraph) <= 80 and not paragraph.endswith(('.', '!', '?'))
+
+
+class KnowledgeIndex:
+    """BM25 index over the chunks of a knowledge base, built locally with no network calls
+    
+    select() picks the chunks most relevant to a lead that fit a token
+    budget, so each prompt carries only the sections that lead needs
+    instead of the whole document.
+    """
+    
+    def __init__(self, text: str, chunk_tokens: int = 200):
+        self.chunks = chunk_text(text, chunk_tokens)
+        self.chunk_token_counts = [estimate_tokens(chunk) for chunk in self.chunks]
+        self.document_tokens = estimate_tokens(text)
+        
+        # Inverted index: term -> [(chunk id, term frequency)]
+        self.postings: Dict[str, List] = {}
+        self.lengths = []
+        for chunk_id, chunk in enumerate(self.chunks):
+            terms = Counter(tokenize(chunk))
+            self.lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                self.postings.setdefault(term, []).append((chunk_id, frequency))
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        
+        count = len(self.chunks)
+        self.idf = {
+            term: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+    
+    def scores(self, query: str) -> Dict[int, float]:
+        """BM25 score of every chunk that shares a term with the query"""
+        scores = {}
+        for term, query_frequency in Counter(tokenize(query)).items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for chunk_id, frequency in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / (self.average_length or 1))
+                score = idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + score * query_frequency
+        return scores
+    
+    def select(self, query: str, token_budget: int, top_k: int) -> str:
+        """Text of the best ``top_k`` chunks for a query that fit ``token_budget``, in document order"""
+        return self.join(self.select_ids(query, token_budget, top_k))
+    
+    def select_ids(self, query: str, token_budget: int, top_k: int) -> List[int]:
+        """Ids of the best ``top_k`` chunks for a query that fit ``token_budget``
+        
+        Chunks that match nothing in the query fill any room left in the
+        budget in document order, so a lead with no matching terms still
+        gets the opening (usually general) sections.
+        """
+        scores = self.scores(query)
+        ranked = sorted(scores, key=lambda chunk_id: (-scores[chunk_id], chunk_id))
+        ranked += [chunk_id for chunk_id in range(len(self.chunks)) if chunk_id not in scores]
+        
+        chosen = []
+        used = 0
+        for chunk_id in ranked:
+            if len(chosen) >= top_k:
+                break
+            tokens = self.chunk_token_counts[chunk_id]
+            if used + tokens > token_budget:
+                continue
+            chosen.append(chunk_id)
+            used += tokens
+        return chosen
+    
+    def join(self, chunk_ids) -> str:
+        """Text of the given chunks in document order"""
+        return '\n\n'.join(self.chunks[chunk_id] for chunk_id in sorted(set(chunk_ids)))
+    
+    def stats(self) -> Dict[str, int]:
+        """Size of the indexed document"""
+        return {'chunks': len(self.chunks), 'document_tokens': self.document_tokens, 'terms': len(self.postings)}
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_index(text: str, chunk_tokens: int = 200) -> KnowledgeIndex:
+    """Index of a knowledge base text, built once per distinct text (so once per document revision)"""
+    key = (hashlib.sha256(text.encode('utf-8')).hexdigest(), chunk_tokens)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+            return index
+    
+    index = KnowledgeIndex(text, chunk_tokens)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,408 @@
+import os
+import io
+import csv
+import asyncio
+import mmap
+import bisect
+import sqlite3
+import logging
+import threading
+from array import array
+from pathlib import Path
+from typing import AsyncIterator, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Values accepted by LEAD_SOURCE
+LEAD_SOURCE_TYPES = ('sheets', 'csv', 'parquet', 'sqlite')
+
+# Rows parsed per step while streaming a range
+DEFAULT_CHUNK_SIZE = 200
+
+UTF8_BOM = b'\xef\xbb\xbf'
+
+
+class LeadSource:
+    """Row-addressed source of leads for OutreachAgent
+    
+    Rows are numbered like a spreadsheet: row 1 holds the column names and
+    data starts at row 2. get_rows(start_row, end_row) lazily yields
+    (row_index, row_data) for every index in the inclusive range, with an
+    all-empty row_data for blank or missing rows.
+    """
+    
+    kind = None
+    
+    def test_connection(self):
+        raise NotImplementedError
+    
+    def get_rows(self, start_row: int, end_row: int, chunk_size: int = None) -> Iterator[Tuple[int, dict]]:
+        raise NotImplementedError
+    
+    async def get_rows_async(self, start_row: int, end_row: int, chunk_size: int = None) -> AsyncIterator[Tuple[int, dict]]:
+        """get_rows for asyncio; local sources read each chunk in the default executor"""
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        loop = asyncio.get_running_loop()
+        
+        for chunk_start in range(start_row, end_row + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_row)
+            rows = await loop.run_in_executor(None, lambda: list(self.get_rows(chunk_start, chunk_end, chunk_size)))
+            for row in rows:
+                yield row
+    
+    async def aclose(self):
+        """Release clients used by get_rows_async on the running loop"""
+    
+    def get_row_by_index(self, row_index: int) -> dict:
+        """Get a single row by index (1-based)"""
+        for _, row_data in self.get_rows(row_index, row_index):
+            return row_data
+        return {}
+    
+    @staticmethod
+    def _row_to_dict(headers: list, values: list) -> dict:
+        """Map a list of cell values onto the header names"""
+        row_data = {}
+        for i, header in enumerate(headers):
+            if i < len(values):
+                row_data[header] = values[i]
+            else:
+                row_data[header] = ''
+        
+        return row_data
+    
+    @staticmethod
+    def _cell(value) -> str:
+        """Text of a typed cell value, with NULL as an empty string"""
+        return '' if value is None else str(value)
+
+
+class CSVLeadSource(LeadSource):
+    """Leads in a local CSV file, read through a memory map
+    
+    The first read scans the file once and records the byte offset of every
+    record, so any row range is a single slice of the map parsed on its own.
+    Quoted fields may contain newlines. The index is rebuilt when the file's
+    size or modification time changes.
+    """
+    
+    kind = 'csv'
+    
+    def __init__(self, path: str, encoding: str = 'utf-8', delimiter: str = ','):
+        self.path = path
+        self.document_id = path
+        self.encoding = encoding
+        self.delimiter = delimiter
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+        self._signature = None
+        # _offsets[i] is where record i + 1 starts; the last entry is the end of the data
+        self._offsets = array('Q')
+        self._headers = []
+    
+    def _load(self):
+        """Map the file and index its records, unless the current index is still valid"""
+        stat = os.stat(self.path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self._signature:
+            return
+        
+        self._close_map()
+        self._offsets = array('Q')
+        self._headers = []
+        self._signature = signature
+        if stat.st_size == 0:
+            return
+        
+        self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = self._index_records(self._map)
+        if len(self._offsets) > 1:
+            self._headers = self._parse(self._map[self._offsets[0]:self._offsets[1]])[0]
+        logger.info(f"Indexed {max(len(self._offsets) - 2, 0)} data rows in {self.path}")
+    
+    @staticmethod
+    def _index_records(data) -> array:
+        """Byte offsets of every record start, skipping newlines inside quoted fields"""
+        size = len(data)
+        position = len(UTF8_BOM) if data[:len(UTF8_BOM)] == UTF8_BOM else 0
+        offsets = array('Q', [position])
+        quotes = 0
+        while position < size:
+            newline = data.find(b'\n', position)
+            end = size if newline == -1 else newline + 1
+            # An escaped quote ("") counts twice, so an odd total means the record continues
+            quotes += data[position:end].count(b'"')
+            if quotes % 2 == 0 or end == size:
+                offsets.append(end)
+                quotes = 0
+            position = end
+        return offsets
+    
+    def _parse(self, raw: bytes) -> List[List[str]]:
+        """Parse a slice of whole records"""
+        text = raw.decode(self.encoding, errors='replace')
+        return list(csv.reader(io.StringIO(text, newline=''), delimiter=self.delimiter))
+    
+    def _close_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+    
+    def test_connection(self):
+        """Check that the file exists and has a header row"""
+        try:
+            with self._lock:
+                self._load()
+                headers = list(self._headers)
+        except OSError as e:
+            raise Exception(f"CSV lead source unavailable: {str(e)}")
+        if not headers:
+            raise Exception(f"CSV lead source {self.path} has no header row")
+        return True
+    
+    def get_rows(self, start_row: int, end_row: int, chunk_size: int = None) -> Iterator[Tuple[int, dict]]:
+        """Lazily yield (row_index, row_data) for rows start_row..end_row (1-based, inclusive)"""
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        
+        for chunk_start in range(start_row, end_row + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_row)
+            
+            try:
+                with self._lock:
+                    self._load()
+                    headers = self._headers
+                    record_count = len(self._offsets) - 1
+                    first, last = chunk_start - 1, min(chunk_end, record_count)
+                    raw = self._map[self._offsets[first]:self._offsets[last]] if first < last else b''
+            except OSError as e:
+                raise Exception(f"Failed to read rows {chunk_start}-{chunk_end}: {str(e)}")
+            
+            # csv yields exactly one entry per indexed record, blank lines included
+            records = self._parse(raw)
+            for offset, row_index in enumerate(range(chunk_start, chunk_end + 1)):
+                values = records[offset] if offset < len(records) else []
+                yield row_index, self._row_to_dict(headers, values)
+    
+    def close(self):
+        """Unmap the file"""
+        with self._lock:
+            self._close_map()
+            self._signature = None
+
+
+class ParquetLeadSource(LeadSource):
+    """Leads in a local Parquet file, read a row group at a time (requires pyarrow)
+    
+    Row groups are located from the file metadata, so a range only decodes the
+    groups it overlaps. The most recently read group is kept for the next chunk.
+    """
+    
+    kind = 'parquet'
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.document_id = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._headers = []
+        # First data record of each row group, plus the total record count
+        self._group_starts = []
+        self._cached_group = None
+        self._cached_table = None
+    
+    def _open(self):
+        if self._file is not None:
+            return
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("Parquet lead sources require pyarrow (pip install pyarrow)")
+        
+        self._file = pq.ParquetFile(self.path, memory_map=True)
+        self._headers = list(self._file.schema_arrow.names)
+        starts = [0]
+        for i in range(self._file.metadata.num_row_groups):
+            starts.append(starts[-1] + self._file.metadata.row_group(i).num_rows)
+        self._group_starts = starts
+    
+    def _group_records(self, group: int, first: int, last: int) -> List[List[str]]:
+        """Cell text of records first..last (exclusive) of one row group
+        
+        The decoded group stays cached in Arrow's columnar form, and only the
+        requested slice is turned into Python values.
+        """
+        if group != self._cached_group:
+            self._cached_table = self._file.read_row_group(group, columns=self._headers)
+            self._cached_group = group
+        columns = [column.to_pylist() for column in self._cached_table.slice(first, last - first).columns]
+        return [[self._cell(value) for value in row] for row in zip(*columns)]
+    
+    def _records(self, first: int, last: int) -> List[List[str]]:
+        """Data records first..last (0-based, exclusive end) across row groups"""
+        records = []
+        position = first
+        while position < last:
+            group = bisect.bisect_right(self._group_starts, position) - 1
+            group_start, group_end = self._group_starts[group], self._group_starts[group + 1]
+            stop = min(last, group_end)
+            records.extend(self._group_records(group, position - group_start, stop - group_start))
+            position = stop
+        return records
+    
+    def test_connection(self):
+        """Check that the file can be opened and read its schema"""
+        try:
+            with self._lock:
+                self._open()
+        except OSError as e:
+            raise Exception(f"Parquet lead source unavailable: {str(e)}")
+        return True
+    
+    def get_rows(self, start_row: int, end_row: int, chunk_size: int = None) -> Iterator[Tuple[int, dict]]:
+        """Lazily yield (row_index, row_data) for rows start_row..end_row (1-based, inclusive)"""
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        
+        for chunk_start in range(start_row, end_row + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_row)
+            
+            try:
+                with self._lock:
+                    self._open()
+                    headers = self._headers
+                    # Row 1 is the header, so data row n is record n - 2
+                    records = [list(headers)] if chunk_start == 1 else []
+                    first = max(chunk_start - 2, 0)
+                    last = min(chunk_end - 1, self._group_starts[-1])
+                    records.extend(self._records(first, last))
+            except OSError as e:
+                raise Exception(f"Failed to read rows {chunk_start}-{chunk_end}: {str(e)}")
+            
+            for offset, row_index in enumerate(range(chunk_start, chunk_end + 1)):
+                values = records[offset] if offset < len(records) else []
+                yield row_index, self._row_to_dict(headers, values)
+
+
+class SQLiteLeadSource(LeadSource):
+    """Leads in a table of a local SQLite database, opened read-only
+    
+    Data rows are the table's rows in rowid order. The rowids are loaded once
+    so a range becomes one indexed ``rowid BETWEEN`` query; they are reloaded
+    when another connection changes the database.
+    """
+    
+    kind = 'sqlite'
+    
+    def __init__(self, path: str, table: str = 'leads'):
+        self.path = path
+        self.table = table
+        self.document_id = f"{path}:{table}"
+        self._lock = threading.Lock()
+        self._conn = None
+        self._headers = []
+        self._rowids = array('q')
+        self._data_version = None
+    
+    def _connect(self):
+        if self._conn is None:
+            uri = Path(self.path).absolute().as_uri() + '?mode=ro'
+            self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        return self._conn
+    
+    def _quoted_table(self) -> str:
+        return '"' + self.table.replace('"', '""') + '"'
+    
+    def _load(self):
+        """Read the column names and rowid order, unless the database is unchanged"""
+        conn = self._connect()
+        data_version = conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self._data_version:
+            return
+        
+        columns = conn.execute(f'PRAGMA table_info({self._quoted_table()})').fetchall()
+        if not columns:
+            raise Exception(f"Table {self.table} not found in {self.path}")
+        self._headers = [column[1] for column in columns]
+        self._rowids = array('q', (row[0] for row in conn.execute(
+            f'SELECT rowid FROM {self._quoted_table()} ORDER BY rowid'
+        )))
+        self._data_version = data_version
+    
+    def test_connection(self):
+        """Check that the database opens and the table exists"""
+        try:
+            with self._lock:
+                self._load()
+        except sqlite3.Error as e:
+            raise Exception(f"SQLite lead source unavailable: {str(e)}")
+        return True
+    
+    def get_rows(self, start_row: int, end_row: int, chunk_size: int = None) -> Iterator[Tuple[int, dict]]:
+        """Lazily yield (row_index, row_data) for rows start_row..end_row (1-based, inclusive)"""
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        
+        for chunk_start in range(start_row, end_row + 1, chunk_size):
+            chunk_end = min(chunk_start + chunk_size - 1, end_row)
+            
+            try:
+                with self._lock:
+                    self._load()
+                    headers = self._headers
+                    records = [list(headers)] if chunk_start == 1 else []
+                    # Row 1 is the header, so data row n is the (n - 2)th rowid
+                    first = max(chunk_start - 2, 0)
+                    last = min(chunk_end - 1, len(self._rowids))
+                    if first < last:
+                        records.extend(
+                            [self._cell(value) for value in row]
+                            for row in self._conn.execute(
+                                f'SELECT * FROM {self._quoted_table()} WHERE rowid BETWEEN ? AND ? ORDER BY rowid',
+                                (self._rowids[first], self._rowids[last - 1])
+                            )
+                        )
+            except sqlite3.Error as e:
+                raise Exception(f"Failed to read rows {chunk_start}-{chunk_end}: {str(e)}")
+            
+            for offset, row_index in enumerate(range(chunk_start, chunk_end + 1)):
+                values = records[offset] if offset < len(records) else []
+                yield row_index, self._row_to_dict(headers, values)
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+                self._data_version = None
+
+
+def lead_source_kind() -> str:
+    """Kind of lead source selected by LEAD_SOURCE (default: Google Sheets), without building it"""
+    return os.environ.get('LEAD_SOURCE', 'sheets').lower()
+
+
+def create_lead_source(kind: str = None) -> LeadSource:
+    """Build the lead source selected by LEAD_SOURCE (default: Google Sheets)"""
+    kind = (kind or lead_source_kind()).lower()
+    if kind not in LEAD_SOURCE_TYPES:
+        raise Exception(f"Unknown lead source: {kind}")
+    
+    if kind == 'sheets':
+        from services.google_sheets_service import GoogleSheetsService
+        return GoogleSheetsService()
+    
+    path = os.environ.get('LEAD_SOURCE_PATH')
+    if not path:
+        raise Exception(f"LEAD_SOURCE_PATH is required for the {kind} lead source")
+    
+    if kind == 'csv':
+        return CSVLeadSource(
+            path,
+            encoding=os.environ.get('LEAD_SOURCE_ENCODING', 'utf-8'),
+            delimiter=os.environ.get('LEAD_SOURCE_DELIMITER', ',')
+        )
+    if kind == 'parquet':
+        return ParquetLeadSource(path)
+    return SQLiteLeadSource(path, table=os.environ.get('LEAD_SOURCE_TABLE', 'leads'))
@@ -0,0 +1,463 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Shard states; a leased shard whose lease expired can be claimed again
+SHARD_PENDING = 'pending'
+SHARD_LEASED = 'leased'
+SHARD_DONE = 'done'
+SHARD_FAILED = 'failed'
+
+# Result counters summed over every attempt at a shard
+COUNT_FIELDS = ('processed', 'sent', 'rendered', 'skipped', 'error_count')
+
+LEASE_STORE_TYPES = ('sqlite', 'redis')
+
+
+def campaign_status(shards: List[Dict[str, Any]]) -> str:
+    """State of a campaign from the states of its shards"""
+    states = {shard['status'] for shard in shards}
+    if states <= {SHARD_DONE}:
+        return 'completed'
+    if states <= {SHARD_DONE, SHARD_FAILED}:
+        return 'failed'
+    return 'running'
+
+
+def _overlaps(start_row: int, end_row: int, campaign: Dict[str, Any]) -> bool:
+    return start_row <= campaign['end_row'] and campaign['start_row'] <= end_row
+
+
+class SQLiteLeaseStore:
+    """Campaign shards and their leases in a SQLite file shared by the workers of one machine
+    
+    Every claim, heartbeat and finish runs in an immediate transaction, so
+    several processes can use the same file. A finish or heartbeat only
+    applies while the caller still holds the lease: the shard's ``token``
+    grows with every claim, so a worker whose lease expired and was taken
+    over cannot overwrite the new owner's progress.
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get('LEASE_DB_PATH', 'leases.db')
+        self._lock = threading.Lock()
+        # Other processes hold the write lock only for one short transaction
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS campaigns (
+                    campaign_id TEXT PRIMARY KEY,
+                    start_row INTEGER NOT NULL,
+                    end_row INTEGER NOT NULL,
+                    mode TEXT,
+                    created_at TEXT NOT NULL
+                )
+            ''')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS shards (
+                    campaign_id TEXT NOT NULL,
+                    shard_index INTEGER NOT NULL,
+                    start_row INTEGER NOT NULL,
+                    end_row INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    owner TEXT,
+                    token INTEGER NOT NULL DEFAULT 0,
+                    lease_expires REAL,
+                    progress INTEGER,
+                    counts TEXT NOT NULL DEFAULT '{}',
+                    error TEXT,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (campaign_id, shard_index)
+                )
+            ''')
+    
+    def create_campaign(self, campaign_id: str, start_row: int, end_row: int,
+                        shards: List[Tuple[int, int]], mode: str = None) -> Dict[str, Any]:
+        """Register a campaign and its shards
+        
+        Raises when the range overlaps a campaign that is still running, so
+        the same rows are never worked on by two campaigns at once.
+        """
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            campaign = self._overlapping_campaign(start_row, end_row)
+            if campaign:
+                raise Exception(
+                    f"Rows {start_row}-{end_row} overlap running campaign {campaign['campaign_id']} "
+                    f"(rows {campaign['start_row']}-{campaign['end_row']})"
+                )
+            self._conn.execute(
+                'INSERT INTO campaigns (campaign_id, start_row, end_row, mode, created_at) VALUES (?, ?, ?, ?, ?)',
+                (campaign_id, start_row, end_row, mode, now)
+            )
+            self._conn.executemany(
+                'INSERT INTO shards (campaign_id, shard_index, start_row, end_row, status, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(campaign_id, index, first, last, SHARD_PENDING, now) for index, (first, last) in enumerate(shards)]
+            )
+        return self.get_campaign(campaign_id)
+    
+    def claim(self, campaign_id: str, worker_id: str, ttl: float) -> Optional[Dict[str, Any]]:
+        """Lease the first pending shard, or one whose lease expired, to ``worker_id``; None when there is none"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            row = self._conn.execute(
+                'SELECT * FROM shards WHERE campaign_id = ? AND '
+                '(status = ? OR (status = ? AND lease_expires < ?)) ORDER BY shard_index LIMIT 1',
+                (campaign_id, SHARD_PENDING, SHARD_LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            if row['status'] == SHARD_LEASED:
+                logger.warning(f"Lease of {campaign_id} shard {row['shard_index']} held by {row['owner']} expired; reassigning it")
+            self._conn.execute(
+                'UPDATE shards SET status = ?, owner = ?, token = token + 1, lease_expires = ?, updated_at = ? '
+                'WHERE campaign_id = ? AND shard_index = ?',
+                (SHARD_LEASED, worker_id, now + ttl, datetime.now().isoformat(), campaign_id, row['shard_index'])
+            )
+            row = self._conn.execute(
+                'SELECT * FROM shards WHERE campaign_id = ? AND shard_index = ?', (campaign_id, row['shard_index'])
+            ).fetchone()
+        return self._shard(row)
+    
+    def heartbeat(self, campaign_id: str, shard_index: int, worker_id: str, token: int,
+                  ttl: float, progress: int = None) -> bool:
+        """Extend a lease and record the last completed row; False when the lease was lost"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                'UPDATE shards SET lease_expires = ?, progress = COALESCE(?, progress), updated_at = ? '
+                'WHERE campaign_id = ? AND shard_index = ? AND status = ? AND owner = ? AND token = ?',
+                (time.time() + ttl, progress, datetime.now().isoformat(),
+                 campaign_id, shard_index, SHARD_LEASED, worker_id, token)
+            ).rowcount == 1
+    
+    def finish(self, campaign_id: str, shard_index: int, worker_id: str, token: int, status: str,
+               counts: Dict[str, int] = None, progress: int = None, error: str = None) -> bool:
+        """End a lease: the shard becomes done, failed, or pending again for another worker
+        
+        ``counts`` are added to the shard's totals. False when the lease was
+        lost, in which case nothing is changed.
+        """
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            row = self._conn.execute(
+                'SELECT counts FROM shards WHERE campaign_id = ? AND shard_index = ? '
+                'AND status = ? AND owner = ? AND token = ?',
+                (campaign_id, shard_index, SHARD_LEASED, worker_id, token)
+            ).fetchone()
+            if row is None:
+                return False
+            totals = json.loads(row['counts'])
+            for field, value in (counts or {}).items():
+                totals[field] = totals.get(field, 0) + value
+            self._conn.execute(
+                'UPDATE shards SET status = ?, owner = NULL, lease_expires = NULL, progress = COALESCE(?, progress), '
+                'counts = ?, error = ?, updated_at = ? WHERE campaign_id = ? AND shard_index = ?',
+                (status, progress, json.dumps(totals), error, datetime.now().isoformat(), campaign_id, shard_index)
+            )
+        return True
+    
+    def overlapping_campaign(self, start_row: int, end_row: int) -> Optional[Dict[str, Any]]:
+        """A running campaign (one with pending or leased shards) sharing rows with the range, or None"""
+        with self._lock:
+            return self._overlapping_campaign(start_row, end_row)
+    
+    def _overlapping_campaign(self, start_row: int, end_row: int) -> Optional[Dict[str, Any]]:
+        for campaign in self._conn.execute(
+            'SELECT DISTINCT c.* FROM campaigns c JOIN shards s ON s.campaign_id = c.campaign_id '
+            'WHERE s.status IN (?, ?)', (SHARD_PENDING, SHARD_LEASED)
+        ).fetchall():
+            if _overlaps(start_row, end_row, campaign):
+                return dict(campaign)
+        return None
+    
+    def get_campaign(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """A campaign with its shards, or None if it is unknown"""
+        with self._lock:
+            campaign = self._conn.execute('SELECT * FROM campaigns WHERE campaign_id = ?', (campaign_id,)).fetchone()
+            if campaign is None:
+                return None
+            shards = self._conn.execute(
+                'SELECT * FROM shards WHERE campaign_id = ? ORDER BY shard_index', (campaign_id,)
+            ).fetchall()
+        campaign = dict(campaign)
+        campaign['shards'] = [self._shard(row) for row in shards]
+        campaign['status'] = campaign_status(campaign['shards'])
+        return campaign
+    
+    def list_campaigns(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recently created campaigns first"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT campaign_id FROM campaigns ORDER BY created_at DESC LIMIT ?', (limit,)
+            ).fetchall()
+        return [self.get_campaign(row['campaign_id']) for row in rows]
+    
+    @staticmethod
+    def _shard(row: sqlite3.Row) -> Dict[str, Any]:
+        shard = dict(row)
+        shard['counts'] = json.loads(shard['counts'])
+        return shard
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+
+# Lua scripts run atomically inside Redis; times come from the Redis clock so
+# workers on machines with skewed clocks agree on when a lease expires
+_REDIS_NOW = '''
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+'''
+
+_REDIS_CREATE = '''
+local ids = redis.call('ZRANGE', KEYS[1], 0, -1)
+local start_row, end_row = tonumber(ARGV[3]), tonumber(ARGV[4])
+for _, id in ipairs(ids) do
+    local campaign = cjson.decode(redis.call('GET', ARGV[1] .. ':campaign:' .. id))
+    if start_row <= campaign.end_row and campaign.start_row <= end_row then
+        for _, value in ipairs(redis.call('HVALS', ARGV[1] .. ':shards:' .. id)) do
+            local status = cjson.decode(value).status
+            if status == 'pending' or status == 'leased' then
+                return redis.error_reply('Rows ' .. start_row .. '-' .. end_row .. ' overlap running campaign ' .. id ..
+                    ' (rows ' .. campaign.start_row .. '-' .. campaign.end_row .. ')')
+            end
+        end
+    end
+end
+redis.call('SET', KEYS[2], ARGV[5])
+for index, shard in ipairs(cjson.decode(ARGV[6])) do
+    redis.call('HSET', KEYS[3], index - 1, cjson.encode(shard))
+end
+redis.call('ZADD', KEYS[1], ARGV[7], ARGV[2])
+return 1
+'''
+
+_REDIS_CLAIM = _REDIS_NOW + '''
+local best_index, best = nil, nil
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+    local index = tonumber(fields[i])
+    local shard = cjson.decode(fields[i + 1])
+    if (shard.status == 'pending' or (shard.status == 'leased' and shard.lease_expires < now))
+            and (best_index == nil or index < best_index) then
+        best_index, best = index, shard
+    end
+end
+if best == nil then
+    return nil
+end
+local previous = ''
+if best.status == 'leased' then
+    previous = best.owner
+end
+best.status = 'leased'
+best.owner = ARGV[1]
+best.token = best.token + 1
+best.lease_expires = now + tonumber(ARGV[2])
+best.updated_at = ARGV[3]
+local encoded = cjson.encode(best)
+redis.call('HSET', KEYS[1], best_index, encoded)
+return {encoded, previous}
+'''
+
+_REDIS_HEARTBEAT = _REDIS_NOW + '''
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value then
+    return 0
+end
+local shard = cjson.decode(value)
+if shard.status ~= 'leased' or shard.owner ~= ARGV[2] or shard.token ~= tonumber(ARGV[3]) then
+    return 0
+end
+shard.lease_expires = now + tonumber(ARGV[4])
+if ARGV[5] ~= '' then
+    shard.progress = tonumber(ARGV[5])
+end
+shard.updated_at = ARGV[6]
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(shard))
+return 1
+'''
+
+_REDIS_FINISH = '''
+local value = redis.call('HGET', KEYS[1], ARGV[1])
+if not value then
+    return 0
+end
+local shard = cjson.decode(value)
+if shard.status ~= 'leased' or shard.owner ~= ARGV[2] or shard.token ~= tonumber(ARGV[3]) then
+    return 0
+end
+local counts = shard.counts
+if type(counts) ~= 'table' then
+    counts = {}
+end
+for field, amount in pairs(cjson.decode(ARGV[5])) do
+    counts[field] = (counts[field] or 0) + amount
+end
+shard.status = ARGV[4]
+shard.owner = cjson.null
+shard.lease_expires = cjson.null
+shard.counts = counts
+if ARGV[6] ~= '' then
+    shard.progress = tonumber(ARGV[6])
+end
+if ARGV[7] ~= '' then
+    shard.error = ARGV[7]
+else
+    shard.error = cjson.null
+end
+shard.updated_at = ARGV[8]
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(shard))
+return 1
+'''
+
+
+class RedisLeaseStore:
+    """SQLiteLeaseStore on Redis, for workers on several machines (requires redis)
+    
+    Same operations and guarantees: each one is a Lua script, so it runs
+    atomically. Keys are prefixed with ``prefix``. The scripts read keys
+    they are not given, so they need a single Redis server, not a cluster.
+    """
+    
+    def __init__(self, url: str = None, prefix: str = None):
+        try:
+            import redis
+        except ImportError:
+            raise Exception("Redis lease stores require the redis package (pip install redis)")
+        self.url = url or os.environ.get('LEASE_REDIS_URL', 'redis://localhost:6379/0')
+        self.prefix = prefix or os.environ.get('LEASE_REDIS_PREFIX', 'outreach')
+        self._redis = redis.Redis.from_url(self.url, decode_responses=True)
+        self._error = redis.ResponseError
+        self._create = self._redis.register_script(_REDIS_CREATE)
+        self._claim = self._redis.register_script(_REDIS_CLAIM)
+        self._heartbeat = self._redis.register_script(_REDIS_HEARTBEAT)
+        self._finish = self._redis.register_script(_REDIS_FINISH)
+    
+    def _key(self, *parts) -> str:
+        return ':'.join((self.prefix,) + tuple(str(part) for part in parts))
+    
+    def create_campaign(self, campaign_id: str, start_row: int, end_row: int,
+                        shards: List[Tuple[int, int]], mode: str = None) -> Dict[str, Any]:
+        """Register a campaign and its shards; raises when the range overlaps a running campaign"""
+        now = datetime.now().isoformat()
+        campaign = {
+            'campaign_id': campaign_id,
+            'start_row': start_row,
+            'end_row': end_row,
+            'mode': mode,
+            'created_at': now
+        }
+        shard_states = [{
+            'campaign_id': campaign_id,
+            'shard_index': index,
+            'start_row': first,
+            'end_row': last,
+            'status': SHARD_PENDING,
+            'token': 0,
+            'counts': {},
+            'updated_at': now
+        } for index, (first, last) in enumerate(shards)]
+        try:
+            self._create(
+                keys=[self._key('campaigns'), self._key('campaign', campaign_id), self._key('shards', campaign_id)],
+                args=[self.prefix, campaign_id, start_row, end_row, json.dumps(campaign), json.dumps(shard_states), time.time()]
+            )
+        except self._error as e:
+            raise Exception(str(e))
+        return self.get_campaign(campaign_id)
+    
+    def claim(self, campaign_id: str, worker_id: str, ttl: float) -> Optional[Dict[str, Any]]:
+        """Lease the first pending shard, or one whose lease expired, to ``worker_id``; None when there is none"""
+        claimed = self._claim(keys=[self._key('shards', campaign_id)], args=[worker_id, ttl, datetime.now().isoformat()])
+        if not claimed:
+            return None
+        shard = self._shard(claimed[0])
+        if claimed[1]:
+            logger.warning(f"Lease of {campaign_id} shard {shard['shard_index']} held by {claimed[1]} expired; reassigning it")
+        return shard
+    
+    def heartbeat(self, campaign_id: str, shard_index: int, worker_id: str, token: int,
+                  ttl: float, progress: int = None) -> bool:
+        """Extend a lease and record the last completed row; False when the lease was lost"""
+        return self._heartbeat(
+            keys=[self._key('shards', campaign_id)],
+            args=[shard_index, worker_id, token, ttl, '' if progress is None else progress, datetime.now().isoformat()]
+        ) == 1
+    
+    def finish(self, campaign_id: str, shard_index: int, worker_id: str, token: int, status: str,
+               counts: Dict[str, int] = None, progress: int = None, error: str = None) -> bool:
+        """End a lease: the shard becomes done, failed, or pending again; False when the lease was lost"""
+        return self._finish(
+            keys=[self._key('shards', campaign_id)],
+            args=[shard_index, worker_id, token, status, json.dumps(counts or {}),
+                  '' if progress is None else progress, error or '', datetime.now().isoformat()]
+        ) == 1
+    
+    def get_campaign(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """A campaign with its shards, or None if it is unknown"""
+        value = self._redis.get(self._key('campaign', campaign_id))
+        if value is None:
+            return None
+        campaign = json.loads(value)
+        shards = [self._shard(shard) for shard in self._redis.hvals(self._key('shards', campaign_id))]
+        campaign['shards'] = sorted(shards, key=lambda shard: shard['shard_index'])
+        campaign['status'] = campaign_status(campaign['shards'])
+        return campaign
+    
+    def overlapping_campaign(self, start_row: int, end_row: int) -> Optional[Dict[str, Any]]:
+        """A running campaign (one with pending or leased shards) sharing rows with the range, or None"""
+        for campaign_id in self._redis.zrange(self._key('campaigns'), 0, -1):
+            value = self._redis.get(self._key('campaign', campaign_id))
+            if value is None:
+                continue
+            campaign = json.loads(value)
+            if not _overlaps(start_row, end_row, campaign):
+                continue
+            for shard in self._redis.hvals(self._key('shards', campaign_id)):
+                if json.loads(shard)['status'] in (SHARD_PENDING, SHARD_LEASED):
+                    return campaign
+        return None
+    
+    def list_campaigns(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recently created campaigns first"""
+        ids = self._redis.zrevrange(self._key('campaigns'), 0, limit - 1)
+        return [campaign for campaign in (self.get_campaign(campaign_id) for campaign_id in ids) if campaign]
+    
+    @staticmethod
+    def _shard(value: str) -> Dict[str, Any]:
+        shard = json.loads(value)
+        for field in ('owner', 'lease_expires', 'progress', 'error'):
+            shard.setdefault(field, None)
+        # cjson turns an empty counts object into an empty array
+        if not isinstance(shard.get('counts'), dict):
+            shard['counts'] = {}
+        return shard
+    
+    def close(self):
+        """Close the Redis connections"""
+        self._redis.close()
+
+
+def create_lease_store(kind: str = None):
+    """Build the lease store selected by LEASE_STORE (default: SQLite)"""
+    kind = (kind or os.environ.get('LEASE_STORE', 'sqlite')).lower()
+    if kind not in LEASE_STORE_TYPES:
+        raise Exception(f"Unknown lease store: {kind}")
+    if kind == 'redis':
+        return RedisLeaseStore()
+    return SQLiteLeaseStore()
@@ -0,0 +1,296 @@
+import math
+import time
+import bisect
+import random
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Tuple
+
+# Histogram buckets in seconds, from a fast SMTP NOOP to a slow completion
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    """Escape a label value for the text exposition format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    """Render a Prometheus label set such as {service="openai",operation="generate"}"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    """Render a sample value, with +Inf for infinity"""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+    
+    type = 'counter'
+    
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1, **labels):
+        """Add ``amount`` to the series with the given labels"""
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def value(self, **labels) -> float:
+        """Current value of the series with the given labels"""
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+    
+    def render(self) -> List[str]:
+        """Sample lines of every series"""
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+    
+    type = 'histogram'
+    
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float, **labels):
+        """Record one sample in the series with the given labels"""
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+    
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def render(self) -> List[str]:
+        """Bucket, sum and count lines of every series"""
+        with self._lock:
+            series = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in self._series.items())
+        lines = []
+        for key, value in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), value['buckets']):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(value['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {value['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide set of metrics rendered in the Prometheus text exposition format"""
+    
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+    
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        """Create and register a counter"""
+        return self._register(Counter(name, help_text, labelnames))
+    
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Create and register a histogram"""
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+    
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+    
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, str, Dict[str, str], float]]]):
+        """Add a callback returning (name, type, help, labels, value) samples read at render time"""
+        with self._lock:
+            self._collectors.append(collector)
+    
+    def render(self) -> str:
+        """Every metric and collected sample in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        
+        described = set()
+        for collector in collectors:
+            for name, metric_type, help_text, labels, value in collector():
+                if name not in described:
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {metric_type}")
+                    described.add(name)
+                lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+EXTERNAL_CALL_SECONDS = REGISTRY.histogram(
+    'outreach_external_call_seconds',
+    'Duration of each call to an external service, per attempt',
+    ('service', 'operation')
+)
+EXTERNAL_CALL_ERRORS = REGISTRY.counter(
+    'outreach_external_call_errors_total',
+    'Calls to an external service that raised, per attempt',
+    ('service', 'operation')
+)
+OPENAI_TOKENS = REGISTRY.counter(
+    'outreach_openai_tokens_total',
+    'OpenAI tokens reported in response.usage',
+    ('type',)
+)
+ROWS_TOTAL = REGISTRY.counter(
+    'outreach_rows_total',
+    'Rows finished by workflow runs, by outcome',
+    ('status',)
+)
+GENERATION_CACHE_TOTAL = REGISTRY.counter(
+    'outreach_generation_cache_total',
+    'Generation cache lookups, by result (hit or miss)',
+    ('result',)
+)
+GENERATION_STREAM_ABORTS = REGISTRY.counter(
+    'outreach_generation_stream_aborts_total',
+    'Streamed generations stopped early, by reason (structure, recipient, body_too_long, incomplete)',
+    ('reason',)
+)
+RECIPIENT_CHECKS = REGISTRY.counter(
+    'outreach_recipient_checks_total',
+    'Recipient addresses screened before generation, by result (valid, syntax, disposable, no_mail_server)',
+    ('result',)
+)
+
+
+@contextmanager
+def track(service: str, operation: str):
+    """Time the with-block as one call to an external service and count it if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        EXTERNAL_CALL_ERRORS.inc(service=service, operation=operation)
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.observe(time.perf_counter() - start, service=service, operation=operation)
+
+
+def timed_call(service: str, operation: str, func: Callable, *args, **kwargs) -> Any:
+    """Call ``func`` inside track(); handy as the function given to RateLimiter.call"""
+    with track(service, operation):
+        return func(*args, **kwargs)
+
+
+async def timed_call_async(service: str, operation: str, func: Callable, *args, **kwargs) -> Any:
+    """timed_call for coroutine functions, for RateLimiter.call_async"""
+    with track(service, operation):
+        return await func(*args, **kwargs)
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    # The smallest value with at least ``fraction`` of the list at or below it; rounding first
+    # keeps float noise such as 0.3 * 10 == 3.0000000000000004 from moving up a rank
+    rank = math.ceil(round(fraction * len(sorted_values), 9))
+    index = min(len(sorted_values) - 1, max(0, rank - 1))
+    return sorted_values[index]
+
+
+class StageTimings:
+    """Wall-clock time a single run spends in each stage, summarized into its results
+    
+    Count, total and max are exact. Percentiles come from a uniform sample of
+    at most ``max_samples`` durations per stage (reservoir sampling), so a
+    run's memory stays flat however many rows it has.
+    """
+    
+    def __init__(self, max_samples: int = 1024):
+        self.max_samples = max_samples
+        self._stages = {}
+        self._random = random.Random()
+        self._lock = threading.Lock()
+    
+    def observe(self, stage: str, seconds: float):
+        """Record time spent in a stage"""
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = {'count': 0, 'total': 0.0, 'max': 0.0, 'samples': []}
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['max'] = max(stats['max'], seconds)
+            if len(stats['samples']) < self.max_samples:
+                stats['samples'].append(seconds)
+            else:
+                # Every duration seen so far stays in the sample with the same probability
+                index = self._random.randrange(stats['count'])
+                if index < self.max_samples:
+                    stats['samples'][index] = seconds
+    
+    @contextmanager
+    def time(self, stage: str):
+        """Record the duration of the with-block under ``stage``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """count, total, mean, p50, p95, p99 and max seconds per stage"""
+        with self._lock:
+            stages = {stage: dict(stats, samples=sorted(stats['samples'])) for stage, stats in self._stages.items()}
+        summary = {}
+        for stage, stats in stages.items():
+            values = stats['samples']
+            summary[stage] = {
+                'count': stats['count'],
+                'total_seconds': round(stats['total'], 3),
+                'mean_seconds': round(stats['total'] / stats['count'], 4),
+                'p50_seconds': round(percentile(values, 0.50), 4),
+                'p95_seconds': round(percentile(values, 0.95), 4),
+                'p99_seconds': round(percentile(values, 0.99), 4),
+                'max_seconds': round(stats['max'], 4)
+            }
+        return summary
@@ -1,20 +1,194 @@
+import os
+import time
 import logging
 import json
+import threading
+import uuid
+import asyncio
+import itertools
+import contextvars
+from collections import deque
+from contextlib import ExitStack, contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any
 
+from services.ai_service import EMAIL_MAX_TOKENS, empty_usage
+from services.adaptive_limiter import AdaptiveLimiter
+from services.campaign_bundle import CampaignBundleWriter, bundle_dir, iter_drafts, read_manifest
+from services.result_log import ResultLog, result_log_dir, result_log_path
+from services.knowledge_index import estimate_tokens, get_index
+from services.email_stream import EmailStreamParser
+from services.email_service import SMTPDeliveryUncertain
+from services.recipient_validator import INVALID_REASONS
+from services.checkpoint_store import RUN_RUNNING, RUN_COMPLETED, RUN_CANCELLED, RUN_INCOMPLETE
+from services.rate_limiter import limiter_stats, stats_delta
+from services.metrics import ROWS_TOTAL, GENERATION_CACHE_TOTAL, StageTimings
+
 logger = logging.getLogger(__name__)
 
+# 'sequential' handles one row at a time; 'concurrent' overlaps fetch, generate and send;
+# 'batch' generates every row through the OpenAI Batch API before sending;
+# 'async' overlaps them like 'concurrent' but on one asyncio event loop (execute_async);
+# 'render' generates like 'concurrent' but writes the drafts to a bundle instead of
+# sending them, for send_bundle() to deliver later
+EXECUTION_MODES = ('sequential', 'concurrent', 'batch', 'async', 'render')
+
+
+class _Run:
+    """State shared by the stages of a single OutreachAgent.execute call"""
+    
+    def __init__(self, results: Dict[str, Any], cancel_event: threading.Event = None,
+                 progress_callback=None, event_callback=None):
+        self.results = results
+        self.knowledge_base = None
+        # KnowledgeIndex of a knowledge base too large to send whole with every row
+        self.knowledge_index = None
+        # Shared prompt prefix and token usage accumulated over the run
+        self.instructions = None
+        self.usage = empty_usage()
+        self.cancel_event = cancel_event
+        self.progress_callback = progress_callback
+        self.event_callback = event_callback
+        self.started = time.monotonic()
+        # Rows the send ledger says were already contacted
+        self.contacted = set()
+        # Rows whose recipient failed validation, with the reason it was rejected
+        self.invalid_recipients = {}
+        # Recipient validation: domains checked (once per chunk), DNS lookups, cache hits, failed lookups
+        self.recipient_checks = {'domains': 0, 'lookups': 0, 'cache_hits': 0, 'lookup_errors': 0}
+        # Checkpoint id of the run, and whether reading rows failed part way
+        self.run_id = None
+        self.fetch_failed = False
+        # Adaptive per-stage concurrency limits of a concurrent run, by stage name
+        self.limiters = {}
+        # Time spent in each stage (knowledge_base, fetch, validate, ledger, generate, send)
+        self.timings = StageTimings()
+        # Service rate limiter counters when the run started
+        self.throttle_before = {}
+        # CampaignBundleWriter receiving the drafts of a 'render' run
+        self.bundle = None
+        # ResultLog holding every outcome and error; results keep only the recent ones
+        self.log = None
+        # Generation cache lookups of the run
+        self.generation_cache = {'hits': 0, 'misses': 0}
+        # Multi-lead requests, the rows they asked for and the rows generated again one by one
+        self.multi_lead = {'requests': 0, 'rows': 0, 'fallback_rows': 0}
+        self._counts_lock = threading.Lock()
+    
+    def cancelled(self) -> bool:
+        """Whether the caller asked the run to stop"""
+        return bool(self.cancel_event and self.cancel_event.is_set())
+    
+    def add_error(self, message: str):
+        """Record a run-level error, such as a failed knowledge base or row fetch"""
+        self.results['errors'].append(message)
+        self.results['error_count'] += 1
+        if self.log:
+            self.log.append({'row': None, 'status': 'error', 'error': message})
+    
+    def count_cache_lookup(self, hit: bool):
+        """Count one generation cache lookup"""
+        GENERATION_CACHE_TOTAL.inc(result='hit' if hit else 'miss')
+        with self._counts_lock:
+            self.generation_cache['hits' if hit else 'misses'] += 1
+    
+    def count_multi_lead(self, rows: int, fallback_rows: int):
+        """Count one multi-lead request and the rows missing from its answer"""
+        with self._counts_lock:
+            self.multi_lead['requests'] += 1
+            self.multi_lead['rows'] += rows
+            self.multi_lead['fallback_rows'] += fallback_rows
+    
+    def add_recipient_checks(self, counts: Dict[str, int], invalid: Dict[int, str]):
+        """Count one chunk's recipient validation and note the rows it rejected"""
+        with self._counts_lock:
+            for key, value in counts.items():
+                self.recipient_checks[key] += value
+            self.invalid_recipients.update(invalid)
+    
+    def notify(self):
+        """Report the current results to the progress callback"""
+        if self.progress_callback:
+            self.progress_callback(self.results)
+    
+    def emit(self, event_type: str, row_index: int, **data):
+        """Send a per-row event with the running counters to the event callback"""
+        if not self.event_callback:
+            return
+        results = self.results
+        event = {
+            'type': event_type,
+            'row': row_index,
+            'counters': {
+                'processed': results['processed'],
+                'sent': results['sent'],
+                'skipped': results['skipped'],
+                'errors': results['error_count'],
+                'elapsed': round(time.monotonic() - self.started, 3)
+            }
+        }
+        event.update(data)
+        self.event_callback(event)
+
 
 class OutreachAgent:
     """Main outreach agent that orchestrates the workflow"""
     
-    def __init__(self, sheets_service, docs_service, ai_service, email_service):
-        self.sheets_service = sheets_service
+    def __init__(self, lead_source, docs_service, ai_service, email_service, ledger=None, checkpoints=None,
+                 generation_cache=None, recipient_validator=None):
+        # Any LeadSource: Google Sheets, CSV, Parquet or SQLite
+        self.lead_source = lead_source
         self.docs_service = docs_service
         self.ai_service = ai_service
         self.email_service = email_service
+        # Optional SendLedger used to skip rows that were already contacted
+        self.ledger = ledger
+        # Optional CheckpointStore used to resume interrupted runs
+        self.checkpoints = checkpoints
+        # Optional GenerationCache so reruns reuse emails generated from the same inputs
+        self.generation_cache = generation_cache
+        # Optional RecipientValidator screening addresses (syntax, disposable domains, MX) before generation
+        self.recipient_validator = recipient_validator
+        
+        # Execution mode and per-stage concurrency limits for 'concurrent' mode
+        self.execution_mode = os.environ.get('OUTREACH_EXECUTION_MODE', 'sequential')
+        self.fetch_concurrency = int(os.environ.get('OUTREACH_FETCH_CONCURRENCY', '2'))
+        self.fetch_chunk_size = int(os.environ.get('OUTREACH_FETCH_CHUNK_SIZE', '100'))
+        self.generate_concurrency = int(os.environ.get('OUTREACH_GENERATE_CONCURRENCY', '4'))
+        self.send_concurrency = int(os.environ.get('OUTREACH_SEND_CONCURRENCY', '2'))
+        # With adaptive concurrency the two values above are starting points that
+        # move between 1 and these maximums depending on latency and throttling
+        self.adaptive_concurrency = os.environ.get('OUTREACH_ADAPTIVE_CONCURRENCY', 'true').lower() != 'false'
+        self.generate_max_concurrency = int(os.environ.get('OUTREACH_GENERATE_MAX_CONCURRENCY', str(self.generate_concurrency * 4)))
+        self.send_max_concurrency = int(os.environ.get('OUTREACH_SEND_MAX_CONCURRENCY', str(self.send_concurrency * 2)))
+        # 'async' mode: rows held in flight at once, which is also its generate ceiling
+        self.async_max_in_flight = int(os.environ.get('OUTREACH_ASYNC_MAX_IN_FLIGHT', '256'))
+        # Where 'batch' mode writes its Batch API input files
+        self.batch_dir = os.environ.get('OUTREACH_BATCH_DIR', os.path.join('.cache', 'batches'))
+        # Where 'render' mode writes its campaign bundles
+        self.bundle_dir = bundle_dir()
+        # Every outcome goes to a per-run result log; results in memory keep counters
+        # and only this many recent details and errors
+        self.result_log_enabled = os.environ.get('OUTREACH_RESULT_LOG_ENABLED', 'true').lower() != 'false'
+        self.result_log_dir = result_log_dir()
+        self.results_recent_limit = int(os.environ.get('OUTREACH_RESULTS_RECENT_LIMIT', '100'))
+        # A knowledge base over the token budget is chunked and indexed, and each
+        # row gets only its top-k most relevant chunks that fit the budget
+        self.knowledge_retrieval = os.environ.get('OUTREACH_KB_RETRIEVAL', 'false').lower() == 'true'
+        self.knowledge_token_budget = int(os.environ.get('OUTREACH_KB_TOKEN_BUDGET', '1500'))
+        self.knowledge_top_k = int(os.environ.get('OUTREACH_KB_TOP_K', '6'))
+        self.knowledge_chunk_tokens = int(os.environ.get('OUTREACH_KB_CHUNK_TOKENS', '250'))
+        # Company rows generated per OpenAI request in the sequential, concurrent,
+        # render and async modes; rows missing from the answer are generated one by one
+        self.leads_per_request = max(1, int(os.environ.get('OUTREACH_LEADS_PER_REQUEST', '1')))
+        # Stream single-row generations, validating the JSON as it arrives and
+        # stopping a bad or runaway answer early
+        self.streaming = os.environ.get('OUTREACH_STREAMING', 'false').lower() == 'true'
+        self.max_body_chars = int(os.environ.get('OUTREACH_MAX_BODY_CHARS', '8000'))
         
-        # Prompt template from n8n workflow
+        # Prompt template from n8n workflow. It is sent verbatim together with the
+        # knowledge base as a prefix shared by every row, so it must not contain
+        # per-row data; the row itself goes in row_template.
         self.prompt_template = """You are an automation outreach agent.
 Follow all instructions EXACTLY.
 
@@ -24,9 +198,8 @@ Your ONLY job is to output the required JSON fields. Nothing else.
 ────────────────────────────────────────
 COMPANY DATA (JSON INPUT)
 
-Use this company row EXACTLY as provided:
-
-{company_data}
+The company row is given as JSON in the COMPANY DATA message that follows
+these instructions. Use it EXACTLY as provided.
 
 This JSON contains the target company details, including the field:
 "email_to_use"
@@ -93,11 +266,11 @@ STEP 3 — OUTPUT FORMAT (STRICT)
 
 Your final output MUST be a valid JSON object that EXACTLY matches this structure:
 
-{{
+{
   "to": "<email_to_use>",
   "subject": "<generated subject>",
   "emailBody": "<generated HTML email>"
-}}
+}
 
 RULES (VERY IMPORTANT):
 • Do NOT wrap the JSON in quotes.
@@ -119,108 +292,1274 @@ GLOBAL RULES (STRICT)
     - subject  
     - emailBody
 """
+        self.row_template = """COMPANY DATA (JSON INPUT)
+
+Use this company row EXACTLY as provided:
+
+{company_data}
+"""
+        # Per-request part of a multi-lead prompt, in place of row_template
+        self.multi_row_template = """COMPANY DATA (JSON INPUT)
+
+This message holds {count} company rows. Write one email for each row, following
+the instructions above for every row exactly as if it were the only one and using
+only that row's data. Use each company row EXACTLY as provided:
+
+{companies}
+
+OUTPUT FORMAT FOR SEVERAL ROWS (STRICT)
+
+Output ONE JSON object with an "emails" array holding exactly one object per row,
+in the order given, each with the "row" number of its company:
+
+{{"emails": [{{"row": <row>, "to": "<email_to_use of that row>", "subject": "<subject line>", "emailBody": "<generated HTML email>"}}]}}
+"""
+    
+    def execute(self, start_row: int, end_row: int, mode: str = None,
+                cancel_event: threading.Event = None, progress_callback=None,
+                event_callback=None, run_id: str = None) -> Dict[str, Any]:
+        """Execute the outreach workflow for the given row range
+        
+        ``mode`` is one of EXECUTION_MODES and defaults to OUTREACH_EXECUTION_MODE;
+        'async' runs execute_async() on a new event loop in the calling thread,
+        and 'render' sends nothing: the drafts go to a campaign bundle whose
+        path is returned in ``results['bundle']``.
+        Setting ``cancel_event`` stops the run before the next row,
+        ``progress_callback(results)`` is called whenever the results change and
+        ``event_callback(event)`` receives per-row events (fetched, generated,
+        sent, skipped, error) with the running counters.
+        
+        With a checkpoint store, progress is saved under ``run_id`` (a new id
+        when omitted); passing the id of an unfinished run continues it after
+        its last completed row, see resume().
+        """
+        mode = mode or self.execution_mode
+        if mode not in EXECUTION_MODES:
+            raise Exception(f"Unknown execution mode: {mode}")
+        if mode == 'async':
+            return asyncio.run(self.execute_async(
+                start_row, end_row, cancel_event=cancel_event, progress_callback=progress_callback,
+                event_callback=event_callback, run_id=run_id
+            ))
+        
+        run, first_row = self._begin_run(start_row, end_row, mode, cancel_event, progress_callback, event_callback, run_id)
+        
+        # Get knowledge base once
+        try:
+            with run.timings.time('knowledge_base'):
+                run.knowledge_base = self.docs_service.get_document()
+            self._prepare_knowledge_base(run)
+            logger.info("Knowledge base fetched successfully")
+        except Exception as e:
+            return self._knowledge_base_failed(run, e)
+        
+        if first_row <= end_row:
+            if mode == 'concurrent':
+                # One pooled SMTP connection per concurrent send
+                send_limit = self.send_max_concurrency if self.adaptive_concurrency else self.send_concurrency
+                with self.email_service.session(pool_size=send_limit):
+                    self._execute_concurrent(run, first_row, end_row)
+            elif mode == 'batch':
+                self._execute_batch(run, first_row, end_row)
+            elif mode == 'render':
+                self._execute_render(run, first_row, end_row)
+            else:
+                # Send the whole batch over one pooled SMTP session
+                with self.email_service.session():
+                    self._execute_sequential(run, first_row, end_row)
+        
+        return self._end_run(run)
     
-    def execute(self, start_row: int, end_row: int) -> Dict[str, Any]:
-        """Execute the outreach workflow for the given row range"""
+    async def execute_async(self, start_row: int, end_row: int, cancel_event: threading.Event = None,
+                            progress_callback=None, event_callback=None, run_id: str = None) -> Dict[str, Any]:
+        """execute() on asyncio: every row is a task on one event loop instead of a thread
+        
+        Rows are read with the lead source's get_rows_async, generated with
+        AsyncOpenAI and sent over pooled aiosmtplib connections, so one
+        process can keep hundreds of rows in flight. The generate and send
+        limits work as in 'concurrent' mode, and at most
+        OUTREACH_ASYNC_MAX_IN_FLIGHT rows are held in memory at once.
+        Results, events and checkpoints are the same as execute()'s.
+        """
+        run, first_row = self._begin_run(start_row, end_row, 'async', cancel_event, progress_callback, event_callback, run_id)
+        
+        try:
+            with run.timings.time('knowledge_base'):
+                run.knowledge_base = await self.docs_service.get_document_async()
+            self._prepare_knowledge_base(run)
+            logger.info("Knowledge base fetched successfully")
+        except Exception as e:
+            return self._knowledge_base_failed(run, e)
+        
+        try:
+            if first_row <= end_row:
+                send_limit = self.send_max_concurrency if self.adaptive_concurrency else self.send_concurrency
+                async with self.email_service.async_session(pool_size=send_limit):
+                    await self._execute_async_rows(run, first_row, end_row)
+        finally:
+            # HTTP clients are bound to this loop, which usually ends with the run
+            for service in (self.ai_service, self.lead_source, self.docs_service):
+                await service.aclose()
+        
+        return self._end_run(run)
+    
+    def _begin_run(self, start_row: int, end_row: int, mode: str, cancel_event: threading.Event,
+                   progress_callback, event_callback, run_id: str):
+        """Create the run state and checkpoint; returns the run and the first row left to do"""
+        run = self._new_run(cancel_event, progress_callback, event_callback)
+        results = run.results
+        if mode == 'render':
+            results['rendered'] = 0
+        
+        first_row = start_row
+        if self.checkpoints:
+            run.run_id = run_id or uuid.uuid4().hex
+            results['run_id'] = run.run_id
+            first_row = self._restore_checkpoint(run, start_row, end_row, mode)
+        # A resumed run appends to the log it started
+        self._open_result_log(run, run.run_id or run_id)
+        run.notify()
+        return run, first_row
+    
+    def _new_run(self, cancel_event: threading.Event, progress_callback, event_callback) -> '_Run':
+        """Run state with empty results
+        
+        ``errors`` and ``details`` hold only the most recent entries, so the
+        results of a huge range stay small; ``error_count`` counts them all
+        and the result log keeps every one.
+        """
         results = {
             'processed': 0,
             'sent': 0,
             'skipped': 0,
-            'errors': [],
-            'details': []
+            'error_count': 0,
+            'errors': deque(maxlen=self.results_recent_limit),
+            'details': deque(maxlen=self.results_recent_limit)
         }
+        run = _Run(results, cancel_event, progress_callback, event_callback)
+        run.throttle_before = limiter_stats()
+        return run
+    
+    def _open_result_log(self, run: '_Run', log_id: str = None):
+        """Start logging the run's outcomes under ``log_id`` (a new id when omitted)"""
+        if not self.result_log_enabled:
+            return
+        log_id = log_id or uuid.uuid4().hex
+        try:
+            run.log = ResultLog(result_log_path(log_id, self.result_log_dir))
+            run.results['result_log'] = log_id
+        except OSError as e:
+            # Without a log the run still goes ahead with its recent results only
+            logger.error(f"Result log unavailable: {str(e)}")
+    
+    @staticmethod
+    def _close_results(run: '_Run'):
+        """Close the result log and turn the recent entries into plain lists for the caller"""
+        if run.log:
+            run.log.close()
+            run.log = None
+        run.results['errors'] = list(run.results['errors'])
+        run.results['details'] = list(run.results['details'])
+    
+    def _knowledge_base_failed(self, run: '_Run', error: Exception) -> Dict[str, Any]:
+        """End a run whose knowledge base could not be fetched"""
+        logger.error(f"Error fetching knowledge base: {str(error)}")
+        run.add_error(f"Knowledge base error: {str(error)}")
+        run.results['incomplete'] = True
+        self._finish_checkpoint(run, RUN_INCOMPLETE)
+        self._close_results(run)
+        run.notify()
+        return run.results
+    
+    def _end_run(self, run: '_Run') -> Dict[str, Any]:
+        """Add the run summaries to the results and record how the run ended"""
+        results = run.results
+        results['prompt_cache'] = self._prompt_cache_summary(run.usage, run.instructions)
+        if run.knowledge_index:
+            results['knowledge_retrieval'] = dict(
+                run.knowledge_index.stats(), token_budget=self.knowledge_token_budget, top_k=self.knowledge_top_k
+            )
+        if self.generation_cache:
+            results['generation_cache'] = dict(run.generation_cache)
+        if run.multi_lead['requests']:
+            results['multi_lead'] = dict(run.multi_lead)
+        if self.recipient_validator:
+            results['recipient_validation'] = dict(run.recipient_checks, rejected=len(run.invalid_recipients))
+        results['metrics'] = self._metrics_summary(run)
+        # Calls, retries and seconds spent waiting on each service's rate limiter during the run
+        results['throttling'] = stats_delta(run.throttle_before, limiter_stats())
         
-        # Get knowledge base once
+        if run.cancelled():
+            logger.info(f"Run cancelled after {results['processed']} processed rows")
+            results['cancelled'] = True
+            self._finish_checkpoint(run, RUN_CANCELLED)
+        elif run.fetch_failed:
+            results['incomplete'] = True
+            self._finish_checkpoint(run, RUN_INCOMPLETE)
+        else:
+            self._finish_checkpoint(run, RUN_COMPLETED)
+        self._close_results(run)
+        run.notify()
+        
+        return results
+    
+    def resume(self, run_id: str, **kwargs) -> Dict[str, Any]:
+        """Continue a checkpointed run after its last completed row
+        
+        Keyword arguments are passed on to execute(). The returned results
+        cover the whole run, including rows finished before the interruption.
+        """
+        if not self.checkpoints:
+            raise Exception("Checkpoints are not enabled")
+        
+        checkpoint = self.checkpoints.get_run(run_id)
+        if not checkpoint:
+            raise Exception(f"Unknown run: {run_id}")
+        if checkpoint['status'] == RUN_COMPLETED:
+            raise Exception(f"Run {run_id} already completed")
+        
+        kwargs.setdefault('mode', checkpoint['mode'])
+        return self.execute(checkpoint['start_row'], checkpoint['end_row'], run_id=run_id, **kwargs)
+    
+    def _restore_checkpoint(self, run: '_Run', start_row: int, end_row: int, mode: str) -> int:
+        """Register the run, replay rows it already finished and return the first row left to do"""
         try:
-            knowledge_base = self.docs_service.get_document()
-            logger.info("Knowledge base fetched successfully")
+            self.checkpoints.create_run(run.run_id, start_row, end_row, mode)
+            checkpoint = self.checkpoints.get_run(run.run_id)
+            self.checkpoints.set_status(run.run_id, RUN_RUNNING)
+            
+            if checkpoint['last_completed_row'] is None:
+                return start_row
+            
+            for outcome in self.checkpoints.row_outcomes(run.run_id):
+                self._apply_outcome(run.results, outcome)
+            
+            first_row = checkpoint['last_completed_row'] + 1
+            run.results['resumed_from'] = first_row
+            logger.info(f"Resuming run {run.run_id} at row {first_row}")
+            return first_row
+        except Exception as e:
+            # Without a usable checkpoint the run still goes ahead, just not resumably
+            logger.error(f"Checkpoint store unavailable: {str(e)}")
+            run.run_id = None
+            return start_row
+    
+    def _finish_checkpoint(self, run: '_Run', status: str):
+        """Record how the run ended"""
+        if not self.checkpoints or not run.run_id:
+            return
+        try:
+            self.checkpoints.set_status(run.run_id, status)
+        except Exception as e:
+            logger.error(f"Failed to update checkpoint for run {run.run_id}: {str(e)}")
+    
+    def _execute_sequential(self, run: '_Run', start_row: int, end_row: int):
+        """Fetch, generate and send one row at a time"""
+        try:
+            # Read the range in bulk from the lead source
+            for rows in self._row_groups(self._iter_rows(run, start_row, end_row)):
+                if run.cancelled():
+                    break
+                for outcome in self._process_rows(run, rows):
+                    self._record_outcome(run, outcome)
+        except Exception as e:
+            # Reading the range itself failed; rows after this point are not processed
+            logger.error(f"Error fetching rows {start_row}-{end_row}: {str(e)}")
+            run.add_error(f"Row fetch error: {str(e)}")
+            run.fetch_failed = True
+            run.notify()
+    
+    def _execute_concurrent(self, run: '_Run', start_row: int, end_row: int):
+        """Overlap the fetch, generate and send stages across rows
+        
+        Lead source chunks are read ahead by a fetch pool, and each row runs in a
+        worker that takes a generate slot for the AI call and a send slot for
+        SMTP, so every stage has its own concurrency limit. Outcomes are
+        recorded in row order.
+        
+        With adaptive concurrency the generate and send limits are
+        AdaptiveLimiters that follow the latency of each call and back off
+        whenever the OpenAI or SMTP rate limiter sees a transient error.
+        """
+        if self.adaptive_concurrency:
+            generate_slots = AdaptiveLimiter('generate', self.generate_concurrency, maximum=self.generate_max_concurrency)
+            send_slots = AdaptiveLimiter('send', self.send_concurrency, maximum=self.send_max_concurrency)
+            run.limiters = {'generate': generate_slots, 'send': send_slots}
+            row_workers = generate_slots.maximum + send_slots.maximum
+        else:
+            generate_slots = threading.BoundedSemaphore(self.generate_concurrency)
+            send_slots = threading.BoundedSemaphore(self.send_concurrency)
+            row_workers = self.generate_concurrency + self.send_concurrency
+        
+        with self._backoff_on_throttling(run):
+            self._run_concurrent(run, start_row, end_row, generate_slots, send_slots, row_workers)
+    
+    @contextmanager
+    def _backoff_on_throttling(self, run: '_Run'):
+        """Shrink a stage's adaptive limit whenever this run's OpenAI or SMTP calls hit a transient error
+        
+        Listening is scoped to the run's context, so other jobs sharing the
+        process-wide rate limiters do not shrink this run's limits. Row
+        workers are submitted with contextvars.copy_context().run to inherit it.
+        """
+        with ExitStack() as stack:
+            for service, stage in ((self.ai_service, 'generate'), (self.email_service, 'send')):
+                service_limiter = getattr(service, 'limiter', None)
+                if stage in run.limiters and service_limiter:
+                    stack.enter_context(service_limiter.listening(run.limiters[stage].on_transient_error))
+            yield
+    
+    def _run_concurrent(self, run: '_Run', start_row: int, end_row: int,
+                        generate_slots, send_slots, row_workers: int):
+        """Pipeline body of _execute_concurrent; each worker handles a group of leads_per_request rows"""
+        # Bound how far fetching may run ahead of generation and sending
+        max_pending = row_workers * 2
+        pending = deque()
+        
+        with ThreadPoolExecutor(max_workers=self.fetch_concurrency) as fetch_pool, \
+                ThreadPoolExecutor(max_workers=row_workers) as row_pool:
+            fetch_error = None
+            try:
+                for rows in self._row_groups(self._prefetch_rows(run, fetch_pool, start_row, end_row)):
+                    # Rows already submitted still finish; nothing new starts after a cancel
+                    if run.cancelled():
+                        break
+                    pending.append(row_pool.submit(
+                        contextvars.copy_context().run, self._process_rows, run, rows, generate_slots, send_slots
+                    ))
+                    while pending and (len(pending) >= max_pending or pending[0].done()):
+                        for outcome in pending.popleft().result():
+                            self._record_outcome(run, outcome)
+            except Exception as e:
+                # Reading the range itself failed; rows after this point are not processed
+                logger.error(f"Error fetching rows {start_row}-{end_row}: {str(e)}")
+                fetch_error = e
+            
+            while pending:
+                for outcome in pending.popleft().result():
+                    self._record_outcome(run, outcome)
+            
+            if fetch_error:
+                run.add_error(f"Row fetch error: {str(fetch_error)}")
+                run.fetch_failed = True
+                run.notify()
+    
+    async def _execute_async_rows(self, run: '_Run', start_row: int, end_row: int):
+        """Pipeline of execute_async: one task per row, outcomes recorded in row order"""
+        if self.adaptive_concurrency:
+            # Waiting generations cost a task rather than a thread, so the ceiling is the in-flight bound
+            generate_slots = AdaptiveLimiter('generate', self.generate_concurrency, maximum=self.async_max_in_flight)
+            send_slots = AdaptiveLimiter('send', self.send_concurrency, maximum=self.send_max_concurrency)
+            run.limiters = {'generate': generate_slots, 'send': send_slots}
+        else:
+            generate_slots = asyncio.Semaphore(self.generate_concurrency)
+            send_slots = asyncio.Semaphore(self.send_concurrency)
+        
+        pending = deque()
+        # Rows in flight are bounded by async_max_in_flight whatever the group size
+        max_pending = max(1, self.async_max_in_flight // self.leads_per_request)
+        fetch_error = None
+        with self._backoff_on_throttling(run):
+            try:
+                async for rows in self._row_groups_async(self._iter_rows_async(run, start_row, end_row)):
+                    # Rows already started still finish; nothing new starts after a cancel
+                    if run.cancelled():
+                        break
+                    pending.append(asyncio.ensure_future(self._process_rows_async(run, rows, generate_slots, send_slots)))
+                    while pending and (len(pending) >= max_pending or pending[0].done()):
+                        for outcome in await pending.popleft():
+                            self._record_outcome(run, outcome)
+            except Exception as e:
+                # Reading the range itself failed; rows after this point are not processed
+                logger.error(f"Error fetching rows {start_row}-{end_row}: {str(e)}")
+                fetch_error = e
+            
+            while pending:
+                for outcome in await pending.popleft():
+                    self._record_outcome(run, outcome)
+        
+        if fetch_error:
+            run.add_error(f"Row fetch error: {str(fetch_error)}")
+            run.fetch_failed = True
+            run.notify()
+    
+    def _execute_batch(self, run: '_Run', start_row: int, end_row: int):
+        """Generate all rows through the OpenAI Batch API, then send the results
+        
+        Prompts for every eligible row are written to one JSONL file that is
+        submitted as a single batch and polled until it finishes, so no worker
+        waits on individual completions. The send stage then delivers the
+        parsed emails in row order, up to send_concurrency at a time.
+        """
+        os.makedirs(self.batch_dir, exist_ok=True)
+        batch_path = os.path.join(self.batch_dir, f"{run.run_id or uuid.uuid4().hex}.jsonl")
+        
+        # (row_index, company_data, outcome) in row order; outcome is None for rows to generate or send
+        entries = []
+        # Emails taken from the generation cache, by batch custom_id; those rows are not in the batch
+        cached = {}
+        try:
+            with open(batch_path, 'w', encoding='utf-8') as f:
+                for row_index, company_data in self._iter_rows(run, start_row, end_row):
+                    if run.cancelled():
+                        return
+                    outcome = self._screen_row(run, row_index, company_data)
+                    email_content = None if outcome else self._cached_email(run, company_data)
+                    if email_content:
+                        cached[f"row-{row_index}"] = email_content
+                    elif not outcome:
+                        request = self.ai_service.build_batch_request(
+                            f"row-{row_index}", self._build_row_prompt(run, company_data), run.instructions
+                        )
+                        f.write(json.dumps(request) + '\n')
+                    entries.append((row_index, company_data, outcome))
         except Exception as e:
-            logger.error(f"Error fetching knowledge base: {str(e)}")
-            results['errors'].append(f"Knowledge base error: {str(e)}")
-            return results
+            # Rows read before the failure are still generated and sent
+            logger.error(f"Error fetching rows {start_row}-{end_row}: {str(e)}")
+            run.add_error(f"Row fetch error: {str(e)}")
+            run.fetch_failed = True
+            run.notify()
         
-        # Process each row
-        for row_index in range(start_row, end_row + 1):
+        generated = {}
+        batch_error = None
+        if any(outcome is None and f"row-{row_index}" not in cached for row_index, _, outcome in entries):
+            try:
+                batch_id = self.ai_service.submit_batch(batch_path)
+                run.results['batch_id'] = batch_id
+                run.notify()
+                # The whole batch counts as one generate sample
+                with run.timings.time('generate'):
+                    batch = self.ai_service.wait_for_batch(batch_id, run.cancel_event)
+                if run.cancelled():
+                    return
+                if batch.status != 'completed':
+                    logger.warning(f"Batch {batch_id} ended as {batch.status}; rows without output will be errors")
+                generated = self.ai_service.get_batch_results(batch, run.usage)
+            except Exception as e:
+                logger.error(f"Batch generation failed: {str(e)}")
+                batch_error = str(e)
+        
+        with self.email_service.session(pool_size=self.send_concurrency), \
+                ThreadPoolExecutor(max_workers=self.send_concurrency) as send_pool:
+            pending = deque()
+            for row_index, company_data, outcome in entries:
+                if run.cancelled():
+                    break
+                if outcome:
+                    pending.append(outcome)
+                else:
+                    custom_id = f"row-{row_index}"
+                    pending.append(send_pool.submit(
+                        self._send_batch_result, run, row_index, company_data,
+                        generated.get(custom_id), batch_error, cached.get(custom_id)
+                    ))
+                while pending and (isinstance(pending[0], dict) or pending[0].done()):
+                    item = pending.popleft()
+                    self._record_outcome(run, item if isinstance(item, dict) else item.result())
+            
+            while pending:
+                item = pending.popleft()
+                self._record_outcome(run, item if isinstance(item, dict) else item.result())
+    
+    def _send_batch_result(self, run: '_Run', row_index: int, company_data: Dict,
+                           content: str, batch_error: str = None, cached: Dict[str, str] = None) -> Dict[str, Any]:
+        """Parse one row's batch output, or take its cached email, and send it"""
+        try:
+            if cached:
+                return self._deliver_row(run, row_index, company_data, cached)
+            if content is None:
+                return {'row': row_index, 'status': 'error', 'error': batch_error or 'No output in batch results'}
+            email_content = self._cache_email(run, company_data, self._parse_email(content))
+            return self._deliver_row(run, row_index, company_data, email_content)
+        except Exception as e:
+            logger.error(f"Error processing row {row_index}: {str(e)}")
+            return {'row': row_index, 'status': 'error', 'error': str(e)}
+    
+    def _execute_render(self, run: '_Run', start_row: int, end_row: int):
+        """Generate like 'concurrent' mode, writing each draft to the run's campaign bundle instead of sending it
+        
+        The bundle is named after the run id, so resuming a render run appends
+        to the bundle it started.
+        """
+        manifest = {
+            'run_id': run.run_id,
+            'end_row': end_row,
+            'model': self.ai_service.model,
+            'knowledge_base_revision': getattr(self.docs_service, 'revision_id', None),
+            'from_email': self.email_service.from_email
+        }
+        if 'resumed_from' not in run.results:
+            # A resumed run keeps the start row the bundle was created with
+            manifest['start_row'] = start_row
+        
+        path = os.path.join(self.bundle_dir, run.run_id or uuid.uuid4().hex)
+        run.bundle = CampaignBundleWriter(path, render_message=self.email_service.render_message, manifest=manifest)
+        run.results['bundle'] = path
+        run.notify()
+        try:
+            self._execute_concurrent(run, start_row, end_row)
+        finally:
+            run.bundle.close(rendered=run.results['rendered'], cancelled=run.cancelled())
+    
+    def send_bundle(self, path: str, cancel_event: threading.Event = None,
+                    progress_callback=None, event_callback=None) -> Dict[str, Any]:
+        """Deliver the drafts of a campaign bundle written by a 'render' run, without generating anything
+        
+        Drafts are streamed from the bundle and sent over pooled SMTP
+        connections, up to the send limit at once (adaptive as in
+        'concurrent' mode). The send ledger is checked a chunk at a time, so
+        sending the same bundle again, or after an interruption, only
+        delivers drafts that were not sent yet. The bundle can be copied from
+        the machine that rendered it.
+        """
+        manifest = read_manifest(path)
+        run = self._new_run(cancel_event, progress_callback, event_callback)
+        run.results['bundle'] = path
+        self._open_result_log(run)
+        logger.info(f"Sending campaign bundle {path} (run {manifest.get('run_id')})")
+        run.notify()
+        
+        if self.adaptive_concurrency:
+            send_slots = AdaptiveLimiter('send', self.send_concurrency, maximum=self.send_max_concurrency)
+            run.limiters = {'send': send_slots}
+            send_limit = send_slots.maximum
+        else:
+            send_slots = threading.BoundedSemaphore(self.send_concurrency)
+            send_limit = self.send_concurrency
+        
+        with self.email_service.session(pool_size=send_limit), self._backoff_on_throttling(run):
+            try:
+                self._send_drafts(run, path, send_slots, send_limit)
+            except Exception as e:
+                logger.error(f"Error reading bundle {path}: {str(e)}")
+                run.add_error(f"Bundle read error: {str(e)}")
+                run.fetch_failed = True
+        
+        return self._end_run(run)
+    
+    def _send_drafts(self, run: '_Run', path: str, send_slots, send_limit: int):
+        """Pipeline of send_bundle: drafts checked against the ledger per chunk, outcomes recorded in order"""
+        drafts = iter_drafts(path)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=send_limit) as send_pool:
+            try:
+                while not run.cancelled():
+                    with run.timings.time('fetch'):
+                        chunk = list(itertools.islice(drafts, self.fetch_chunk_size))
+                    if not chunk:
+                        break
+                    self._check_ledger(run, [(draft['row'], draft['company_data']) for draft in chunk])
+                    
+                    for draft in chunk:
+                        if run.cancelled():
+                            break
+                        outcome = self._screen_row(run, draft['row'], draft['company_data'])
+                        if outcome:
+                            pending.append(outcome)
+                        else:
+                            email_content = {field: draft[field] for field in ('to', 'subject', 'emailBody')}
+                            pending.append(send_pool.submit(
+                                contextvars.copy_context().run,
+                                self._send_draft, run, draft['row'], draft['company_data'], email_content, send_slots
+                            ))
+                        while pending and (len(pending) >= send_limit * 2 or isinstance(pending[0], dict) or pending[0].done()):
+                            item = pending.popleft()
+                            self._record_outcome(run, item if isinstance(item, dict) else item.result())
+            finally:
+                while pending:
+                    item = pending.popleft()
+                    self._record_outcome(run, item if isinstance(item, dict) else item.result())
+    
+    def _send_draft(self, run: '_Run', row_index: int, company_data: Dict,
+                    email_content: Dict[str, str], send_slots=None) -> Dict[str, Any]:
+        """Send an already generated email, returning the row outcome"""
+        try:
+            return self._deliver_row(run, row_index, company_data, email_content, send_slots)
+        except Exception as e:
+            logger.error(f"Error processing row {row_index}: {str(e)}")
+            return {'row': row_index, 'status': 'error', 'error': str(e)}
+    
+    def _iter_rows(self, run: '_Run', start_row: int, end_row: int):
+        """Yield (row_index, company_data) in order, checking recipients and the send ledger a batch at a time"""
+        rows = iter(self.lead_source.get_rows(start_row, end_row))
+        while True:
+            # Time spent reading is recorded once per batch, not per row
+            fetch_started = time.perf_counter()
+            batch = list(itertools.islice(rows, self.fetch_chunk_size))
+            if not batch:
+                return
+            run.timings.observe('fetch', time.perf_counter() - fetch_started)
+            self._check_recipients(run, batch)
+            self._check_ledger(run, batch)
+            yield from batch
+    
+    async def _iter_rows_async(self, run: '_Run', start_row: int, end_row: int):
+        """_iter_rows for asyncio, reading through the lead source's get_rows_async"""
+        batch = []
+        fetch_started = time.perf_counter()
+        async for row in self.lead_source.get_rows_async(start_row, end_row):
+            batch.append(row)
+            if len(batch) < self.fetch_chunk_size:
+                continue
+            run.timings.observe('fetch', time.perf_counter() - fetch_started)
+            await self._check_recipients_async(run, batch)
+            await self._check_ledger_async(run, batch)
+            for row in batch:
+                yield row
+            batch = []
+            fetch_started = time.perf_counter()
+        
+        if batch:
+            run.timings.observe('fetch', time.perf_counter() - fetch_started)
+            await self._check_recipients_async(run, batch)
+            await self._check_ledger_async(run, batch)
+            for row in batch:
+                yield row
+    
+    def _prefetch_rows(self, run: '_Run', fetch_pool: ThreadPoolExecutor, start_row: int, end_row: int):
+        """Yield (row_index, company_data) in order while up to fetch_concurrency chunks are read ahead"""
+        window = deque()
+        for chunk_start in range(start_row, end_row + 1, self.fetch_chunk_size):
+            chunk_end = min(chunk_start + self.fetch_chunk_size - 1, end_row)
+            window.append(fetch_pool.submit(self._fetch_chunk, run, chunk_start, chunk_end))
+            if len(window) >= self.fetch_concurrency:
+                yield from window.popleft().result()
+        
+        while window:
+            yield from window.popleft().result()
+    
+    def _fetch_chunk(self, run: '_Run', first_row: int, last_row: int) -> List:
+        """Read one chunk of rows and check its recipients and the send ledger"""
+        with run.timings.time('fetch'):
+            rows = list(self.lead_source.get_rows(first_row, last_row))
+        self._check_recipients(run, rows)
+        self._check_ledger(run, rows)
+        return rows
+    
+    def _check_recipients(self, run: '_Run', rows: List):
+        """Validate the recipients of a chunk of rows at once, so their domains are looked up concurrently"""
+        if not self.recipient_validator:
+            return
+        
+        emails = {}
+        for row_index, company_data in rows:
+            email_to_use = (company_data or {}).get('email_to_use', '')
+            if email_to_use:
+                emails.setdefault(email_to_use, []).append(row_index)
+        if not emails:
+            return
+        
+        try:
+            counts = {}
+            with run.timings.time('validate'):
+                reasons = self.recipient_validator.validate_many(emails.keys(), counts)
+            invalid = {
+                row_index: INVALID_REASONS[reason]
+                for email, reason in reasons.items() if reason
+                for row_index in emails[email]
+            }
+            run.add_recipient_checks(counts, invalid)
+        except Exception as e:
+            # Unvalidated rows go ahead; a bad address then fails at send time as before
+            logger.error(f"Recipient validation failed: {str(e)}")
+    
+    async def _check_recipients_async(self, run: '_Run', rows: List):
+        """_check_recipients in a worker thread, since DNS lookups block"""
+        if self.recipient_validator:
+            await asyncio.get_running_loop().run_in_executor(None, self._check_recipients, run, rows)
+    
+    async def _check_ledger_async(self, run: '_Run', rows: List):
+        """_check_ledger in a worker thread, since SQLite calls block"""
+        if self.ledger:
+            await asyncio.get_running_loop().run_in_executor(None, self._check_ledger, run, rows)
+    
+    def _check_ledger(self, run: '_Run', rows: List):
+        """Mark rows whose recipient or content was already sent, with one bulk lookup"""
+        if not self.ledger:
+            return
+        
+        keyed = {}
+        for row_index, company_data in rows:
+            email_to_use = (company_data or {}).get('email_to_use', '')
+            if email_to_use and '@' in email_to_use:
+                key = (self.ledger.normalize_email(email_to_use), self.ledger.row_hash(company_data))
+                keyed.setdefault(key, []).append(row_index)
+        
+        if not keyed:
+            return
+        
+        try:
+            with run.timings.time('ledger'):
+                contacted = self.ledger.contacted(keyed.keys())
+            for key in contacted:
+                run.contacted.update(keyed[key])
+        except Exception as e:
+            # A broken ledger should not stop the run; rows are then treated as new
+            logger.error(f"Send ledger lookup failed: {str(e)}")
+    
+    def _reserve_send(self, row_index: int, company_data: Dict, to_email: str) -> bool:
+        """Reserve the recipient in the ledger right before sending; False if another send has it"""
+        if not self.ledger:
+            return True
+        try:
+            return self.ledger.reserve(to_email, self.ledger.row_hash(company_data), row_index)
+        except Exception as e:
+            # A broken ledger should not stop the run; the row is then sent unreserved
+            logger.error(f"Failed to reserve row {row_index} in the send ledger: {str(e)}")
+            return True
+    
+    def _record_send(self, row_index: int, company_data: Dict, to_email: str, status: str, subject: str = None):
+        """Record a send attempt in the ledger, if one is configured"""
+        if not self.ledger:
+            return
+        try:
+            self.ledger.record(to_email, self.ledger.row_hash(company_data), row_index, status, subject)
+        except Exception as e:
+            logger.error(f"Failed to record row {row_index} in the send ledger: {str(e)}")
+    
+    async def _reserve_send_async(self, row_index: int, company_data: Dict, to_email: str) -> bool:
+        """_reserve_send in a worker thread, since SQLite calls block"""
+        if not self.ledger:
+            return True
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._reserve_send, row_index, company_data, to_email
+        )
+    
+    async def _record_send_async(self, row_index: int, company_data: Dict, to_email: str, status: str, subject: str = None):
+        """_record_send in a worker thread, since SQLite calls block"""
+        if self.ledger:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._record_send, row_index, company_data, to_email, status, subject
+            )
+    
+    def _process_row(self, run: '_Run', row_index: int, company_data: Dict,
+                     generate_slots=None, send_slots=None) -> Dict[str, Any]:
+        """Validate, generate and send a single row, returning its outcome
+        
+        ``generate_slots`` and ``send_slots`` are optional semaphores limiting
+        how many rows may be in each stage at once.
+        """
+        try:
+            outcome = self._screen_row(run, row_index, company_data)
+            if outcome:
+                return outcome
+            
+            # Generate email using AI, unless the same inputs were generated before
+            email_content = self._cached_email(run, company_data)
+            return self._complete_row(run, row_index, company_data, email_content, generate_slots, send_slots)
+        
+        except Exception as e:
+            logger.error(f"Error processing row {row_index}: {str(e)}")
+            return {'row': row_index, 'status': 'error', 'error': str(e)}
+    
+    def _complete_row(self, run: '_Run', row_index: int, company_data: Dict, email_content: Dict[str, str],
+                      generate_slots=None, send_slots=None) -> Dict[str, Any]:
+        """Generate the email of a screened row unless one is given, then deliver it"""
+        if not email_content:
+            with generate_slots or nullcontext(), run.timings.time('generate'):
+                email_content = self._generate_email(run, company_data)
+        return self._deliver_row(run, row_index, company_data, email_content, send_slots)
+    
+    def _row_groups(self, rows):
+        """Group an iterator of (row_index, company_data) into lists of leads_per_request rows"""
+        group = []
+        try:
+            for row in rows:
+                group.append(row)
+                if len(group) >= self.leads_per_request:
+                    yield group
+                    group = []
+        except Exception:
+            # Rows read before a fetch error are still processed
+            if group:
+                yield group
+            raise
+        if group:
+            yield group
+    
+    async def _row_groups_async(self, rows):
+        """_row_groups for an async iterator"""
+        group = []
+        try:
+            async for row in rows:
+                group.append(row)
+                if len(group) >= self.leads_per_request:
+                    yield group
+                    group = []
+        except Exception:
+            if group:
+                yield group
+            raise
+        if group:
+            yield group
+    
+    def _process_rows(self, run: '_Run', rows: List, generate_slots=None, send_slots=None) -> List[Dict[str, Any]]:
+        """Process a group of rows, generating the emails of its eligible uncached rows in one request
+        
+        Rows the multi-lead answer leaves out or gets wrong are generated
+        one by one. Returns the outcomes in row order.
+        """
+        if len(rows) == 1:
+            row_index, company_data = rows[0]
+            return [self._process_row(run, row_index, company_data, generate_slots, send_slots)]
+        
+        screened, to_generate = self._screen_rows(run, rows)
+        generated = {}
+        if len(to_generate) > 1:
+            try:
+                with generate_slots or nullcontext(), run.timings.time('generate'):
+                    generated = self._generate_emails(run, to_generate)
+            except Exception as e:
+                logger.error(f"Multi-lead generation failed, generating rows one by one: {str(e)}")
+                run.count_multi_lead(len(to_generate), len(to_generate))
+        
+        outcomes = []
+        for row_index, company_data in rows:
+            outcome = screened[row_index]
+            if outcome.get('status'):
+                outcomes.append(outcome)
+                continue
+            try:
+                email_content = outcome.get('email') or generated.get(row_index)
+                outcomes.append(self._complete_row(run, row_index, company_data, email_content, generate_slots, send_slots))
+            except Exception as e:
+                logger.error(f"Error processing row {row_index}: {str(e)}")
+                outcomes.append({'row': row_index, 'status': 'error', 'error': str(e)})
+        return outcomes
+    
+    async def _process_rows_async(self, run: '_Run', rows: List, generate_slots, send_slots) -> List[Dict[str, Any]]:
+        """_process_rows for asyncio"""
+        if len(rows) == 1:
+            row_index, company_data = rows[0]
+            return [await self._process_row_async(run, row_index, company_data, generate_slots, send_slots)]
+        
+        screened, to_generate = self._screen_rows(run, rows)
+        generated = {}
+        if len(to_generate) > 1:
+            try:
+                async with generate_slots:
+                    with run.timings.time('generate'):
+                        response = await self.ai_service.generate_email_async(
+                            self._build_multi_row_prompt(run, to_generate),
+                            instructions=run.instructions,
+                            usage=run.usage,
+                            max_tokens=EMAIL_MAX_TOKENS * len(to_generate)
+                        )
+                generated = self._accept_emails(run, to_generate, response)
+            except Exception as e:
+                logger.error(f"Multi-lead generation failed, generating rows one by one: {str(e)}")
+                run.count_multi_lead(len(to_generate), len(to_generate))
+        
+        outcomes = []
+        for row_index, company_data in rows:
+            outcome = screened[row_index]
+            if outcome.get('status'):
+                outcomes.append(outcome)
+                continue
+            try:
+                email_content = outcome.get('email') or generated.get(row_index)
+                outcomes.append(await self._complete_row_async(run, row_index, company_data, email_content,
+                                                               generate_slots, send_slots))
+            except Exception as e:
+                logger.error(f"Error processing row {row_index}: {str(e)}")
+                outcomes.append({'row': row_index, 'status': 'error', 'error': str(e)})
+        return outcomes
+    
+    def _screen_rows(self, run: '_Run', rows: List):
+        """Screen a group of rows and look up their cached emails
+        
+        Returns a dict of row_index to either the final outcome of a row that
+        stops at screening or {'email': cached email or None}, and the
+        (row_index, company_data) pairs that still need generating.
+        """
+        screened = {}
+        to_generate = []
+        for row_index, company_data in rows:
+            outcome = self._screen_row(run, row_index, company_data)
+            if outcome:
+                screened[row_index] = outcome
+                continue
+            email_content = self._cached_email(run, company_data)
+            screened[row_index] = {'email': email_content}
+            if not email_content:
+                to_generate.append((row_index, company_data))
+        return screened, to_generate
+    
+    async def _process_row_async(self, run: '_Run', row_index: int, company_data: Dict,
+                                 generate_slots, send_slots) -> Dict[str, Any]:
+        """_process_row for asyncio; the slots are AdaptiveLimiters or asyncio semaphores"""
+        try:
+            outcome = self._screen_row(run, row_index, company_data)
+            if outcome:
+                return outcome
+            
+            email_content = self._cached_email(run, company_data)
+            return await self._complete_row_async(run, row_index, company_data, email_content, generate_slots, send_slots)
+        
+        except Exception as e:
+            logger.error(f"Error processing row {row_index}: {str(e)}")
+            return {'row': row_index, 'status': 'error', 'error': str(e)}
+    
+    async def _complete_row_async(self, run: '_Run', row_index: int, company_data: Dict,
+                                  email_content: Dict[str, str], generate_slots, send_slots) -> Dict[str, Any]:
+        """_complete_row for asyncio"""
+        if not email_content:
+            async with generate_slots:
+                with run.timings.time('generate'):
+                    email_content = await self._generate_email_async(run, company_data)
+        return await self._deliver_row_async(run, row_index, company_data, email_content, send_slots)
+    
+    def _screen_row(self, run: '_Run', row_index: int, company_data: Dict) -> Dict[str, Any]:
+        """Checks that run before generation; returns the outcome of a row that stops here, else None"""
+        logger.info(f"Processing row {row_index}")
+        run.emit('fetched', row_index)
+        
+        if not company_data:
+            logger.warning(f"No data found for row {row_index}")
+            return {'row': row_index, 'status': 'empty'}
+        
+        # Validate email
+        email_to_use = company_data.get('email_to_use', '')
+        if not email_to_use or '@' not in email_to_use:
+            logger.warning(f"Invalid email for row {row_index}: {email_to_use}")
+            return {'row': row_index, 'status': 'skipped', 'reason': 'Invalid email'}
+        
+        # Addresses the recipient validator rejected: bad syntax, disposable or no mail server
+        reason = run.invalid_recipients.get(row_index)
+        if reason:
+            logger.warning(f"Undeliverable email for row {row_index} ({reason}): {email_to_use}")
+            return {'row': row_index, 'status': 'skipped', 'reason': reason}
+        
+        # Skip recipients the ledger says were already contacted, before paying for generation
+        if row_index in run.contacted:
+            logger.info(f"Row {row_index} already contacted, skipping: {email_to_use}")
+            return {'row': row_index, 'status': 'skipped', 'reason': 'Already contacted'}
+        
+        return None
+    
+    def _deliver_row(self, run: '_Run', row_index: int, company_data: Dict,
+                     email_content: Dict[str, str], send_slots=None) -> Dict[str, Any]:
+        """Send a generated email and return the row outcome"""
+        if not email_content:
+            logger.error(f"Failed to generate email for row {row_index}")
+            return {'row': row_index, 'status': 'failed'}
+        run.emit('generated', row_index, to=email_content['to'])
+        
+        if run.bundle:
+            # 'render' mode: keep the draft for send_bundle() instead of sending it
+            run.bundle.add(row_index, company_data, email_content)
+            return {
+                'row': row_index,
+                'status': 'rendered',
+                'to': email_content['to'],
+                'subject': email_content['subject']
+            }
+        
+        # Another run or worker may have sent to this recipient since the ledger was checked
+        if not self._reserve_send(row_index, company_data, email_content['to']):
+            return self._contacted_outcome(row_index, email_content)
+        
+        # Send email
+        with send_slots or nullcontext(), run.timings.time('send'):
             try:
-                logger.info(f"Processing row {row_index}")
-                
-                # Fetch company data from Google Sheets
-                company_data = self.sheets_service.get_row_by_index(row_index)
-                
-                if not company_data:
-                    logger.warning(f"No data found for row {row_index}")
-                    results['skipped'] += 1
-                    continue
-                
-                # Validate email
-                email_to_use = company_data.get('email_to_use', '')
-                if not email_to_use or '@' not in email_to_use:
-                    logger.warning(f"Invalid email for row {row_index}: {email_to_use}")
-                    results['skipped'] += 1
-                    results['details'].append({
-                        'row': row_index,
-                        'status': 'skipped',
-                        'reason': 'Invalid email'
-                    })
-                    continue
-                
-                # Generate email using AI
-                email_content = self._generate_email(company_data, knowledge_base)
-                
-                if not email_content:
-                    logger.error(f"Failed to generate email for row {row_index}")
-                    results['errors'].append(f"Row {row_index}: Email generation failed")
-                    continue
-                
-                # Send email
                 self.email_service.send_email(
                     email_content['to'],
                     email_content['subject'],
                     email_content['emailBody']
                 )
-                
-                results['sent'] += 1
-                results['details'].append({
-                    'row': row_index,
-                    'status': 'sent',
-                    'to': email_content['to'],
-                    'subject': email_content['subject']
-                })
-                
-                logger.info(f"Email sent successfully for row {row_index}")
-                
+            except SMTPDeliveryUncertain:
+                # The server may have the message; a rerun must not send it again
+                self._record_send(row_index, company_data, email_content['to'], 'uncertain', email_content['subject'])
+                raise
+            except Exception:
+                self._record_send(row_index, company_data, email_content['to'], 'failed', email_content['subject'])
+                raise
+        return self._sent_outcome(row_index, company_data, email_content)
+    
+    async def _deliver_row_async(self, run: '_Run', row_index: int, company_data: Dict,
+                                 email_content: Dict[str, str], send_slots) -> Dict[str, Any]:
+        """_deliver_row for asyncio"""
+        if not email_content:
+            logger.error(f"Failed to generate email for row {row_index}")
+            return {'row': row_index, 'status': 'failed'}
+        run.emit('generated', row_index, to=email_content['to'])
+        
+        if not await self._reserve_send_async(row_index, company_data, email_content['to']):
+            return self._contacted_outcome(row_index, email_content)
+        
+        async with send_slots:
+            with run.timings.time('send'):
+                try:
+                    await self.email_service.send_email_async(
+                        email_content['to'],
+                        email_content['subject'],
+                        email_content['emailBody']
+                    )
+                except SMTPDeliveryUncertain:
+                    # The server may have the message; a rerun must not send it again
+                    await self._record_send_async(row_index, company_data, email_content['to'], 'uncertain', email_content['subject'])
+                    raise
+                except Exception:
+                    await self._record_send_async(row_index, company_data, email_content['to'], 'failed', email_content['subject'])
+                    raise
+        await self._record_send_async(row_index, company_data, email_content['to'], 'sent', email_content['subject'])
+        return self._sent_result(row_index, email_content)
+    
+    @staticmethod
+    def _contacted_outcome(row_index: int, email_content: Dict[str, str]) -> Dict[str, Any]:
+        """Outcome of a row whose recipient was reserved or sent to by another send"""
+        logger.info(f"Row {row_index} already contacted or being sent elsewhere, skipping: {email_content['to']}")
+        return {'row': row_index, 'status': 'skipped', 'reason': 'Already contacted'}
+    
+    def _sent_outcome(self, row_index: int, company_data: Dict, email_content: Dict[str, str]) -> Dict[str, Any]:
+        """Record a successful send in the ledger and return the row outcome"""
+        self._record_send(row_index, company_data, email_content['to'], 'sent', email_content['subject'])
+        return self._sent_result(row_index, email_content)
+    
+    @staticmethod
+    def _sent_result(row_index: int, email_content: Dict[str, str]) -> Dict[str, Any]:
+        """Outcome of a row whose email was sent"""
+        logger.info(f"Email sent successfully for row {row_index}")
+        return {
+            'row': row_index,
+            'status': 'sent',
+            'to': email_content['to'],
+            'subject': email_content['subject']
+        }
+    
+    def _record_outcome(self, run: '_Run', outcome: Dict[str, Any]):
+        """Fold a row outcome into the run results, log it, report it and checkpoint it"""
+        event_type, data = self._apply_outcome(run.results, outcome)
+        if run.log:
+            try:
+                run.log.append(outcome)
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to log row {outcome['row']}: {str(e)}")
+        ROWS_TOTAL.inc(status=outcome['status'])
+        if run.limiters:
+            run.results['concurrency'] = {stage: limiter.stats() for stage, limiter in run.limiters.items()}
+        run.emit(event_type, outcome['row'], **data)
+        
+        if self.checkpoints and run.run_id:
+            try:
+                self.checkpoints.record_row(run.run_id, outcome)
             except Exception as e:
-                logger.error(f"Error processing row {row_index}: {str(e)}")
-                results['errors'].append(f"Row {row_index}: {str(e)}")
-            
+                logger.error(f"Failed to checkpoint row {outcome['row']}: {str(e)}")
+        
+        run.notify()
+    
+    @staticmethod
+    def _apply_outcome(results: Dict[str, Any], outcome: Dict[str, Any]):
+        """Fold a row outcome into the results and return its (event_type, event_data)"""
+        row_index = outcome['row']
+        status = outcome['status']
+        
+        if status == 'empty':
+            results['skipped'] += 1
+            return 'skipped', {'reason': 'No data'}
+        elif status == 'skipped':
+            results['skipped'] += 1
+            results['details'].append({
+                'row': row_index,
+                'status': 'skipped',
+                'reason': outcome['reason']
+            })
+            return 'skipped', {'reason': outcome['reason']}
+        elif status == 'failed':
+            results['errors'].append(f"Row {row_index}: Email generation failed")
+            results['error_count'] += 1
+            return 'error', {'error': 'Email generation failed'}
+        elif status in ('sent', 'rendered'):
+            results[status] += 1
+            results['details'].append({
+                'row': row_index,
+                'status': status,
+                'to': outcome['to'],
+                'subject': outcome['subject']
+            })
+            results['processed'] += 1
+            return status, {'to': outcome['to'], 'subject': outcome['subject']}
+        else:
+            results['errors'].append(f"Row {row_index}: {outcome['error']}")
+            results['error_count'] += 1
             results['processed'] += 1
+            return 'error', {'error': outcome['error']}
+    
+    def _prepare_knowledge_base(self, run: '_Run'):
+        """Build the shared prompt prefix, indexing a knowledge base larger than the retrieval budget"""
+        run.knowledge_index = None
+        if self.knowledge_retrieval and estimate_tokens(run.knowledge_base) > self.knowledge_token_budget:
+            with run.timings.time('knowledge_base'):
+                # Built once per document revision and reused by later runs
+                run.knowledge_index = get_index(run.knowledge_base, self.knowledge_chunk_tokens)
+            stats = run.knowledge_index.stats()
+            logger.info(
+                f"Knowledge base of ~{stats['document_tokens']} tokens indexed in {stats['chunks']} chunks; "
+                f"each row gets at most {self.knowledge_top_k} chunks within {self.knowledge_token_budget} tokens"
+            )
+            run.instructions = self._build_instructions(None)
+        else:
+            run.instructions = self._build_instructions(run.knowledge_base)
+    
+    def _build_instructions(self, knowledge_base: str) -> str:
+        """Static prompt prefix shared by every row: instructions, then the knowledge base
         
-        return results
+        Without ``knowledge_base`` the prefix holds only the instructions and
+        each row prompt carries the knowledge base sections retrieved for it.
+        """
+        if knowledge_base is None:
+            return (f"{self.prompt_template}\n\nKNOWLEDGE BASE:\n"
+                    f"The sections of the knowledge base relevant to the company follow its COMPANY DATA.")
+        return f"{self.prompt_template}\n\nKNOWLEDGE BASE:\n{knowledge_base}"
     
-    def _generate_email(self, company_data: Dict, knowledge_base: str) -> Dict[str, str]:
-        """Generate email content using AI"""
-        # Format company data as JSON string
-        company_data_str = json.dumps(company_data, indent=2)
+    def _build_row_prompt(self, run: '_Run', company_data: Dict) -> str:
+        """Per-row part of the prompt, sent after the shared prefix"""
+        prompt = self.row_template.format(company_data=json.dumps(company_data, indent=2))
+        if run.knowledge_index is None:
+            return prompt
         
-        # Build the prompt
-        prompt = self.prompt_template.format(company_data=company_data_str)
+        sections = run.knowledge_index.join(self._knowledge_chunk_ids(run, company_data))
+        return f"{prompt}\nKNOWLEDGE BASE (sections relevant to this company):\n\n{sections}\n"
+    
+    def _build_multi_row_prompt(self, run: '_Run', rows: List) -> str:
+        """Per-request part of a multi-lead prompt: the rows with their numbers, then the retrieved sections"""
+        companies = json.dumps([{'row': row_index, 'company': company_data} for row_index, company_data in rows], indent=2)
+        prompt = self.multi_row_template.format(count=len(rows), companies=companies)
+        if run.knowledge_index is None:
+            return prompt
         
-        # Add knowledge base to context
-        full_prompt = f"{prompt}\n\nKNOWLEDGE BASE:\n{knowledge_base}"
+        # Sections relevant to any of the rows, each included once
+        chunk_ids = set()
+        for _, company_data in rows:
+            chunk_ids.update(self._knowledge_chunk_ids(run, company_data))
+        sections = run.knowledge_index.join(chunk_ids)
+        return f"{prompt}\nKNOWLEDGE BASE (sections relevant to these companies):\n\n{sections}\n"
+    
+    def _knowledge_chunk_ids(self, run: '_Run', company_data: Dict) -> List[int]:
+        """Knowledge base chunks retrieved for a row"""
+        # The row's own values are the query, so an industry or city pulls in the sections about it
+        query = ' '.join(str(value) for value in company_data.values())
+        return run.knowledge_index.select_ids(query, self.knowledge_token_budget, self.knowledge_top_k)
+    
+    def _generate_email(self, run: '_Run', company_data: Dict) -> Dict[str, str]:
+        """Generate email content using AI and store it in the generation cache"""
+        # Row data goes last so the instructions and knowledge base form a
+        # byte-identical prefix the provider can cache across rows
+        if self.streaming:
+            parser = self._stream_parser(company_data)
+            self.ai_service.generate_email_stream(
+                self._build_row_prompt(run, company_data),
+                parser.feed,
+                instructions=run.instructions,
+                usage=run.usage
+            )
+            return self._cache_email(run, company_data, parser.email())
+        
+        response = self.ai_service.generate_email(
+            self._build_row_prompt(run, company_data),
+            instructions=run.instructions,
+            usage=run.usage
+        )
+        
+        return self._cache_email(run, company_data, self._parse_email(response))
+    
+    async def _generate_email_async(self, run: '_Run', company_data: Dict) -> Dict[str, str]:
+        """_generate_email for asyncio"""
+        if self.streaming:
+            parser = self._stream_parser(company_data)
+            await self.ai_service.generate_email_stream_async(
+                self._build_row_prompt(run, company_data),
+                parser.feed,
+                instructions=run.instructions,
+                usage=run.usage
+            )
+            return self._cache_email(run, company_data, parser.email())
         
-        # Call AI service
-        response = self.ai_service.generate_email(full_prompt)
+        response = await self.ai_service.generate_email_async(
+            self._build_row_prompt(run, company_data),
+            instructions=run.instructions,
+            usage=run.usage
+        )
+        return self._cache_email(run, company_data, self._parse_email(response))
+    
+    def _stream_parser(self, company_data: Dict) -> EmailStreamParser:
+        """Parser that checks a streamed email against its row while it is generated"""
+        return EmailStreamParser(company_data.get('email_to_use'), self.max_body_chars)
+    
+    def _generate_emails(self, run: '_Run', rows: List) -> Dict[int, Dict[str, str]]:
+        """Generate the emails of several rows in one request, keyed by row index
         
-        # Parse JSON response
+        Only the emails that pass _parse_emails are returned (and cached).
+        """
+        response = self.ai_service.generate_email(
+            self._build_multi_row_prompt(run, rows),
+            instructions=run.instructions,
+            usage=run.usage,
+            max_tokens=EMAIL_MAX_TOKENS * len(rows)
+        )
+        return self._accept_emails(run, rows, response)
+    
+    def _accept_emails(self, run: '_Run', rows: List, response: str) -> Dict[int, Dict[str, str]]:
+        """Validate a multi-lead answer, count the rows it misses and cache the rest"""
+        emails = self._parse_emails(response, rows)
+        missing = len(rows) - len(emails)
+        if missing:
+            logger.warning(f"Multi-lead answer is missing {missing} of {len(rows)} rows; generating them one by one")
+        run.count_multi_lead(len(rows), missing)
+        for row_index, company_data in rows:
+            if row_index in emails:
+                self._cache_email(run, company_data, emails[row_index])
+        return emails
+    
+    def _generation_key(self, run: '_Run', company_data: Dict) -> str:
+        """Generation cache key of a row: its data, the knowledge base, the prompt, the model and the retrieval settings"""
+        retrieval = None
+        if run.knowledge_index is not None:
+            retrieval = {
+                'top_k': self.knowledge_top_k,
+                'token_budget': self.knowledge_token_budget,
+                'chunk_tokens': self.knowledge_chunk_tokens
+            }
+        return self.generation_cache.make_key(
+            company_data, run.knowledge_base, run.instructions, self.row_template, self.ai_service.model,
+            retrieval=retrieval
+        )
+    
+    def _cached_email(self, run: '_Run', company_data: Dict) -> Dict[str, str]:
+        """The email previously generated from the same inputs, or None"""
+        if not self.generation_cache:
+            return None
         try:
-            # Clean response - remove markdown code blocks if present
-            response_clean = response.strip()
-            if response_clean.startswith('```'):
-                # Remove markdown code block
-                lines = response_clean.split('\n')
-                response_clean = '\n'.join(lines[1:-1])
-            
-            email_content = json.loads(response_clean)
+            email_content = self.generation_cache.get(self._generation_key(run, company_data))
+        except Exception as e:
+            # A broken cache should not stop the run; the row is then generated
+            logger.error(f"Generation cache lookup failed: {str(e)}")
+            return None
+        run.count_cache_lookup(email_content is not None)
+        return email_content
+    
+    def _cache_email(self, run: '_Run', company_data: Dict, email_content: Dict[str, str]) -> Dict[str, str]:
+        """Store a parsed email in the generation cache and return it"""
+        if self.generation_cache and email_content:
+            try:
+                self.generation_cache.put(self._generation_key(run, company_data), email_content)
+            except Exception as e:
+                logger.error(f"Failed to store generated email in the cache: {str(e)}")
+        return email_content
+    
+    @staticmethod
+    def _strip_code_fence(response: str) -> str:
+        """Model output without a surrounding markdown code block"""
+        response_clean = response.strip()
+        if response_clean.startswith('```'):
+            lines = response_clean.split('\n')
+            response_clean = '\n'.join(lines[1:-1])
+        return response_clean
+    
+    def _parse_email(self, response: str) -> Dict[str, str]:
+        """Parse and validate the JSON email returned by the model"""
+        try:
+            email_content = json.loads(self._strip_code_fence(response))
             
             # Validate required fields
             if 'to' in email_content and 'subject' in email_content and 'emailBody' in email_content:
@@ -228,9 +1567,73 @@ GLOBAL RULES (STRICT)
             else:
                 logger.error("AI response missing required fields")
                 return None
-                
+        
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse AI response as JSON: {str(e)}")
             logger.error(f"Response was: {response[:500]}")
             return None
-
+    
+    def _parse_emails(self, response: str, rows: List) -> Dict[int, Dict[str, str]]:
+        """Parse a multi-lead answer strictly, keeping only the emails that can be trusted
+        
+        An email is kept when its "row" is one of the requested rows and
+        appears once, its fields are non-empty strings and its "to" is that
+        row's email_to_use, so an email can never go to another row's
+        recipient. Every other row is left out for a per-row retry.
+        """
+        try:
+            parsed = json.loads(self._strip_code_fence(response))
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse multi-lead AI response as JSON: {str(e)}")
+            return {}
+        entries = parsed.get('emails') if isinstance(parsed, dict) else None
+        if not isinstance(entries, list):
+            logger.error("Multi-lead AI response has no \"emails\" array")
+            return {}
+        
+        recipients = {row_index: company_data.get('email_to_use', '') for row_index, company_data in rows}
+        emails = {}
+        seen = set()
+        for entry in entries:
+            row_index = entry.get('row') if isinstance(entry, dict) else None
+            if type(row_index) is not int or row_index not in recipients:
+                continue
+            if row_index in seen:
+                # Two answers for one row: trust neither
+                emails.pop(row_index, None)
+                continue
+            seen.add(row_index)
+            
+            email_content = {field: entry.get(field) for field in ('to', 'subject', 'emailBody')}
+            if not all(isinstance(value, str) and value.strip() for value in email_content.values()):
+                continue
+            if email_content['to'].strip().lower() != recipients[row_index].strip().lower():
+                logger.warning(f"Multi-lead email for row {row_index} is addressed to {email_content['to']}, not the row's recipient")
+                continue
+            emails[row_index] = email_content
+        return emails
+    
+    @staticmethod
+    def _metrics_summary(run: '_Run') -> Dict[str, Any]:
+        """Throughput, per-stage timings and token counts of a run"""
+        elapsed = time.monotonic() - run.started
+        rows = run.results['processed'] + run.results['skipped']
+        return {
+            'elapsed_seconds': round(elapsed, 3),
+            'rows_per_second': round(rows / elapsed, 3) if elapsed > 0 else 0.0,
+            'stages': run.timings.summary(),
+            'tokens': {
+                'prompt': run.usage['prompt_tokens'],
+                'cached_prompt': run.usage['cached_prompt_tokens'],
+                'completion': run.usage['completion_tokens']
+            }
+        }
+    
+    @staticmethod
+    def _prompt_cache_summary(usage: Dict[str, int], instructions: str) -> Dict[str, Any]:
+        """Token usage of a run and how much of the prompt the provider served from cache"""
+        summary = dict(usage)
+        prompt_tokens = usage['prompt_tokens']
+        summary['cache_hit_ratio'] = round(usage['cached_prompt_tokens'] / prompt_tokens, 4) if prompt_tokens else 0.0
+        summary['shared_prefix_chars'] = len(instructions or '')
+        return summary
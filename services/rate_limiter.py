@@ -0,0 +1,337 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import smtplib
+import threading
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Default requests per second and burst size per service (0 means unlimited).
+# Sheets allows 60 reads per minute per user; Docs has the same read quota.
+DEFAULT_LIMITS = {
+    'openai': (0, 0),
+    'sheets': (1.0, 10),
+    'docs': (1.0, 5),
+    'smtp': (0, 0),
+}
+
+# HTTP statuses worth retrying
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# SMTP replies meaning "try again later": service unavailable, mailbox busy,
+# local error and insufficient storage
+RETRYABLE_SMTP_CODES = (421, 450, 451, 452)
+
+# (limiter, listener) pairs registered with RateLimiter.listening() by the code running
+# in the current context, so one run only hears about the errors of its own calls
+_context_listeners = contextvars.ContextVar('rate_limit_listeners', default=())
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens per second up to ``burst``"""
+    
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _reserve(self) -> float:
+        """Take one token and return how long to wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+        
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+    
+    def acquire(self) -> float:
+        """Take one token, sleeping until it is available; returns the seconds waited
+        
+        A token is reserved before sleeping, so concurrent callers queue up
+        behind each other instead of all waking at the same moment.
+        """
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+    
+    async def acquire_async(self) -> float:
+        """acquire() for coroutines: waits with asyncio.sleep instead of blocking the loop"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+def status_code(error: Exception) -> Optional[int]:
+    """HTTP status of an OpenAI APIStatusError, a googleapiclient HttpError or an httpx HTTPStatusError"""
+    code = getattr(error, 'status_code', None)
+    if code is None:
+        resp = getattr(error, 'resp', None)
+        code = getattr(resp, 'status', None)
+    if code is None:
+        response = getattr(error, 'response', None)
+        code = getattr(response, 'status_code', None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from a Retry-After header if present"""
+    headers = None
+    response = getattr(error, 'response', None)
+    if response is not None:
+        headers = getattr(response, 'headers', None)
+    if headers is None:
+        headers = getattr(error, 'resp', None)
+    if not headers:
+        return None
+    
+    try:
+        value = headers.get('retry-after') or headers.get('Retry-After')
+    except Exception:
+        return None
+    if not value:
+        return None
+    
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an error is a transient quota, overload or network failure"""
+    # Socket timeouts (TimeoutError since Python 3.10), resets and dropped SMTP sessions,
+    # from smtplib and aiosmtplib alike
+    if isinstance(error, (TimeoutError, ConnectionError, smtplib.SMTPServerDisconnected)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code in RETRYABLE_SMTP_CODES
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(
+            code in RETRYABLE_SMTP_CODES for code, _ in error.recipients.values()
+        )
+    if type(error).__module__.startswith('aiosmtplib'):
+        # aiosmtplib reports the reply as .code, and refused recipients as a list of errors
+        recipients = getattr(error, 'recipients', None)
+        if recipients:
+            return all(getattr(recipient, 'code', None) in RETRYABLE_SMTP_CODES for recipient in recipients)
+        return getattr(error, 'code', None) in RETRYABLE_SMTP_CODES
+    
+    # An exhausted OpenAI quota also comes back as a 429 but will not clear up by waiting
+    if getattr(error, 'code', None) == 'insufficient_quota':
+        return False
+    
+    code = status_code(error)
+    if code is not None:
+        return code in RETRYABLE_STATUSES
+    
+    # OpenAI and httpx timeouts and connection failures carry no status
+    return type(error).__name__ in (
+        'APITimeoutError', 'APIConnectionError', 'Timeout', 'timeout',
+        'ConnectTimeout', 'ReadTimeout', 'PoolTimeout', 'ConnectError', 'RemoteProtocolError'
+    )
+
+
+class RateLimiter:
+    """Token bucket plus retries with jittered exponential backoff for one service
+    
+    ``call`` waits for a token, runs the function and retries transient
+    failures (429s, 5xx, SMTP 4xx, timeouts), honouring Retry-After when the
+    server sends one. Time spent waiting is counted so quotas can be sized.
+    Listeners registered with listening() are told about every transient
+    error of the calls made in their context, including ones a retry later
+    recovers from.
+    """
+    
+    def __init__(self, name: str, rate: float = 0, burst: int = 1, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 60.0):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'failures': 0,
+            'throttled_seconds': 0.0,
+            'backoff_seconds': 0.0
+        }
+    
+    def backoff_delay(self, attempt: int, error: Exception = None) -> float:
+        """Delay before retry ``attempt`` (1-based): Retry-After, else full-jitter exponential"""
+        server_delay = retry_after(error) if error is not None else None
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+    
+    def call(self, func: Callable, *args, **kwargs) -> Any:
+        """Run ``func(*args, **kwargs)`` under the rate limit, retrying transient errors"""
+        attempt = 0
+        while True:
+            self._count_call(self.bucket.acquire())
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+    
+    async def call_async(self, func: Callable, *args, **kwargs) -> Any:
+        """call() for coroutine functions: awaits ``func(*args, **kwargs)`` and backs off with asyncio.sleep"""
+        attempt = 0
+        while True:
+            self._count_call(await self.bucket.acquire_async())
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                attempt += 1
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+    
+    def _count_call(self, waited: float):
+        self._add('calls', 1)
+        if waited:
+            self._add('throttled_seconds', waited)
+    
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retry ``attempt``, or None when ``error`` should be raised"""
+        if not is_retryable(error):
+            return None
+        if status_code(error) == 429 or retry_after(error) is not None:
+            self._add('rate_limited', 1)
+        for limiter, listener in _context_listeners.get():
+            if limiter is self:
+                listener(error)
+        
+        if attempt > self.max_retries:
+            self._add('failures', 1)
+            return None
+        
+        delay = self.backoff_delay(attempt, error)
+        logger.warning(f"{self.name}: transient error ({str(error)}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+        self._add('retries', 1)
+        self._add('backoff_seconds', delay)
+        return delay
+    
+    @contextmanager
+    def listening(self, listener: Callable[[Exception], None]):
+        """Call ``listener(error)`` on transient errors of calls made in this context, inside the block
+        
+        The limiter is shared by every job in the process, but a listener
+        only hears the calls of the code that registered it: the same
+        thread, tasks it creates, and work it hands to other threads through
+        contextvars.copy_context().run. Leaving the block always removes it.
+        """
+        token = _context_listeners.set(_context_listeners.get() + ((self, listener),))
+        try:
+            yield
+        finally:
+            _context_listeners.reset(token)
+    
+    def _add(self, key: str, value):
+        with self._stats_lock:
+            self._stats[key] += value
+    
+    def stats(self) -> Dict[str, Any]:
+        """Counters since startup, including the configured limits"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['throttled_seconds'] = round(stats['throttled_seconds'], 3)
+        stats['backoff_seconds'] = round(stats['backoff_seconds'], 3)
+        stats['rate'] = self.bucket.rate
+        stats['burst'] = self.bucket.burst
+        return stats
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str) -> RateLimiter:
+    """Process-wide limiter for a service, configured from env on first use
+    
+    RATE_LIMIT_<NAME>_PER_SECOND and RATE_LIMIT_<NAME>_BURST set the bucket;
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY and RETRY_MAX_DELAY the backoff.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            default_rate, default_burst = DEFAULT_LIMITS.get(name, (0, 0))
+            prefix = f"RATE_LIMIT_{name.upper()}"
+            limiter = RateLimiter(
+                name,
+                rate=float(os.environ.get(f"{prefix}_PER_SECOND", str(default_rate))),
+                burst=int(os.environ.get(f"{prefix}_BURST", str(default_burst or 1))),
+                max_retries=int(os.environ.get('RETRY_MAX_ATTEMPTS', '5')),
+                base_delay=float(os.environ.get('RETRY_BASE_DELAY', '1.0')),
+                max_delay=float(os.environ.get('RETRY_MAX_DELAY', '60'))
+            )
+            _limiters[name] = limiter
+        return limiter
+
+
+def limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """Stats of every limiter created so far"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+def stats_delta(before: Dict[str, Dict[str, Any]], after: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Per-service counters accumulated between two limiter_stats() snapshots"""
+    delta = {}
+    for name, stats in after.items():
+        previous = before.get(name, {})
+        delta[name] = {
+            key: round(value - previous.get(key, 0), 3) if isinstance(value, float) else value - previous.get(key, 0)
+            for key, value in stats.items() if key not in ('rate', 'burst')
+        }
+    return delta
+
+
+def _collect_metrics():
+    """Limiter counters as Prometheus samples"""
+    samples = []
+    for name, stats in limiter_stats().items():
+        labels = {'service': name}
+        samples.extend([
+            ('outreach_rate_limit_calls_total', 'counter', 'Calls made through a service rate limiter', labels, stats['calls']),
+            ('outreach_rate_limit_retries_total', 'counter', 'Retries after transient errors', labels, stats['retries']),
+            ('outreach_rate_limited_total', 'counter', 'Responses that were 429 or carried Retry-After', labels, stats['rate_limited']),
+            ('outreach_rate_limit_throttled_seconds_total', 'counter', 'Seconds spent waiting for a rate limit token', labels, stats['throttled_seconds']),
+            ('outreach_rate_limit_backoff_seconds_total', 'counter', 'Seconds spent backing off between retries', labels, stats['backoff_seconds']),
+        ])
+    return samples
+
+
+REGISTRY.add_collector(_collect_metrics)
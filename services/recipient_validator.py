@@ -0,0 +1,251 @@
+import os
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+from services.metrics import RECIPIENT_CHECKS, track
+
+logger = logging.getLogger(__name__)
+
+# Why a recipient is rejected, by the reason code validate_many() returns
+INVALID_REASONS = {
+    'syntax': 'Invalid email',
+    'disposable': 'Disposable email domain',
+    'no_mail_server': 'No mail server for domain'
+}
+
+# Throwaway-inbox providers; RECIPIENT_DISPOSABLE_DOMAINS_FILE adds more
+DISPOSABLE_DOMAINS = frozenset("""
+10minutemail.com 20minutemail.com 33mail.com anonaddy.me burnermail.io discard.email
+dispostable.com dropmail.me emailondeck.com fakeinbox.com fakemail.net getairmail.com
+getnada.com guerrillamail.biz guerrillamail.com guerrillamail.de guerrillamail.net
+guerrillamail.org guerrillamailblock.com harakirimail.com inboxkitten.com incognitomail.org
+mailcatch.com maildrop.cc mailinator.com mailinator.net mailnesia.com mailpoof.com
+mintemail.com moakt.com mohmal.com mytemp.email sharklasers.com spam4.me spamgourmet.com
+temp-mail.io temp-mail.org tempail.com tempmail.dev tempmail.net tempmailo.com
+tempr.email throwawaymail.com trashmail.com trashmail.de yopmail.com yopmail.fr
+""".split())
+
+# RFC 5321 limits on the whole address and on its local part
+MAX_ADDRESS_LENGTH = 254
+MAX_LOCAL_LENGTH = 64
+
+# Unquoted local part (dot-atom); quoted local parts are legal but never seen in lead lists
+_LOCAL_RE = re.compile(r"^[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*$")
+_LABEL_RE = re.compile(r'^[a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?$')
+
+
+def split_address(email: str) -> Optional[tuple]:
+    """(local part, ASCII lowercase domain) of a syntactically valid address, else None"""
+    email = (email or '').strip()
+    if len(email) > MAX_ADDRESS_LENGTH or email.count('@') != 1:
+        return None
+    local, domain = email.split('@')
+    if not local or len(local) > MAX_LOCAL_LENGTH or not _LOCAL_RE.match(local):
+        return None
+    
+    try:
+        # Internationalized domains are looked up in their punycode form
+        domain = domain.rstrip('.').encode('idna').decode('ascii').lower()
+    except UnicodeError:
+        return None
+    labels = domain.split('.')
+    if len(labels) < 2 or not all(_LABEL_RE.match(label) for label in labels) or labels[-1].isdigit():
+        return None
+    return local, domain
+
+
+def load_disposable_domains(path: str = None) -> frozenset:
+    """Built-in disposable domains plus those listed one per line in ``path`` (# starts a comment)"""
+    path = path or os.environ.get('RECIPIENT_DISPOSABLE_DOMAINS_FILE')
+    if not path:
+        return DISPOSABLE_DOMAINS
+    extra = set()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            domain = line.split('#', 1)[0].strip().lower()
+            if domain:
+                extra.add(domain)
+    return DISPOSABLE_DOMAINS | extra
+
+
+class DNSResolver:
+    """Mail hosts of a domain from its MX records (requires dnspython)"""
+    
+    def __init__(self, timeout: float = None):
+        try:
+            import dns.resolver
+        except ImportError:
+            raise Exception("MX checks require dnspython (pip install dnspython)")
+        
+        self._errors = dns.resolver
+        self._resolver = dns.resolver.Resolver()
+        # Total seconds per lookup, across the configured nameservers and retries
+        self._resolver.lifetime = timeout or float(os.environ.get('RECIPIENT_DNS_TIMEOUT', '3'))
+    
+    def mail_hosts(self, domain: str) -> List[str]:
+        """Hosts that accept mail for ``domain``; empty when it has none
+        
+        A domain without MX records falls back to its own A or AAAA record
+        (RFC 5321), and a null MX (RFC 7505) means it accepts no mail.
+        Timeouts and server failures raise, since they say nothing about
+        the domain.
+        """
+        try:
+            answer = self._resolver.resolve(domain, 'MX')
+        except self._errors.NXDOMAIN:
+            return []
+        except self._errors.NoAnswer:
+            for record_type in ('A', 'AAAA'):
+                try:
+                    self._resolver.resolve(domain, record_type)
+                    return [domain]
+                except (self._errors.NXDOMAIN, self._errors.NoAnswer):
+                    continue
+            return []
+        hosts = [str(record.exchange).rstrip('.') for record in answer]
+        return [host for host in hosts if host]
+
+
+class RecipientValidator:
+    """Screens recipient addresses before any generation is paid for
+    
+    Every address gets the syntax and disposable-domain checks. With a
+    resolver, the domains of a batch are also checked for a mail server,
+    up to ``dns_concurrency`` lookups at once. Results are cached per
+    domain for ``cache_ttl`` seconds, and a domain already being looked up
+    by another thread is waited on rather than looked up again, so leads
+    sharing a domain cost one lookup. A lookup that fails (timeout, server
+    failure) counts the domain as deliverable and is retried after
+    ``error_ttl`` seconds; the send itself is the final check.
+    """
+    
+    def __init__(self, resolver=None, disposable_domains: Iterable[str] = None, cache_ttl: float = None,
+                 error_ttl: float = None, cache_size: int = None, dns_concurrency: int = None):
+        # Any object with mail_hosts(domain) -> list of hosts, e.g. DNSResolver or a local stub
+        self.resolver = resolver
+        self.disposable_domains = frozenset(disposable_domains) if disposable_domains is not None else load_disposable_domains()
+        self.cache_ttl = cache_ttl or float(os.environ.get('RECIPIENT_MX_CACHE_TTL', '3600'))
+        self.error_ttl = error_ttl or float(os.environ.get('RECIPIENT_MX_ERROR_TTL', '60'))
+        self.cache_size = cache_size or int(os.environ.get('RECIPIENT_MX_CACHE_SIZE', '10000'))
+        self.dns_concurrency = dns_concurrency or int(os.environ.get('RECIPIENT_DNS_CONCURRENCY', '16'))
+        
+        # domain -> (accepts mail, monotonic expiry), least recently used first
+        self._cache = OrderedDict()
+        # domain -> Future of a lookup in progress
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._pool = None
+    
+    def validate_many(self, emails: Iterable[str], counts: Dict[str, int] = None) -> Dict[str, Optional[str]]:
+        """Reason code (see INVALID_REASONS) of each address, None for those that pass
+        
+        ``counts``, when given, is increased by the number of distinct
+        domains checked, DNS lookups made, cache hits and failed lookups.
+        """
+        reasons = {}
+        by_domain = {}
+        for email in emails:
+            if email in reasons:
+                continue
+            parts = split_address(email)
+            if parts is None:
+                reasons[email] = 'syntax'
+            elif self._is_disposable(parts[1]):
+                reasons[email] = 'disposable'
+            else:
+                reasons[email] = None
+                by_domain.setdefault(parts[1], []).append(email)
+        
+        if self.resolver and by_domain:
+            for domain, accepts_mail in self._accepts_mail(by_domain, counts).items():
+                if not accepts_mail:
+                    for email in by_domain[domain]:
+                        reasons[email] = 'no_mail_server'
+        
+        for reason in reasons.values():
+            RECIPIENT_CHECKS.inc(result=reason or 'valid')
+        return reasons
+    
+    def validate(self, email: str) -> Optional[str]:
+        """validate_many for a single address"""
+        return self.validate_many([email])[email]
+    
+    def _is_disposable(self, domain: str) -> bool:
+        """Whether a domain, or a domain it is under, is a disposable-inbox provider"""
+        labels = domain.split('.')
+        return any('.'.join(labels[i:]) in self.disposable_domains for i in range(len(labels) - 1))
+    
+    def _accepts_mail(self, domains: Iterable[str], counts: Dict[str, int] = None) -> Dict[str, bool]:
+        """Whether each domain has a mail server, from the cache or from concurrent lookups"""
+        counts = counts if counts is not None else {}
+        results = {}
+        futures = {}
+        now = time.monotonic()
+        with self._lock:
+            for domain in domains:
+                cached = self._cache.get(domain)
+                if cached and cached[1] > now:
+                    self._cache.move_to_end(domain)
+                    results[domain] = cached[0]
+                    counts['cache_hits'] = counts.get('cache_hits', 0) + 1
+                    continue
+                future = self._inflight.get(domain)
+                own = future is None
+                if own:
+                    if self._pool is None:
+                        self._pool = ThreadPoolExecutor(max_workers=self.dns_concurrency, thread_name_prefix='mx-lookup')
+                    future = self._inflight[domain] = self._pool.submit(self._lookup, domain)
+                    counts['lookups'] = counts.get('lookups', 0) + 1
+                futures[domain] = (future, own)
+        counts['domains'] = counts.get('domains', 0) + len(results) + len(futures)
+        
+        for domain, (future, own) in futures.items():
+            accepts_mail, failed = future.result()
+            if failed and own:
+                counts['lookup_errors'] = counts.get('lookup_errors', 0) + 1
+            results[domain] = accepts_mail
+        return results
+    
+    def _lookup(self, domain: str):
+        """Resolve one domain and cache the answer; returns (accepts mail, whether the lookup failed)"""
+        failed = False
+        try:
+            with track('dns', 'mx'):
+                accepts_mail = bool(self.resolver.mail_hosts(domain))
+        except Exception as e:
+            logger.warning(f"MX lookup for {domain} failed, treating it as deliverable: {str(e)}")
+            accepts_mail = True
+            failed = True
+        
+        with self._lock:
+            self._cache[domain] = (accepts_mail, time.monotonic() + (self.error_ttl if failed else self.cache_ttl))
+            self._cache.move_to_end(domain)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            self._inflight.pop(domain, None)
+        return accepts_mail, failed
+    
+    def stats(self) -> Dict[str, int]:
+        """Domains currently cached and lookups in progress"""
+        with self._lock:
+            return {'cached_domains': len(self._cache), 'inflight_lookups': len(self._inflight)}
+    
+    def close(self):
+        """Stop the lookup threads"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            pool.shutdown(wait=False)
+
+
+def create_recipient_validator() -> RecipientValidator:
+    """Validator configured from the environment; MX checks only with RECIPIENT_MX_CHECK=true"""
+    resolver = None
+    if os.environ.get('RECIPIENT_MX_CHECK', 'false').lower() == 'true':
+        resolver = DNSResolver()
+    return RecipientValidator(resolver=resolver)
@@ -0,0 +1,108 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+# Largest page served by read_result_log
+MAX_PAGE_SIZE = 1000
+# Bytes of log a read_result_log page reads at most, matching or not
+MAX_SCAN_BYTES = 4 * 1024 * 1024
+
+
+def result_log_dir() -> str:
+    """Directory holding one result log per run (OUTREACH_RESULT_LOG_DIR)"""
+    return os.environ.get('OUTREACH_RESULT_LOG_DIR', 'result_logs')
+
+
+def result_log_path(log_id: str, directory: str = None) -> str:
+    """Path of a run's result log"""
+    return os.path.join(directory or result_log_dir(), f"{log_id}.jsonl")
+
+
+def at_line_boundary(path: str) -> bool:
+    """Whether a new line can be appended to a file as is
+    
+    True when the file is missing, empty, or its last byte is a newline;
+    False when it ends in a line torn by an interrupted write.
+    """
+    if not os.path.exists(path):
+        return True
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+class ResultLog:
+    """Append-only JSON Lines log of every row outcome and error of one run
+    
+    The run keeps only counters and the most recent entries in memory; this
+    file holds all of them, written as they happen. Reopening the log of a
+    resumed run appends to it.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        torn = not at_line_boundary(path)
+        self._file = open(path, 'a', encoding='utf-8')
+        if torn:
+            # Keep new entries off the torn line an interrupted run left behind
+            self._file.write('\n')
+    
+    def append(self, entry: Dict[str, Any]):
+        """Write one entry, stamped with the time it was logged"""
+        line = json.dumps(dict(entry, at=datetime.now().isoformat()), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + '\n')
+            # Flushed per entry so the log can be paged while the run goes on
+            self._file.flush()
+    
+    def close(self):
+        """Close the log file"""
+        with self._lock:
+            self._file.close()
+
+
+def read_result_log(path: str, cursor: int = 0, limit: int = 100, status: str = None,
+                    max_scan_bytes: int = MAX_SCAN_BYTES) -> Dict[str, Any]:
+    """One page of a result log, starting at byte offset ``cursor``
+    
+    Returns the entries (only those with the given ``status`` when set), the
+    cursor of the next page and whether the end of the log was reached. A
+    live run's log can be followed by polling from the last cursor. A page
+    stops after ``max_scan_bytes`` of log even when a ``status`` filter has
+    matched fewer than ``limit`` entries, so a rare status costs several
+    short pages rather than one read of the whole file; such a page may be
+    empty and is continued from its ``next_cursor`` while ``end`` is false.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    stop = cursor + max_scan_bytes
+    entries = []
+    end = False
+    with open(path, 'rb') as f:
+        f.seek(cursor)
+        while len(entries) < limit and cursor < stop:
+            line = f.readline()
+            if not line.endswith(b'\n'):
+                # End of the log, or a line the run is still writing
+                end = True
+                break
+            cursor += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping unreadable entry ending at byte {cursor} of {path}")
+                continue
+            if not status or entry.get('status') == status:
+                entries.append(entry)
+    return {'entries': entries, 'next_cursor': cursor, 'end': end}
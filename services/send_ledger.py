@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# SQLite caps the number of bound parameters per statement
+LOOKUP_BATCH_SIZE = 400
+
+# Statuses that count a recipient as contacted: 'uncertain' is a send whose
+# connection dropped after DATA, which the server may have delivered
+CONTACTED_STATUSES = ('sent', 'uncertain')
+_CONTACTED_SQL = 'status IN ({})'.format(', '.join(f"'{status}'" for status in CONTACTED_STATUSES))
+
+
+class SendLedger:
+    """Local SQLite record of every send attempt, used to skip rows already contacted
+    
+    Besides the bulk lookup done before generation, each send first takes a
+    reservation on its recipient and row (reserve()), so two runs or
+    workers sharing the file never send to the same address at once. The
+    reservation is released when the attempt is recorded; one left behind
+    by a crashed process expires after ``reservation_ttl`` seconds.
+    """
+    
+    def __init__(self, path: str = None, reservation_ttl: float = None):
+        self.path = path or os.environ.get('SEND_LEDGER_PATH', 'send_ledger.db')
+        self.reservation_ttl = reservation_ttl or float(os.environ.get('SEND_LEDGER_RESERVATION_TTL', '900'))
+        self._lock = threading.Lock()
+        # Other processes hold the write lock only for one short transaction
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS sends (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    email TEXT NOT NULL,
+                    row_hash TEXT NOT NULL,
+                    row_index INTEGER,
+                    status TEXT NOT NULL,
+                    subject TEXT,
+                    sent_at TEXT NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_sends_email ON sends (email, status)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_sends_row_hash ON sends (row_hash, status)')
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS reservations (
+                    email TEXT PRIMARY KEY,
+                    row_hash TEXT NOT NULL,
+                    row_index INTEGER,
+                    reserved_at REAL NOT NULL
+                )
+            ''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_reservations_row_hash ON reservations (row_hash)')
+    
+    @staticmethod
+    def normalize_email(email: str) -> str:
+        """Canonical form of an address for ledger lookups"""
+        return (email or '').strip().lower()
+    
+    @staticmethod
+    def row_hash(company_data: Dict) -> str:
+        """Stable hash of a row's content, independent of column order"""
+        payload = json.dumps(company_data, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def contacted(self, entries: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """Return the (email, row_hash) pairs that already have a successful or uncertain send
+        
+        A pair counts as contacted when either the recipient address or the
+        exact row content has a send in CONTACTED_STATUSES. Lookups are
+        batched so a whole row range costs a handful of queries.
+        """
+        entries = [(self.normalize_email(email), row_hash) for email, row_hash in entries]
+        emails = list({email for email, _ in entries})
+        hashes = list({row_hash for _, row_hash in entries})
+        
+        sent_emails = self._select_sent('email', emails)
+        sent_hashes = self._select_sent('row_hash', hashes)
+        
+        return {
+            (email, row_hash) for email, row_hash in entries
+            if email in sent_emails or row_hash in sent_hashes
+        }
+    
+    def _select_sent(self, column: str, values: list) -> Set[str]:
+        """Values of ``column`` that appear on at least one entry in CONTACTED_STATUSES"""
+        found = set()
+        for i in range(0, len(values), LOOKUP_BATCH_SIZE):
+            batch = values[i:i + LOOKUP_BATCH_SIZE]
+            placeholders = ','.join('?' * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT DISTINCT {column} FROM sends WHERE {_CONTACTED_SQL} AND {column} IN ({placeholders})",
+                    batch
+                ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+    
+    def reserve(self, email: str, row_hash: str, row_index: int = None) -> bool:
+        """Claim the right to send to a recipient now; False if it was sent to or is being sent to
+        
+        Like contacted(), the recipient counts as taken when either its
+        address or the row content has a successful or uncertain send. The check and the
+        claim run in one immediate transaction, so of two callers racing for
+        the same address only one gets True.
+        """
+        email = self.normalize_email(email)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('BEGIN IMMEDIATE')
+            if self._conn.execute(
+                f"SELECT 1 FROM sends WHERE {_CONTACTED_SQL} AND (email = ? OR row_hash = ?) LIMIT 1", (email, row_hash)
+            ).fetchone():
+                return False
+            self._conn.execute(
+                'DELETE FROM reservations WHERE (email = ? OR row_hash = ?) AND reserved_at < ?',
+                (email, row_hash, now - self.reservation_ttl)
+            )
+            if self._conn.execute(
+                'SELECT 1 FROM reservations WHERE email = ? OR row_hash = ? LIMIT 1', (email, row_hash)
+            ).fetchone():
+                return False
+            self._conn.execute(
+                'INSERT INTO reservations (email, row_hash, row_index, reserved_at) VALUES (?, ?, ?, ?)',
+                (email, row_hash, row_index, now)
+            )
+        return True
+    
+    def record(self, email: str, row_hash: str, row_index: int, status: str, subject: str = None):
+        """Record the outcome of a send attempt, releasing its reservation"""
+        email = self.normalize_email(email)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO sends (email, row_hash, row_index, status, subject, sent_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (email, row_hash, row_index, status, subject, datetime.now().isoformat())
+            )
+            self._conn.execute('DELETE FROM reservations WHERE email = ? AND row_hash = ?', (email, row_hash))
+    
+    def close(self):
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
@@ -24,7 +24,7 @@ setup(
     author="AI Kaptan",
     author_email="support@aikaptan.com",
     url="https://github.com/aikaptan/outreach-agent",
-    packages=find_packages(exclude=["tests", "*.tests", "*.tests.*", "tests.*"]),
+    packages=find_packages(exclude=["tests", "*.tests", "*.tests.*", "tests.*", "fakes", "fakes.*", "benchmarks", "benchmarks.*"]),
     install_requires=requirements,
     python_requires=">=3.8",
     classifiers=[
@@ -0,0 +1,102 @@
+"""AdaptiveLimiter AIMD behaviour, and RateLimiter listeners feeding it"""
+import asyncio
+import threading
+import time
+
+from services.adaptive_limiter import AdaptiveLimiter
+from services.rate_limiter import RateLimiter
+
+
+def test_grows_only_while_saturated():
+    limiter = AdaptiveLimiter('test', initial=1, maximum=4)
+    for _ in range(20):
+        with limiter:
+            pass
+    # One caller at a time fills a limit of 1, never one of 2
+    assert limiter.limit == 2
+    
+    def worker():
+        for _ in range(20):
+            with limiter:
+                time.sleep(0.001)
+    
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert limiter.limit == 4
+    assert limiter.stats()['increases'] == 3
+
+
+def test_backoff_halves_once_per_burst():
+    limiter = AdaptiveLimiter('test', initial=8, minimum=3)
+    limiter.backoff()
+    assert limiter.limit == 4
+    # A second signal right after the first is part of the same burst
+    limiter.backoff()
+    assert limiter.limit == 4
+    
+    limiter._last_decrease = 0.0
+    limiter.backoff()
+    assert limiter.limit == 3
+
+
+def test_slow_calls_shrink_the_limit():
+    limiter = AdaptiveLimiter('test', initial=4)
+    for _ in range(3):
+        with limiter:
+            pass
+    with limiter:
+        time.sleep(0.5)
+    
+    assert limiter.limit == 2
+    assert limiter.stats()['decreases'] == 1
+
+
+def test_coroutines_never_exceed_the_limit():
+    limiter = AdaptiveLimiter('test', initial=3)
+    in_flight = []
+    peak = []
+    
+    async def call():
+        async with limiter:
+            in_flight.append(1)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.pop()
+    
+    async def run():
+        await asyncio.gather(*[call() for _ in range(20)])
+    
+    asyncio.run(run())
+    assert len(peak) == 20
+    assert max(peak) == 3
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_listener_hears_only_its_own_calls():
+    limiter = RateLimiter('test', max_retries=1, base_delay=0)
+    heard = []
+    
+    def flaky():
+        errors = [TimeoutError('timed out')]
+        
+        def func():
+            if errors:
+                raise errors.pop()
+            return 'ok'
+        return func
+    
+    def other_job():
+        limiter.call(flaky())
+    
+    with limiter.listening(heard.append):
+        limiter.call(flaky())
+        thread = threading.Thread(target=other_job)
+        thread.start()
+        thread.join()
+    limiter.call(flaky())
+    
+    assert len(heard) == 1
+    assert isinstance(heard[0], TimeoutError)
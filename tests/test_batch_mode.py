@@ -0,0 +1,82 @@
+"""'batch' mode end to end against the local fake OpenAI endpoint"""
+import threading
+from contextlib import nullcontext
+
+import pytest
+
+from fakes.openai_server import FakeOpenAIServer
+from services.ai_service import AIService
+from services.outreach_agent import OutreachAgent
+
+ROWS = {
+    row_index: {'company_name': f'Company {row_index}', 'email_to_use': f'owner{row_index}@company{row_index}.example'}
+    for row_index in range(2, 8)
+}
+
+
+class Leads:
+    """Lead source serving ROWS"""
+    
+    def get_rows(self, start_row, end_row, **kwargs):
+        for row_index in range(start_row, end_row + 1):
+            yield row_index, dict(ROWS[row_index])
+
+
+class KnowledgeBase:
+    def get_document(self):
+        return 'We build AI automations for small businesses.'
+
+
+class RecordingEmail:
+    """Keeps each email instead of sending it"""
+    
+    def __init__(self):
+        self.sent = {}
+        self._lock = threading.Lock()
+    
+    def session(self, pool_size=None):
+        return nullcontext(self)
+    
+    def send_email(self, to_email, subject, html_body):
+        with self._lock:
+            self.sent[to_email] = subject
+
+
+@pytest.fixture
+def openai_server(tmp_path, monkeypatch):
+    server = FakeOpenAIServer()
+    monkeypatch.setenv('OPENAI_BASE_URL', server.start())
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.setenv('OPENAI_BATCH_POLL_INTERVAL', '0.01')
+    monkeypatch.setenv('OUTREACH_BATCH_DIR', str(tmp_path / 'batches'))
+    monkeypatch.setenv('OUTREACH_RESULT_LOG_DIR', str(tmp_path / 'results'))
+    yield server
+    server.stop()
+
+
+def test_generates_every_row_in_one_batch(openai_server):
+    email = RecordingEmail()
+    agent = OutreachAgent(Leads(), KnowledgeBase(), AIService(), email)
+    
+    results = agent.execute(2, 7, mode='batch')
+    
+    assert results['sent'] == 6
+    assert results['batch_id'] in openai_server.batches
+    assert len(openai_server.batches) == 1
+    assert email.sent == {row['email_to_use']: f"Quick idea for {row['company_name']}" for row in ROWS.values()}
+
+
+def test_cancelled_run_sends_nothing(openai_server):
+    openai_server.batch_delay = 60
+    email = RecordingEmail()
+    agent = OutreachAgent(Leads(), KnowledgeBase(), AIService(), email)
+    cancel_event = threading.Event()
+    timer = threading.Timer(0.2, cancel_event.set)
+    timer.start()
+    
+    results = agent.execute(2, 7, mode='batch', cancel_event=cancel_event)
+    timer.join()
+    
+    assert email.sent == {}
+    assert results['sent'] == 0
+    assert openai_server.batches[results['batch_id']]['status'] == 'cancelled'
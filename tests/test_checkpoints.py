@@ -0,0 +1,108 @@
+"""CheckpointStore, and resuming an interrupted run without sending a row twice"""
+import json
+import re
+import threading
+from contextlib import nullcontext
+
+import pytest
+
+from services.checkpoint_store import RUN_CANCELLED, RUN_COMPLETED, RUN_RUNNING, CheckpointStore
+from services.outreach_agent import OutreachAgent
+from services.send_ledger import SendLedger
+
+
+@pytest.fixture
+def checkpoints(tmp_path):
+    store = CheckpointStore(str(tmp_path / 'checkpoints.db'))
+    yield store
+    store.close()
+
+
+def test_run_progress(checkpoints):
+    checkpoints.create_run('run-1', 2, 10, 'concurrent')
+    checkpoints.create_run('run-1', 5, 50, 'batch')
+    run = checkpoints.get_run('run-1')
+    assert (run['start_row'], run['end_row'], run['mode']) == (2, 10, 'concurrent')
+    assert run['status'] == RUN_RUNNING
+    assert run['last_completed_row'] is None
+    
+    for row in (2, 3, 4):
+        checkpoints.record_row('run-1', {'row': row, 'status': 'sent', 'to': f'lead{row}@acme.com'})
+    checkpoints.record_row('run-1', {'row': 4, 'status': 'error', 'error': 'timeout'})
+    checkpoints.set_status('run-1', RUN_CANCELLED)
+    
+    run = checkpoints.get_run('run-1')
+    assert run['last_completed_row'] == 4
+    assert run['status'] == RUN_CANCELLED
+    assert [outcome['status'] for outcome in checkpoints.row_outcomes('run-1')] == ['sent', 'sent', 'error']
+    assert checkpoints.get_run('missing') is None
+
+
+def test_list_runs_newest_first(checkpoints):
+    checkpoints.create_run('old', 2, 3)
+    checkpoints.create_run('new', 2, 3)
+    checkpoints.record_row('old', {'row': 2, 'status': 'sent'})
+    assert [run['run_id'] for run in checkpoints.list_runs()] == ['old', 'new']
+    assert len(checkpoints.list_runs(limit=1)) == 1
+
+
+class Leads:
+    """Lead source whose every row has its own recipient"""
+    
+    def get_rows(self, start_row, end_row, **kwargs):
+        for row_index in range(start_row, end_row + 1):
+            yield row_index, {'CompanyName': f'Company {row_index}', 'email_to_use': f'owner{row_index}@acme.com'}
+
+
+class KnowledgeBase:
+    def get_document(self):
+        return 'We build AI automations for small businesses.'
+
+
+class EchoAI:
+    """Writes each email to the row's own address, without any API"""
+    
+    model = 'echo'
+    
+    def generate_email(self, prompt, **kwargs):
+        to = re.search(r'"email_to_use": "([^"]+)"', prompt).group(1)
+        return json.dumps({'to': to, 'subject': 'Hello', 'emailBody': '<p>Hi</p>'})
+
+
+class RecordingEmail:
+    """Counts the sends per recipient and cancels the run after ``cancel_after`` of them"""
+    
+    def __init__(self, cancel_event=None, cancel_after=None):
+        self.sent = []
+        self.cancel_event = cancel_event
+        self.cancel_after = cancel_after
+        self._lock = threading.Lock()
+    
+    def session(self, pool_size=None):
+        return nullcontext(self)
+    
+    def send_email(self, to_email, subject, html_body):
+        with self._lock:
+            self.sent.append(to_email)
+            if self.cancel_event and len(self.sent) == self.cancel_after:
+                self.cancel_event.set()
+
+
+def test_resume_sends_each_row_once(tmp_path, checkpoints, monkeypatch):
+    monkeypatch.setenv('OUTREACH_RESULT_LOG_ENABLED', 'false')
+    ledger = SendLedger(str(tmp_path / 'send_ledger.db'))
+    cancel_event = threading.Event()
+    email = RecordingEmail(cancel_event, cancel_after=15)
+    agent = OutreachAgent(Leads(), KnowledgeBase(), EchoAI(), email,
+                          ledger=ledger, checkpoints=checkpoints)
+    
+    first = agent.execute(2, 41, mode='sequential', cancel_event=cancel_event, run_id='run-1')
+    assert first['processed'] < 40
+    assert checkpoints.get_run('run-1')['status'] != RUN_COMPLETED
+    
+    results = agent.resume('run-1')
+    ledger.close()
+    
+    assert checkpoints.get_run('run-1')['status'] == RUN_COMPLETED
+    assert results['processed'] == 40
+    assert len(email.sent) == len(set(email.sent)) == 40
@@ -0,0 +1,65 @@
+"""EmailStreamParser fed the way a model streams its answer"""
+import json
+
+import pytest
+
+from services.email_stream import EmailStreamParser
+
+EMAIL = {'to': 'jane@acme.com', 'subject': 'Quick idea', 'emailBody': '<p>Hi Jane,\n"quoted" \\ é \U0001f600</p>'}
+
+
+def feed_in_pieces(parser, text, size):
+    for i in range(0, len(text), size):
+        parser.feed(text[i:i + size])
+
+
+@pytest.mark.parametrize('size', [1, 3, 1000])
+def test_parses_any_split(size):
+    parser = EmailStreamParser(expected_to='Jane@Acme.com')
+    feed_in_pieces(parser, json.dumps(EMAIL), size)
+    
+    assert parser.complete
+    assert parser.email() == EMAIL
+
+
+def test_accepts_code_fence():
+    parser = EmailStreamParser()
+    parser.feed('```json\n' + json.dumps(EMAIL, indent=2) + '\n```')
+    assert parser.email() == EMAIL
+
+
+@pytest.mark.parametrize('text, message', [
+    ('Sure! Here is the email: {', 'does not start with a JSON object'),
+    ('{"to": "jane@acme.com", "cc": "x"}', "unexpected field 'cc'"),
+    ('{"to": "jane@acme.com", "to": "jane@acme.com"}', "repeats field 'to'"),
+    ('{"to": 1}', 'is not a string'),
+    ('{"to": "jane@acme.com", "subject": "Hi"}', 'missing emailBody'),
+    ('{"to": "jane@acme.com", "subject": "Hi", "emailBody": "x"} and more', 'continues after'),
+])
+def test_rejects_malformed_output(text, message):
+    parser = EmailStreamParser()
+    with pytest.raises(Exception, match=message):
+        parser.feed(text)
+
+
+def test_rejects_other_recipient_as_soon_as_it_is_read():
+    parser = EmailStreamParser(expected_to='jane@acme.com')
+    with pytest.raises(Exception, match='not the row'):
+        parser.feed('{"to": "someone@else.com"')
+    # Nothing after the recipient had to arrive
+    assert 'subject' not in parser.fields
+
+
+def test_stops_long_body_before_it_ends():
+    parser = EmailStreamParser(max_body_chars=10)
+    parser.feed('{"to": "jane@acme.com", "subject": "Hi", "emailBody": "0123456789')
+    with pytest.raises(Exception, match='longer than 10'):
+        parser.feed('a')
+
+
+def test_incomplete_stream():
+    parser = EmailStreamParser()
+    parser.feed('{"to": "jane@acme.com", "subject": "Hi"')
+    assert not parser.complete
+    with pytest.raises(Exception, match='ended before'):
+        parser.email()
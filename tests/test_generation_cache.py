@@ -0,0 +1,59 @@
+"""GenerationCache keys and least-recently-used eviction"""
+import pytest
+
+from services.generation_cache import GenerationCache
+
+
+def email(to):
+    return {'to': to, 'subject': 'Hello', 'emailBody': '<p>Hi</p>'}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = GenerationCache(str(tmp_path / 'generation_cache.db'), max_entries=3)
+    yield cache
+    cache.close()
+
+
+def test_key_ignores_column_order_but_not_inputs():
+    key = GenerationCache.make_key({'a': '1', 'b': '2'}, 'kb', 'instructions', 'row', 'gpt-4o-mini')
+    assert key == GenerationCache.make_key({'b': '2', 'a': '1'}, 'kb', 'instructions', 'row', 'gpt-4o-mini')
+    assert key != GenerationCache.make_key({'a': '1', 'b': '3'}, 'kb', 'instructions', 'row', 'gpt-4o-mini')
+    assert key != GenerationCache.make_key({'a': '1', 'b': '2'}, 'kb v2', 'instructions', 'row', 'gpt-4o-mini')
+    assert key != GenerationCache.make_key({'a': '1', 'b': '2'}, 'kb', 'instructions', 'row', 'gpt-4o')
+    # Retrieval settings decide which knowledge base chunks a prompt gets
+    assert key != GenerationCache.make_key({'a': '1', 'b': '2'}, 'kb', 'instructions', 'row', 'gpt-4o-mini',
+                                           retrieval={'top_k': 6, 'token_budget': 1500, 'chunk_tokens': 250})
+
+
+def test_get_and_put(cache):
+    assert cache.get('k1') is None
+    cache.put('k1', dict(email('jane@acme.com'), extra='dropped'))
+    assert cache.get('k1') == email('jane@acme.com')
+    cache.put('k1', email('bob@acme.com'))
+    assert cache.get('k1') == email('bob@acme.com')
+
+
+def test_evicts_the_least_recently_used(cache):
+    for key in ('k1', 'k2', 'k3'):
+        cache.put(key, email(f'{key}@acme.com'))
+    # Reading k1 makes k2 the oldest entry
+    cache.get('k1')
+    cache.put('k4', email('k4@acme.com'))
+    
+    assert cache.get('k2') is None
+    assert all(cache.get(key) for key in ('k1', 'k3', 'k4'))
+
+
+def test_count_survives_reopening(tmp_path):
+    path = str(tmp_path / 'generation_cache.db')
+    cache = GenerationCache(path, max_entries=2)
+    cache.put('k1', email('a@acme.com'))
+    cache.put('k2', email('b@acme.com'))
+    cache.close()
+    
+    cache = GenerationCache(path, max_entries=2)
+    cache.put('k3', email('c@acme.com'))
+    assert cache.get('k1') is None
+    assert cache.get('k3')
+    cache.close()
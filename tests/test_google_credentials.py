@@ -0,0 +1,30 @@
+"""Loading and caching of the shared Google credentials"""
+import json
+
+import pytest
+
+from services import google_credentials
+
+TOKEN = {'client_id': 'id', 'client_secret': 'secret', 'refresh_token': 'refresh', 'token': 'access'}
+
+
+@pytest.fixture
+def token_file(tmp_path, monkeypatch):
+    path = tmp_path / 'token.json'
+    monkeypatch.delenv('GOOGLE_CREDENTIALS_JSON', raising=False)
+    monkeypatch.setenv('GOOGLE_TOKEN_FILE', str(path))
+    monkeypatch.setattr(google_credentials, '_credentials', None)
+    return path
+
+
+def test_missing_credentials_are_not_cached(token_file):
+    assert google_credentials.get_credentials() is None
+    
+    # A token file written later, e.g. by the OAuth flow, is picked up
+    token_file.write_text(json.dumps(TOKEN), encoding='utf-8')
+    creds = google_credentials.get_credentials()
+    assert creds.refresh_token == 'refresh'
+    
+    # Once loaded, the credentials are shared
+    token_file.unlink()
+    assert google_credentials.get_credentials() is creds
@@ -0,0 +1,109 @@
+"""Background job routes and their Server-Sent Events stream"""
+import json
+import threading
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+def submit(target):
+    return app_module.job_manager.submit(target, params={'startRow': 2, 'endRow': 4})
+
+
+def stream_events(response):
+    """JSON payloads of the data lines of an event stream"""
+    return [json.loads(line[len('data: '):]) for line in response.get_data(as_text=True).splitlines()
+            if line.startswith('data: ')]
+
+
+def test_job_runs_in_the_background(client):
+    started = threading.Event()
+    release = threading.Event()
+    
+    def target(job):
+        started.set()
+        release.wait(5)
+        return {'processed': 3}
+    
+    job = submit(target)
+    assert started.wait(5)
+    assert client.get(f'/api/jobs/{job.id}').get_json()['status'] == 'running'
+    
+    release.set()
+    job.future.result(timeout=5)
+    body = client.get(f'/api/jobs/{job.id}').get_json()
+    assert (body['status'], body['results'], body['params']) == ('completed', {'processed': 3}, {'startRow': 2, 'endRow': 4})
+    assert job.id in [listed['id'] for listed in client.get('/api/jobs').get_json()['jobs']]
+
+
+def test_cancel_running_job(client):
+    started = threading.Event()
+    
+    def target(job):
+        started.set()
+        job.cancel_event.wait(5)
+        return {'processed': 0}
+    
+    job = submit(target)
+    assert started.wait(5)
+    response = client.post(f'/api/jobs/{job.id}/cancel')
+    assert response.status_code == 200
+    job.future.result(timeout=5)
+    assert client.get(f'/api/jobs/{job.id}').get_json()['status'] == 'cancelled'
+
+
+def test_failed_job_reports_its_error(client):
+    def target(job):
+        raise Exception('Sheet not found')
+    
+    job = submit(target)
+    job.future.result(timeout=5)
+    body = client.get(f'/api/jobs/{job.id}').get_json()
+    assert (body['status'], body['error']) == ('failed', 'Sheet not found')
+
+
+@pytest.mark.parametrize('method, path', [
+    ('get', '/api/jobs/missing'),
+    ('post', '/api/jobs/missing/cancel'),
+    ('get', '/api/jobs/missing/events'),
+])
+def test_unknown_job(client, method, path):
+    assert getattr(client, method)(path).status_code == 404
+
+
+def test_event_stream_resumes_after_the_last_id(client):
+    def target(job):
+        for row in (2, 3, 4):
+            job.add_event({'type': 'sent', 'row': row})
+        return {'processed': 3}
+    
+    job = submit(target)
+    job.future.result(timeout=5)
+    
+    response = client.get(f'/api/jobs/{job.id}/events')
+    assert response.mimetype == 'text/event-stream'
+    events = stream_events(response)
+    assert [event['row'] for event in events[:3]] == [2, 3, 4]
+    assert (events[-1]['type'], events[-1]['status']) == ('done', 'completed')
+    
+    # A reconnect carries the id of the last event it saw
+    events = stream_events(client.get(f'/api/jobs/{job.id}/events', headers={'Last-Event-ID': str(events[1]['id'])}))
+    assert [event.get('row') for event in events] == [4, None]
+    events = stream_events(client.get(f'/api/jobs/{job.id}/events?after=3'))
+    assert [event['type'] for event in events] == ['done']
+
+
+@pytest.mark.parametrize('headers, query', [({'Last-Event-ID': 'abc'}, ''), ({}, '?after=1.5')])
+def test_event_stream_rejects_a_bad_last_id(client, headers, query):
+    job = submit(lambda job: {'processed': 0})
+    job.future.result(timeout=5)
+    
+    response = client.get(f'/api/jobs/{job.id}/events{query}', headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
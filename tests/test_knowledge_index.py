@@ -0,0 +1,67 @@
+"""Knowledge base chunking, BM25 chunk selection and the retrieval switch"""
+from services.knowledge_index import KnowledgeIndex, chunk_text, estimate_tokens, get_index
+from services.outreach_agent import OutreachAgent
+
+KNOWLEDGE_BASE = """Who we are
+
+We build AI automations for small and mid-sized businesses.
+
+Dental clinics
+
+Appointment reminders, recall campaigns and insurance pre-checks for dental practices.
+
+Logistics
+
+Shipment tracking updates, carrier invoice matching and route exception alerts.
+
+Accounting
+
+Invoice capture, bank reconciliation and month-end close checklists for accounting firms.
+"""
+
+
+def test_chunks_keep_headings_with_their_section():
+    chunks = chunk_text(KNOWLEDGE_BASE, chunk_tokens=20)
+    assert len(chunks) == 4
+    assert chunks[1].startswith('Dental clinics\n\nAppointment reminders')
+    assert all(chunk.strip() for chunk in chunks)
+
+
+def test_long_paragraph_is_a_chunk_of_its_own():
+    text = 'Short intro.\n\n' + 'word ' * 400 + '\n\nShort outro.'
+    chunks = chunk_text(text, chunk_tokens=50)
+    assert len(chunks) == 3
+    assert estimate_tokens(chunks[1]) > 50
+
+
+def test_selects_the_matching_section_first():
+    index = KnowledgeIndex(KNOWLEDGE_BASE, chunk_tokens=20)
+    assert index.select_ids('Logistics company, tracking shipments', token_budget=1000, top_k=1) == [2]
+    assert index.select('dental practice', token_budget=1000, top_k=1).startswith('Dental clinics')
+
+
+def test_selection_fits_the_budget_and_returns_document_order():
+    index = KnowledgeIndex(KNOWLEDGE_BASE, chunk_tokens=20)
+    budget = index.chunk_token_counts[3] + index.chunk_token_counts[0]
+    ids = index.select_ids('accounting firm', token_budget=budget, top_k=6)
+    
+    assert ids[0] == 3
+    assert sum(index.chunk_token_counts[chunk_id] for chunk_id in ids) <= budget
+    assert index.join(ids).startswith('Who we are')
+
+
+def test_unmatched_query_gets_the_opening_sections():
+    index = KnowledgeIndex(KNOWLEDGE_BASE, chunk_tokens=20)
+    assert index.select_ids('zzz', token_budget=1000, top_k=2) == [0, 1]
+
+
+def test_index_is_built_once_per_text():
+    assert get_index(KNOWLEDGE_BASE, 20) is get_index(KNOWLEDGE_BASE, 20)
+    assert get_index(KNOWLEDGE_BASE, 20) is not get_index(KNOWLEDGE_BASE + ' ', 20)
+
+
+def test_retrieval_is_opt_in(monkeypatch):
+    monkeypatch.delenv('OUTREACH_KB_RETRIEVAL', raising=False)
+    assert not OutreachAgent(None, None, None, None).knowledge_retrieval
+    monkeypatch.setenv('OUTREACH_KB_RETRIEVAL', 'true')
+    assert OutreachAgent(None, None, None, None).knowledge_retrieval
@@ -0,0 +1,133 @@
+"""CSV, SQLite and Parquet lead sources return the same rows the way a sheet numbers them"""
+import asyncio
+import csv
+import os
+import sqlite3
+
+import pytest
+
+from services.lead_sources import CSVLeadSource, ParquetLeadSource, SQLiteLeadSource
+
+HEADERS = ['company_name', 'email_to_use', 'notes']
+RECORDS = [
+    ['Acme', 'jane@acme.com', 'Line one\nline two'],
+    ['Globex', 'hank@globex.com', 'Says "hi", often'],
+    ['', '', ''],
+    ['Initech', 'bill@initech.com', ''],
+    ['Umbrella', 'alice@umbrella.com', 'Café'],
+]
+
+
+def expected(row_index):
+    """What every source should give for a 1-based sheet row"""
+    if row_index == 1:
+        return dict(zip(HEADERS, HEADERS))
+    if row_index - 2 < len(RECORDS):
+        return dict(zip(HEADERS, RECORDS[row_index - 2]))
+    return dict.fromkeys(HEADERS, '')
+
+
+def write_csv(path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        # Spreadsheet exports often start with a byte order mark
+        f.write('\ufeff')
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        writer.writerows(RECORDS)
+
+
+def write_sqlite(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE leads (company_name TEXT, email_to_use TEXT, notes TEXT)')
+    conn.executemany('INSERT INTO leads VALUES (?, ?, ?)', [[value or None for value in record] for record in RECORDS])
+    conn.commit()
+    conn.close()
+
+
+def write_parquet(path):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    table = pa.table({header: [record[i] for record in RECORDS] for i, header in enumerate(HEADERS)})
+    # Small row groups so a range spans several of them
+    pq.write_table(table, path, row_group_size=2)
+
+
+@pytest.fixture(params=['csv', 'sqlite', 'parquet'])
+def source(request, tmp_path):
+    if request.param == 'csv':
+        path = str(tmp_path / 'leads.csv')
+        write_csv(path)
+        source = CSVLeadSource(path)
+    elif request.param == 'sqlite':
+        path = str(tmp_path / 'leads.db')
+        write_sqlite(path)
+        source = SQLiteLeadSource(path)
+    else:
+        path = str(tmp_path / 'leads.parquet')
+        write_parquet(path)
+        source = ParquetLeadSource(path)
+    yield source
+    if hasattr(source, 'close'):
+        source.close()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 200])
+def test_rows_by_index(source, chunk_size):
+    rows = list(source.get_rows(1, 9, chunk_size=chunk_size))
+    assert [row_index for row_index, _ in rows] == list(range(1, 10))
+    assert [row for _, row in rows] == [expected(row_index) for row_index in range(1, 10)]
+
+
+def test_range_in_the_middle(source):
+    assert list(source.get_rows(4, 5)) == [(4, expected(4)), (5, expected(5))]
+    assert source.get_row_by_index(6) == expected(6)
+
+
+def test_rows_async(source):
+    async def collect():
+        return [row async for row in source.get_rows_async(2, 8, chunk_size=3)]
+    
+    assert asyncio.run(collect()) == [(row_index, expected(row_index)) for row_index in range(2, 9)]
+
+
+def test_test_connection(source):
+    assert source.test_connection()
+
+
+def test_csv_reindexes_a_changed_file(tmp_path):
+    path = str(tmp_path / 'leads.csv')
+    write_csv(path)
+    source = CSVLeadSource(path)
+    assert source.get_row_by_index(7) == expected(7)
+    
+    with open(path, 'a', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerow(['Hooli', 'gavin@hooli.com', ''])
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    
+    assert source.get_row_by_index(7) == dict(zip(HEADERS, ['Hooli', 'gavin@hooli.com', '']))
+    source.close()
+
+
+def test_sqlite_sees_rows_added_by_another_connection(tmp_path):
+    path = str(tmp_path / 'leads.db')
+    write_sqlite(path)
+    source = SQLiteLeadSource(path)
+    assert source.get_row_by_index(7) == expected(7)
+    
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO leads VALUES ('Hooli', 'gavin@hooli.com', NULL)")
+    conn.commit()
+    conn.close()
+    
+    assert source.get_row_by_index(7) == dict(zip(HEADERS, ['Hooli', 'gavin@hooli.com', '']))
+    source.close()
+
+
+def test_missing_sqlite_table(tmp_path):
+    path = str(tmp_path / 'leads.db')
+    write_sqlite(path)
+    source = SQLiteLeadSource(path, table='contacts')
+    with pytest.raises(Exception, match='contacts not found'):
+        source.test_connection()
+    source.close()
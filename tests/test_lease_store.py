@@ -0,0 +1,87 @@
+"""SQLiteLeaseStore: claims, lease expiry and fencing of workers that lost their lease"""
+import time
+
+import pytest
+
+from services.campaign_coordinator import plan_shards
+from services.lease_store import SHARD_DONE, SHARD_LEASED, SHARD_PENDING, SQLiteLeaseStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SQLiteLeaseStore(str(tmp_path / 'leases.db'))
+    yield store
+    store.close()
+
+
+def create(store, campaign_id='c1', start_row=2, end_row=31, shard_size=10):
+    return store.create_campaign(campaign_id, start_row, end_row, plan_shards(start_row, end_row, shard_size))
+
+
+def test_claims_shards_in_order_once(store):
+    create(store)
+    claimed = [store.claim('c1', f'worker-{i}', ttl=60) for i in range(4)]
+    
+    assert [shard['shard_index'] for shard in claimed[:3]] == [0, 1, 2]
+    assert [(shard['start_row'], shard['end_row']) for shard in claimed[:3]] == [(2, 11), (12, 21), (22, 31)]
+    assert all(shard['status'] == SHARD_LEASED and shard['token'] == 1 for shard in claimed[:3])
+    assert claimed[3] is None
+
+
+def test_expired_lease_is_reclaimed_with_a_new_token(store):
+    create(store, end_row=11)
+    first = store.claim('c1', 'worker-a', ttl=0.05)
+    assert store.heartbeat('c1', 0, 'worker-a', first['token'], ttl=0.05, progress=5)
+    assert store.claim('c1', 'worker-b', ttl=60) is None
+    
+    time.sleep(0.1)
+    second = store.claim('c1', 'worker-b', ttl=60)
+    
+    assert second['owner'] == 'worker-b'
+    assert second['token'] == first['token'] + 1
+    # The new owner continues after the last row the old one recorded
+    assert second['progress'] == 5
+
+
+def test_fencing_rejects_the_old_owner(store):
+    create(store, end_row=11)
+    first = store.claim('c1', 'worker-a', ttl=0.05)
+    time.sleep(0.1)
+    second = store.claim('c1', 'worker-b', ttl=60)
+    
+    assert not store.heartbeat('c1', 0, 'worker-a', first['token'], ttl=60, progress=9)
+    assert not store.finish('c1', 0, 'worker-a', first['token'], SHARD_DONE, counts={'sent': 10}, progress=11)
+    
+    shard = store.get_campaign('c1')['shards'][0]
+    assert (shard['owner'], shard['progress'], shard['counts']) == ('worker-b', None, {})
+    
+    assert store.finish('c1', 0, 'worker-b', second['token'], SHARD_DONE, counts={'sent': 10}, progress=11)
+    shard = store.get_campaign('c1')['shards'][0]
+    assert (shard['status'], shard['owner'], shard['counts']) == (SHARD_DONE, None, {'sent': 10})
+
+
+def test_released_shard_keeps_counts_across_attempts(store):
+    create(store, end_row=11)
+    first = store.claim('c1', 'worker-a', ttl=60)
+    assert store.finish('c1', 0, 'worker-a', first['token'], SHARD_PENDING, counts={'sent': 4}, progress=5)
+    second = store.claim('c1', 'worker-b', ttl=60)
+    assert store.finish('c1', 0, 'worker-b', second['token'], SHARD_DONE, counts={'sent': 6}, progress=11)
+    
+    campaign = store.get_campaign('c1')
+    assert campaign['shards'][0]['counts'] == {'sent': 10}
+    assert campaign['status'] == 'completed'
+
+
+def test_overlapping_campaigns(store):
+    create(store, 'c1', 2, 31)
+    with pytest.raises(Exception, match='overlap running campaign c1'):
+        create(store, 'c2', 30, 40)
+    assert store.overlapping_campaign(25, 26)['campaign_id'] == 'c1'
+    assert store.overlapping_campaign(32, 40) is None
+    
+    for _ in range(3):
+        shard = store.claim('c1', 'worker-a', ttl=60)
+        store.finish('c1', shard['shard_index'], 'worker-a', shard['token'], SHARD_DONE)
+    # A finished campaign no longer holds its rows
+    assert store.overlapping_campaign(25, 26) is None
+    create(store, 'c2', 30, 40)
@@ -0,0 +1,108 @@
+"""Counters, histograms and stage timings, and their Prometheus rendering at /metrics"""
+import pytest
+
+import app as app_module
+from services.metrics import EXTERNAL_CALL_ERRORS, MetricsRegistry, StageTimings, percentile, timed_call
+
+
+def test_counter_series_by_label():
+    registry = MetricsRegistry()
+    counter = registry.counter('test_rows_total', 'Rows by outcome', ('status',))
+    counter.inc(status='sent')
+    counter.inc(2, status='sent')
+    counter.inc(status='say "hi"\n')
+    
+    assert counter.value(status='sent') == 3
+    assert registry.render().splitlines() == [
+        '# HELP test_rows_total Rows by outcome',
+        '# TYPE test_rows_total counter',
+        'test_rows_total{status="say \\"hi\\"\\n"} 1',
+        'test_rows_total{status="sent"} 3',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('test_seconds', 'Call time', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value)
+    
+    assert histogram.render() == [
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1.0"} 3',
+        'test_seconds_bucket{le="+Inf"} 4',
+        'test_seconds_sum 3.65',
+        'test_seconds_count 4',
+    ]
+
+
+def test_collector_samples_are_rendered():
+    registry = MetricsRegistry()
+    registry.add_collector(lambda: [
+        ('test_limit_calls_total', 'counter', 'Calls', {'service': 'openai'}, 5),
+        ('test_limit_calls_total', 'counter', 'Calls', {'service': 'smtp'}, 2),
+    ])
+    assert registry.render().splitlines() == [
+        '# HELP test_limit_calls_total Calls',
+        '# TYPE test_limit_calls_total counter',
+        'test_limit_calls_total{service="openai"} 5',
+        'test_limit_calls_total{service="smtp"} 2',
+    ]
+
+
+def test_timed_call_counts_errors():
+    before = EXTERNAL_CALL_ERRORS.value(service='test', operation='fail')
+    
+    def fail():
+        raise ValueError('boom')
+    
+    with pytest.raises(ValueError):
+        timed_call('test', 'fail', fail)
+    assert timed_call('test', 'ok', lambda: 7) == 7
+    assert EXTERNAL_CALL_ERRORS.value(service='test', operation='fail') == before + 1
+
+
+def test_stage_timings_summary():
+    timings = StageTimings()
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        timings.observe('send', seconds)
+    
+    send = timings.summary()['send']
+    assert (send['count'], send['total_seconds'], send['mean_seconds'], send['max_seconds']) == (4, 1.0, 0.25, 0.4)
+
+
+def test_stage_timings_keep_a_bounded_sample():
+    timings = StageTimings(max_samples=100)
+    timings._random.seed(1)
+    for i in range(1, 10001):
+        timings.observe('send', i / 1000)
+    
+    assert len(timings._stages['send']['samples']) == 100
+    send = timings.summary()['send']
+    # Count, total and max are exact; the median is estimated from the sample
+    assert (send['count'], send['total_seconds'], send['max_seconds']) == (10000, 50005.0, 10.0)
+    assert 3.0 < send['p50_seconds'] < 7.0
+
+
+@pytest.mark.parametrize('values, fraction, expected', [
+    (list(range(1, 11)), 0.50, 5),
+    (list(range(1, 11)), 0.30, 3),
+    (list(range(1, 11)), 0.95, 10),
+    (list(range(1, 11)), 0.0, 1),
+    (list(range(1, 10)), 0.50, 5),
+    ([7], 0.99, 7),
+    ([], 0.5, 0.0),
+])
+def test_nearest_rank_percentile(values, fraction, expected):
+    assert percentile(values, fraction) == expected
+
+
+def test_metrics_route():
+    timed_call('test', 'route', lambda: None)
+    response = app_module.app.test_client().get('/metrics')
+    
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert '# TYPE outreach_external_call_seconds histogram' in body
+    assert 'outreach_external_call_seconds_count{service="test",operation="route"} 1' in body
@@ -0,0 +1,59 @@
+"""Strict parsing of multi-lead answers: only emails that match their requested row are kept"""
+import json
+
+import pytest
+
+from services.outreach_agent import OutreachAgent
+
+ROWS = [
+    (2, {'company_name': 'Acme', 'email_to_use': 'jane@acme.com'}),
+    (3, {'company_name': 'Globex', 'email_to_use': 'Hank@Globex.com'}),
+    (4, {'company_name': 'Initech', 'email_to_use': 'bill@initech.com'}),
+]
+
+
+@pytest.fixture
+def agent():
+    return OutreachAgent(None, None, None, None)
+
+
+def entry(row, to, subject='Hello', body='<p>Hi</p>'):
+    return {'row': row, 'to': to, 'subject': subject, 'emailBody': body}
+
+
+def answer(*entries):
+    return json.dumps({'emails': list(entries)})
+
+
+def test_keeps_every_matching_email(agent):
+    response = '```json\n' + answer(
+        entry(2, 'jane@acme.com'), entry(3, 'hank@globex.com'), entry(4, 'bill@initech.com')
+    ) + '\n```'
+    emails = agent._parse_emails(response, ROWS)
+    assert sorted(emails) == [2, 3, 4]
+    assert emails[3] == {'to': 'hank@globex.com', 'subject': 'Hello', 'emailBody': '<p>Hi</p>'}
+
+
+def test_drops_entries_that_cannot_be_trusted(agent):
+    emails = agent._parse_emails(answer(
+        # Addressed to another row's recipient
+        entry(2, 'hank@globex.com'),
+        # Empty subject
+        entry(3, 'hank@globex.com', subject=' '),
+        # Not a requested row, and a row number given as a string
+        entry(5, 'x@acme.com'),
+        entry('4', 'bill@initech.com'),
+    ), ROWS)
+    assert emails == {}
+
+
+def test_row_answered_twice_is_dropped(agent):
+    emails = agent._parse_emails(answer(
+        entry(2, 'jane@acme.com'), entry(2, 'jane@acme.com', subject='Other'), entry(4, 'bill@initech.com')
+    ), ROWS)
+    assert sorted(emails) == [4]
+
+
+@pytest.mark.parametrize('response', ['not json', '[]', '{"emails": {}}', '{"email": []}'])
+def test_malformed_answer_yields_nothing(agent, response):
+    assert agent._parse_emails(response, ROWS) == {}
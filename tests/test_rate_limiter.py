@@ -0,0 +1,102 @@
+"""TokenBucket, retry classification and RateLimiter backoff"""
+import smtplib
+
+import pytest
+
+from services.rate_limiter import RateLimiter, TokenBucket, is_retryable, retry_after
+
+
+class StatusError(Exception):
+    """An HTTP error the way OpenAI and httpx report it: a status and response headers"""
+    
+    def __init__(self, status, headers=None, code=None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = type('Response', (), {'headers': headers or {}})()
+        self.code = code
+
+
+def failing(errors, result='ok'):
+    """A function raising each of ``errors`` on successive calls, then returning ``result``"""
+    errors = list(errors)
+    calls = []
+    
+    def func():
+        calls.append(1)
+        if errors:
+            raise errors.pop(0)
+        return result
+    
+    func.calls = calls
+    return func
+
+
+def test_bucket_allows_a_burst_then_throttles():
+    bucket = TokenBucket(rate=50, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert 0 < bucket.acquire() <= 0.03
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(rate=0)
+    assert all(bucket.acquire() == 0 for _ in range(100))
+
+
+@pytest.mark.parametrize('error, retryable', [
+    (StatusError(429), True),
+    (StatusError(503), True),
+    (StatusError(400), False),
+    (StatusError(429, code='insufficient_quota'), False),
+    (smtplib.SMTPResponseException(421, b'busy'), True),
+    (smtplib.SMTPResponseException(550, b'no such user'), False),
+    (smtplib.SMTPServerDisconnected(), True),
+    (ValueError('bad row'), False),
+])
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) == retryable
+
+
+def test_socket_timeouts_are_retryable():
+    assert is_retryable(TimeoutError('timed out'))
+    assert is_retryable(ConnectionResetError())
+
+
+def test_backoff_honours_retry_after():
+    limiter = RateLimiter('test', max_delay=10)
+    assert retry_after(StatusError(429, {'retry-after': '3'})) == 3
+    assert limiter.backoff_delay(1, StatusError(429, {'retry-after': '3'})) == 3
+    # Capped at max_delay
+    assert limiter.backoff_delay(1, StatusError(429, {'retry-after': '120'})) == 10
+    # Without the header: full jitter below base_delay * 2^(attempt - 1)
+    assert 0 <= limiter.backoff_delay(3, StatusError(503)) <= 4
+
+
+def test_call_retries_transient_errors():
+    limiter = RateLimiter('test', max_retries=3, base_delay=0)
+    func = failing([StatusError(503), StatusError(429, {'retry-after': '0'})])
+    
+    assert limiter.call(func) == 'ok'
+    assert len(func.calls) == 3
+    stats = limiter.stats()
+    assert (stats['calls'], stats['retries'], stats['rate_limited'], stats['failures']) == (3, 2, 1, 0)
+
+
+def test_call_gives_up_after_max_retries():
+    limiter = RateLimiter('test', max_retries=2, base_delay=0)
+    func = failing([StatusError(503)] * 5)
+    
+    with pytest.raises(StatusError):
+        limiter.call(func)
+    assert len(func.calls) == 3
+    assert limiter.stats()['failures'] == 1
+
+
+def test_call_raises_other_errors_at_once():
+    limiter = RateLimiter('test', base_delay=0)
+    func = failing([StatusError(401)])
+    
+    with pytest.raises(StatusError):
+        limiter.call(func)
+    assert len(func.calls) == 1
+    assert limiter.stats()['retries'] == 0
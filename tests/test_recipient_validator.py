@@ -0,0 +1,91 @@
+"""RecipientValidator syntax, disposable-domain and MX checks against a stub resolver"""
+import threading
+import time
+
+import pytest
+
+from fakes.dns_resolver import StubResolver
+from services.recipient_validator import RecipientValidator, split_address
+
+
+@pytest.fixture
+def resolver():
+    return StubResolver({'nomail.example': []}, failing=['flaky.example'])
+
+
+@pytest.fixture
+def validator(resolver):
+    validator = RecipientValidator(resolver=resolver, disposable_domains=['mailinator.com'])
+    yield validator
+    validator.close()
+
+
+@pytest.mark.parametrize('email', ['', 'n/a', 'jane@', '@acme.com', 'jane..doe@acme.com', 'jane@acme', 'jane@-acme.com'])
+def test_syntax(email):
+    assert split_address(email) is None
+    assert RecipientValidator(disposable_domains=[]).validate(email) == 'syntax'
+
+
+def test_reasons(validator):
+    reasons = validator.validate_many([
+        'Jane@Acme.com', 'bob@mailinator.com', 'bob@eu.mailinator.com', 'ops@nomail.example', 'x@flaky.example'
+    ])
+    assert reasons == {
+        'Jane@Acme.com': None,
+        'bob@mailinator.com': 'disposable',
+        'bob@eu.mailinator.com': 'disposable',
+        'ops@nomail.example': 'no_mail_server',
+        # A failed lookup lets the address through
+        'x@flaky.example': None,
+    }
+
+
+def test_one_lookup_per_domain_within_the_ttl(validator, resolver):
+    counts = {}
+    validator.validate_many(['a@acme.com', 'b@acme.com', 'c@globex.com'], counts)
+    validator.validate_many(['d@acme.com'], counts)
+    
+    assert resolver.lookups == {'acme.com': 1, 'globex.com': 1}
+    assert counts == {'domains': 3, 'lookups': 2, 'cache_hits': 1}
+
+
+def test_cache_entries_expire(resolver):
+    validator = RecipientValidator(resolver=resolver, disposable_domains=[], cache_ttl=0.05, error_ttl=0.05)
+    counts = {}
+    validator.validate_many(['a@acme.com', 'b@flaky.example'], counts)
+    time.sleep(0.1)
+    validator.validate_many(['a@acme.com', 'b@flaky.example'], counts)
+    validator.close()
+    
+    assert resolver.lookups == {'acme.com': 2, 'flaky.example': 2}
+    assert counts['lookup_errors'] == 2
+
+
+def test_failed_lookup_is_retried_sooner(resolver):
+    validator = RecipientValidator(resolver=resolver, disposable_domains=[], cache_ttl=60, error_ttl=0.05)
+    validator.validate_many(['a@acme.com', 'b@flaky.example'])
+    time.sleep(0.1)
+    validator.validate_many(['a@acme.com', 'b@flaky.example'])
+    validator.close()
+    
+    assert resolver.lookups == {'acme.com': 1, 'flaky.example': 2}
+
+
+def test_concurrent_callers_share_a_lookup():
+    resolver = StubResolver(latency=0.1)
+    validator = RecipientValidator(resolver=resolver, disposable_domains=[])
+    threads = [threading.Thread(target=validator.validate, args=(f'lead{i}@acme.com',)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    validator.close()
+    
+    assert resolver.lookups == {'acme.com': 1}
+
+
+def test_cache_size_is_bounded(resolver):
+    validator = RecipientValidator(resolver=resolver, disposable_domains=[], cache_size=2)
+    validator.validate_many(['a@one.example', 'b@two.example', 'c@three.example'])
+    assert validator.stats() == {'cached_domains': 2, 'inflight_lookups': 0}
+    validator.close()
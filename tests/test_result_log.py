@@ -0,0 +1,95 @@
+"""ResultLog writing and read_result_log paging"""
+import json
+
+import pytest
+
+from services.result_log import ResultLog, at_line_boundary, read_result_log
+
+
+def write_log(path, count, error_every=0):
+    log = ResultLog(str(path))
+    for row in range(2, count + 2):
+        status = 'error' if error_every and row % error_every == 0 else 'sent'
+        log.append({'row': row, 'status': status})
+    log.close()
+
+
+def test_pages_follow_the_cursor(tmp_path):
+    path = tmp_path / 'run.jsonl'
+    write_log(path, 25)
+    
+    rows = []
+    cursor = 0
+    pages = 0
+    while True:
+        page = read_result_log(str(path), cursor=cursor, limit=10)
+        rows += [entry['row'] for entry in page['entries']]
+        cursor = page['next_cursor']
+        pages += 1
+        if page['end']:
+            break
+    
+    assert rows == list(range(2, 27))
+    assert pages == 3
+    assert all('at' in entry for entry in read_result_log(str(path))['entries'])
+
+
+def test_status_filter(tmp_path):
+    path = tmp_path / 'run.jsonl'
+    write_log(path, 30, error_every=10)
+    page = read_result_log(str(path), status='error')
+    assert [entry['row'] for entry in page['entries']] == [10, 20, 30]
+    assert page['end']
+
+
+def test_filtered_page_stops_at_the_scan_limit(tmp_path):
+    path = tmp_path / 'run.jsonl'
+    write_log(path, 200, error_every=150)
+    
+    page = read_result_log(str(path), status='error', max_scan_bytes=2000)
+    assert page['entries'] == []
+    assert not page['end']
+    # The page ends on the first line boundary past the limit
+    assert 2000 <= page['next_cursor'] < 2100
+    
+    rows = []
+    cursor = 0
+    while True:
+        page = read_result_log(str(path), cursor=cursor, status='error', max_scan_bytes=2000)
+        rows += [entry['row'] for entry in page['entries']]
+        cursor = page['next_cursor']
+        if page['end']:
+            break
+    assert rows == [150]
+
+
+def test_torn_last_line_is_not_served_and_reopening_starts_a_new_one(tmp_path):
+    path = tmp_path / 'run.jsonl'
+    write_log(path, 2)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"row": 4, "sta')
+    
+    page = read_result_log(str(path))
+    assert [entry['row'] for entry in page['entries']] == [2, 3]
+    assert page['end']
+    
+    log = ResultLog(str(path))
+    log.append({'row': 5, 'status': 'sent'})
+    log.close()
+    # The torn line is skipped, the new entry is served
+    page = read_result_log(str(path), cursor=page['next_cursor'])
+    assert [entry['row'] for entry in page['entries']] == [5]
+    assert json.loads(path.read_text(encoding='utf-8').splitlines()[-1])['row'] == 5
+
+
+@pytest.mark.parametrize('content, expected', [
+    (None, True),
+    ('', True),
+    ('{"row": 2}\n', True),
+    ('{"row": 2}\n{"ro', False),
+])
+def test_at_line_boundary(tmp_path, content, expected):
+    path = tmp_path / 'run.jsonl'
+    if content is not None:
+        path.write_text(content, encoding='utf-8')
+    assert at_line_boundary(str(path)) == expected
@@ -0,0 +1,193 @@
+"""SendLedger lookups and per-recipient reservations"""
+import json
+import re
+import time
+import threading
+
+import pytest
+
+from fakes.smtp_sink import SMTPSink
+from services.email_service import EmailService
+from services.outreach_agent import OutreachAgent
+from services.send_ledger import SendLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = SendLedger(str(tmp_path / 'send_ledger.db'))
+    yield ledger
+    ledger.close()
+
+
+def test_contacted_by_address_or_row_content(ledger):
+    ledger.record(' Jane@Acme.com ', 'hash-a', 2, 'sent', 'Hi')
+    ledger.record('bob@acme.com', 'hash-b', 3, 'failed', 'Hi')
+    ledger.record('old@acme.com', 'hash-c', 4, 'sent', 'Hi')
+    
+    contacted = ledger.contacted([
+        ('jane@acme.com', 'hash-x'),
+        ('bob@acme.com', 'hash-b'),
+        ('new@acme.com', 'hash-c'),
+        ('new@acme.com', 'hash-y')
+    ])
+    
+    assert contacted == {('jane@acme.com', 'hash-x'), ('new@acme.com', 'hash-c')}
+
+
+def test_contacted_batches_large_lookups(ledger):
+    for i in range(1000):
+        ledger.record(f'lead{i}@acme.com', f'hash-{i}', i, 'sent')
+    entries = [(f'lead{i}@acme.com', f'other-{i}') for i in range(0, 2000, 2)]
+    assert len(ledger.contacted(entries)) == 500
+
+
+def test_reserve_is_exclusive_until_recorded(ledger):
+    assert ledger.reserve('jane@acme.com', 'hash-a', 2)
+    assert not ledger.reserve('JANE@acme.com', 'hash-b', 3)
+    assert not ledger.reserve('other@acme.com', 'hash-a', 4)
+    
+    # A failed attempt releases the recipient for a later try
+    ledger.record('jane@acme.com', 'hash-a', 2, 'failed')
+    assert ledger.reserve('jane@acme.com', 'hash-a', 2)
+    ledger.record('jane@acme.com', 'hash-a', 2, 'sent')
+    assert not ledger.reserve('jane@acme.com', 'hash-z', 5)
+
+
+def test_uncertain_send_counts_as_contacted(ledger):
+    ledger.record('jane@acme.com', 'hash-a', 2, 'uncertain')
+    assert ledger.contacted([('jane@acme.com', 'hash-x')]) == {('jane@acme.com', 'hash-x')}
+    assert not ledger.reserve('jane@acme.com', 'hash-x', 2)
+    assert not ledger.reserve('other@acme.com', 'hash-a', 3)
+
+
+def test_abandoned_reservation_expires(tmp_path):
+    ledger = SendLedger(str(tmp_path / 'send_ledger.db'), reservation_ttl=0.05)
+    assert ledger.reserve('jane@acme.com', 'hash-a')
+    assert not ledger.reserve('jane@acme.com', 'hash-a')
+    time.sleep(0.1)
+    assert ledger.reserve('jane@acme.com', 'hash-a')
+    ledger.close()
+
+
+def test_one_winner_across_connections(tmp_path):
+    path = str(tmp_path / 'send_ledger.db')
+    ledgers = [SendLedger(path) for _ in range(4)]
+    wins = []
+    barrier = threading.Barrier(len(ledgers))
+    
+    def race(ledger):
+        barrier.wait()
+        for i in range(50):
+            if ledger.reserve(f'lead{i}@acme.com', f'hash-{i}', i):
+                wins.append(i)
+    
+    threads = [threading.Thread(target=race, args=(ledger,)) for ledger in ledgers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for ledger in ledgers:
+        ledger.close()
+    
+    assert sorted(wins) == list(range(50))
+
+
+class Stub:
+    """A service with nothing to close"""
+    
+    async def aclose(self):
+        pass
+
+
+class Leads(Stub):
+    def get_rows(self, start_row, end_row, **kwargs):
+        for row_index in range(start_row, end_row + 1):
+            yield row_index, {'CompanyName': f'Company {row_index}', 'email_to_use': f'owner{row_index}@acme.com'}
+    
+    async def get_rows_async(self, start_row, end_row, **kwargs):
+        for row in self.get_rows(start_row, end_row):
+            yield row
+
+
+class KnowledgeBase(Stub):
+    def get_document(self):
+        return 'We build AI automations for small businesses.'
+    
+    async def get_document_async(self):
+        return self.get_document()
+
+
+class EchoAI(Stub):
+    """Writes each email to the row's own address, without any API"""
+    
+    model = 'echo'
+    
+    def generate_email(self, prompt, **kwargs):
+        to = re.search(r'"email_to_use": "([^"]+)"', prompt).group(1)
+        return json.dumps({'to': to, 'subject': 'Hello', 'emailBody': '<p>Hi</p>'})
+    
+    async def generate_email_async(self, prompt, **kwargs):
+        return self.generate_email(prompt, **kwargs)
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    """Local SMTP sink that EmailService() sends to"""
+    sink = SMTPSink()
+    sink.start()
+    monkeypatch.setenv('SMTP_HOST', sink.host)
+    monkeypatch.setenv('SMTP_PORT', str(sink.port))
+    monkeypatch.setenv('SMTP_USER', 'user')
+    monkeypatch.setenv('SMTP_PASSWORD', 'secret')
+    monkeypatch.setenv('SMTP_STARTTLS', 'false')
+    monkeypatch.setenv('OUTREACH_RESULT_LOG_ENABLED', 'false')
+    yield sink
+    sink.stop()
+
+
+@pytest.mark.parametrize('mode', ['sequential', 'async'])
+def test_rerun_does_not_resend_after_a_drop_past_data(tmp_path, sink, mode):
+    ledger = SendLedger(str(tmp_path / 'send_ledger.db'))
+    agent = OutreachAgent(Leads(), KnowledgeBase(), EchoAI(), EmailService(), ledger=ledger)
+    
+    # The server takes the first message, then hangs up before replying to DATA
+    sink.drop('DATA')
+    first = agent.execute(2, 4, mode=mode)
+    second = agent.execute(2, 4, mode=mode)
+    ledger.close()
+    
+    assert (first['sent'], first['error_count']) == (2, 1)
+    assert (second['sent'], second['skipped']) == (0, 3)
+    assert sink.messages == 3
+
+
+class ThreadRecordingLedger(SendLedger):
+    """SendLedger noting the thread of each lookup, reservation and record"""
+    
+    def __init__(self, path):
+        super().__init__(path)
+        self.threads = set()
+    
+    def contacted(self, entries):
+        self.threads.add(threading.get_ident())
+        return super().contacted(entries)
+    
+    def reserve(self, email, row_hash, row_index=None):
+        self.threads.add(threading.get_ident())
+        return super().reserve(email, row_hash, row_index)
+    
+    def record(self, email, row_hash, row_index, status, subject=None):
+        self.threads.add(threading.get_ident())
+        return super().record(email, row_hash, row_index, status, subject)
+
+
+def test_async_mode_keeps_ledger_calls_off_the_event_loop(tmp_path, sink):
+    ledger = ThreadRecordingLedger(str(tmp_path / 'send_ledger.db'))
+    agent = OutreachAgent(Leads(), KnowledgeBase(), EchoAI(), EmailService(), ledger=ledger)
+    
+    # execute() runs the event loop in the calling thread
+    results = agent.execute(2, 6, mode='async')
+    ledger.close()
+    
+    assert results['sent'] == 5
+    assert ledger.threads and threading.get_ident() not in ledger.threads
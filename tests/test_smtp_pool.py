@@ -0,0 +1,153 @@
+"""SMTPConnectionPool and AsyncSMTPConnectionPool against the local SMTP sink"""
+import asyncio
+import threading
+from email.mime.text import MIMEText
+
+import pytest
+
+from fakes.smtp_sink import SMTPSink
+from services.email_service import (
+    AsyncSMTPConnectionPool, EmailService, SMTPConnectionPool, SMTPDeliveryUncertain
+)
+
+
+@pytest.fixture
+def sink():
+    sink = SMTPSink()
+    sink.start()
+    yield sink
+    sink.stop()
+
+
+@pytest.fixture
+def email_service(sink, monkeypatch):
+    monkeypatch.setenv('SMTP_HOST', sink.host)
+    monkeypatch.setenv('SMTP_PORT', str(sink.port))
+    monkeypatch.setenv('SMTP_USER', 'user')
+    monkeypatch.setenv('SMTP_PASSWORD', 'secret')
+    monkeypatch.setenv('SMTP_STARTTLS', 'false')
+    return EmailService()
+
+
+def message(to='lead@example.com'):
+    msg = MIMEText('<p>Hello</p>', 'html')
+    msg['Subject'] = 'Hello'
+    msg['From'] = 'sender@example.com'
+    msg['To'] = to
+    return msg
+
+
+def test_reuses_one_connection(sink, email_service):
+    pool = SMTPConnectionPool(email_service._connect, size=1)
+    for _ in range(5):
+        pool.send_message(message())
+    pool.close()
+    
+    assert sink.messages == 5
+    assert sink.connections == 1
+
+
+def test_recycles_after_max_messages(sink, email_service):
+    pool = SMTPConnectionPool(email_service._connect, size=1, max_messages=2)
+    for _ in range(5):
+        pool.send_message(message())
+    pool.close()
+    
+    assert sink.messages == 5
+    assert sink.connections == 3
+
+
+def test_never_opens_more_than_size(sink, email_service):
+    pool = SMTPConnectionPool(email_service._connect, size=3)
+    threads = [threading.Thread(target=pool.send_message, args=(message(),)) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+    
+    assert sink.messages == 20
+    assert sink.connections <= 3
+
+
+def test_grow_raises_the_limit_only(email_service):
+    pool = SMTPConnectionPool(email_service._connect, size=2)
+    pool.grow(4)
+    pool.grow(1)
+    assert pool.size == 4
+
+
+def test_resends_when_dropped_before_data(sink, email_service):
+    pool = SMTPConnectionPool(email_service._connect, size=1)
+    pool.send_message(message())
+    sink.drop('MAIL')
+    pool.send_message(message())
+    pool.close()
+    
+    assert sink.messages == 2
+    assert sink.connections == 2
+
+
+def test_does_not_resend_when_dropped_after_data(sink, email_service):
+    pool = SMTPConnectionPool(email_service._connect, size=1)
+    sink.drop('DATA')
+    with pytest.raises(SMTPDeliveryUncertain):
+        pool.send_message(message())
+    # The broken connection gave its slot back
+    pool.send_message(message())
+    pool.close()
+    
+    assert sink.messages == 2
+
+
+def test_stale_connection_is_replaced(sink, email_service):
+    pool = SMTPConnectionPool(email_service._connect, size=1, keepalive_interval=0)
+    pool.send_message(message())
+    conn = pool._idle.get_nowait()
+    conn.server.close()
+    pool._idle.put(conn)
+    pool.send_message(message())
+    pool.close()
+    
+    assert sink.messages == 2
+    assert sink.connections == 2
+
+
+def test_closed_pool_refuses_sends(email_service):
+    pool = SMTPConnectionPool(email_service._connect)
+    pool.close()
+    with pytest.raises(Exception, match='closed'):
+        pool.send_message(message())
+
+
+def test_async_pool_drops(sink, email_service):
+    async def run():
+        pool = AsyncSMTPConnectionPool(email_service._connect_async, size=2)
+        await asyncio.gather(*[pool.send_message(message()) for _ in range(6)])
+        sink.drop('MAIL')
+        await pool.send_message(message())
+        sink.drop('DATA')
+        with pytest.raises(SMTPDeliveryUncertain):
+            await pool.send_message(message())
+        await pool.close()
+    
+    asyncio.run(run())
+    assert sink.messages == 8
+
+
+def test_async_sessions_are_per_event_loop(sink, email_service):
+    async def job(count):
+        async with email_service.async_session(pool_size=2):
+            await asyncio.gather(*[
+                email_service.send_email_async(f'lead{i}@example.com', 'Hello', '<p>Hi</p>') for i in range(count)
+            ])
+    
+    threads = [threading.Thread(target=asyncio.run, args=(job(10),)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert sink.messages == 30
+    assert sink.connections <= 6
+    assert email_service._async_pools == {}